@@ -416,9 +416,9 @@ private:
 		_bufferRegister[4] = valueLen; // data width in bytes
 		
 		// address
-		_bufferRegister[5] = (address > 24) & 0xff;
-		_bufferRegister[6] = (address > 16) & 0xff;
-		_bufferRegister[7] = (address > 8) & 0xff;
+		_bufferRegister[5] = (address >> 24) & 0xff;
+		_bufferRegister[6] = (address >> 16) & 0xff;
+		_bufferRegister[7] = (address >> 8) & 0xff;
 		_bufferRegister[8] = address & 0xff;
 		
 		// page address
@@ -428,9 +428,9 @@ private:
 		_bufferRegister[12] = 0x01;
 		
 		// value
-		_bufferRegister[13] = (value > 24) & 0xff;
-		_bufferRegister[14] = (value > 16) & 0xff;
-		_bufferRegister[15] = (value > 8) & 0xff;
+		_bufferRegister[13] = (value >> 24) & 0xff;
+		_bufferRegister[14] = (value >> 16) & 0xff;
+		_bufferRegister[15] = (value >> 8) & 0xff;
 		_bufferRegister[16] = value & 0xff;
 	}
 };
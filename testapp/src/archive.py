@@ -0,0 +1,505 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from collections import deque
+from enum import Enum
+import threading
+import traceback
+import logging
+import struct
+import zlib
+import lzma
+
+import numpy as np
+from frame import Frame
+
+
+class ArchivePredictor(Enum):
+    """Prediction applied to frames before compressing."""
+    Off = 0
+    """Store pixel values."""
+    Frame = 1
+    """Store difference to the same pixel in the previous frame. Best
+    for mostly static scenes."""
+    Row = 2
+    """Store difference to the left neighbor pixel. Best for scenes
+    with a lot of motion."""
+
+
+class ArchiveCodec(Enum):
+    """Compression of chunks."""
+    Zlib = 0
+    """Fast compression using zlib."""
+    Lzma = 1
+    """Strong but slow compression using lzma. Too slow to keep up
+    with capturing at 60Hz. Use it to recompress archives offline."""
+
+
+class _Format:
+    """Binary layout of session archives.
+
+    File: header, chunks, index, footer. Each chunk is a chunk header,
+    the frame timestamps (float64), the frame sequence numbers (int64)
+    and the compressed frames. The index repeats the chunk headers with
+    their file offsets. Without footer, for example if writing has been
+    interrupted, chunks are found by scanning the chunk headers.
+    """
+    MAGIC = b'VFTA'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHBBHHI')
+    """Magic, version, predictor, codec, width, height, chunk frames."""
+    CHUNK = struct.Struct('<4sIQI')
+    """Magic, frame count, first frame index, compressed size."""
+    CHUNK_MAGIC = b'CHNK'
+    INDEX = struct.Struct('<QQI')
+    """Offset of chunk header, first frame index, frame count."""
+    FOOTER = struct.Struct('<QI4s')
+    """Offset of index, number of chunks, magic."""
+
+
+def _predict(frames: np.ndarray, predictor: ArchivePredictor
+             ) -> np.ndarray:
+    """Replace frames by prediction residuals wrapping around at 256."""
+    if predictor == ArchivePredictor.Frame:
+        np.subtract(frames[1:], frames[:-1], out=frames[1:])
+    elif predictor == ArchivePredictor.Row:
+        np.subtract(frames[:, :, 1:], frames[:, :, :-1],
+                    out=frames[:, :, 1:])
+    return frames
+
+
+def _reconstruct(residuals: np.ndarray, predictor: ArchivePredictor
+                 ) -> np.ndarray:
+    """Reverse "_predict()"."""
+    if predictor == ArchivePredictor.Frame:
+        return np.cumsum(residuals, axis=0, dtype=np.uint8)
+    if predictor == ArchivePredictor.Row:
+        return np.cumsum(residuals, axis=2, dtype=np.uint8)
+    return residuals
+
+
+class SessionWriter:
+    """Writes grayscale frames to a compressed lossless archive.
+
+    Stores only the luma plane as produced by "OutputFormat.Gray8".
+    Compared to raw YUYV this halves the size before compression.
+    Frames are collected into chunks. Each chunk is filtered using the
+    predictor and compressed on a background thread. Chunks are
+    independent of each other hence "SessionReader" can decode any
+    frame range by decoding only the chunks containing it.
+
+    "write()" copies the frame into the current chunk. If more than
+    "max_pending" chunks wait for compression it blocks until one is
+    written. Nothing is dropped. Use "write_frame()" with a queued
+    subscription to not block the capturing:
+    ftcamera.subscribe(writer.write_frame, OutputFormat.Gray8,
+                       policy=FTCamera.QueuePolicy.DropNewest,
+                       queue_size=8)
+
+    Call "close()" to write the remaining frames and the chunk index.
+    """
+
+    _logger = logging.getLogger("evcta.SessionWriter")
+
+    def __init__(self: 'SessionWriter', path: str, width: int, height: int,
+                 chunk_frames: int = 60,
+                 predictor: ArchivePredictor = ArchivePredictor.Frame,
+                 codec: ArchiveCodec = ArchiveCodec.Zlib,
+                 level: int | None = None, max_pending: int = 4) -> None:
+        """Create archive.
+
+        Keyword arguments:
+        path --- Path of archive file. Overwritten if present
+        width --- Width of frames in pixels
+        height --- Height of frames in pixels
+        chunk_frames --- Number of frames per chunk. Larger chunks
+                         compress better but decoding a single frame
+                         decodes the entire chunk
+        predictor --- Prediction applied before compressing
+        codec --- Compression of chunks
+        level --- Compression level or None for a fast level
+        max_pending --- Maximum number of chunks waiting for compression
+        """
+        self._width = width
+        self._height = height
+        self._chunk_frames = chunk_frames
+        self._predictor = predictor
+        self._codec = codec
+        self._level = level
+        self._file = open(path, 'wb')
+        self._file.write(_Format.HEADER.pack(
+            _Format.MAGIC, _Format.VERSION, predictor.value, codec.value,
+            width, height, chunk_frames))
+        self._index: "list[tuple[int, int, int]]" = []
+        self._free: deque = deque(
+            np.empty([chunk_frames, height, width], dtype=np.uint8)
+            for _ in range(max_pending + 1))
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._chunk: np.ndarray = None
+        self._timestamps = np.zeros([chunk_frames], dtype=np.float64)
+        self._sequences = np.zeros([chunk_frames], dtype=np.int64)
+        self._count = 0
+        self._error: Exception = None
+        self._closed = False
+        self.frames: int = 0
+        """Number of frames written."""
+        self.stored_bytes: int = 0
+        """Number of compressed bytes written so far."""
+        self._stored_frames = 0
+        self._thread = threading.Thread(
+            target=self._run, name="SessionWriter", daemon=True)
+        self._thread.start()
+
+    @property
+    def ratio(self: 'SessionWriter') -> float:
+        """Compression ratio of compressed frames relative to raw YUYV."""
+        if not self.stored_bytes:
+            return 0.0
+        return self._stored_frames * self._width * self._height * 2\
+            / self.stored_bytes
+
+    def write(self: 'SessionWriter', image: np.ndarray,
+              timestamp: float = 0.0, sequence: int | None = None) -> None:
+        """Add frame.
+
+        Throws "Exception" if writing a previous chunk failed.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+        timestamp --- Capture time in seconds
+        sequence --- Sequence number or None to use the frame index
+        """
+        if self._error:
+            raise Exception("Writing archive failed: {}".format(
+                self._error))
+        if self._chunk is None:
+            with self._condition:
+                while not self._free:
+                    self._condition.wait()
+                self._chunk = self._free.popleft()
+            self._timestamps = np.zeros_like(self._timestamps)
+            self._sequences = np.zeros_like(self._sequences)
+
+        np.copyto(self._chunk[self._count], image)
+        self._timestamps[self._count] = timestamp
+        self._sequences[self._count] = self.frames\
+            if sequence is None else sequence
+        self._count += 1
+        self.frames += 1
+        if self._count == self._chunk_frames:
+            self._submit()
+
+    def write_frame(self: 'SessionWriter', frame: Frame) -> None:
+        """Add frame with timestamp and sequence number.
+
+        Suitable as subscription callback.
+
+        Keyword arguments:
+        frame --- Frame in "OutputFormat.Gray8"
+        """
+        self.write(frame.data, frame.timestamp, frame.sequence)
+
+    def close(self: 'SessionWriter') -> None:
+        """Write remaining frames and the chunk index then close file.
+
+        Throws "Exception" if writing failed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._count:
+            self._submit()
+        with self._condition:
+            self._queue.append(None)
+            self._condition.notify()
+        self._thread.join()
+        try:
+            if not self._error:
+                self._write_index()
+        finally:
+            self._file.close()
+        if self._error:
+            raise Exception("Writing archive failed: {}".format(
+                self._error))
+
+    def __enter__(self: 'SessionWriter') -> 'SessionWriter':
+        return self
+
+    def __exit__(self: 'SessionWriter', *args) -> None:
+        self.close()
+
+    def _submit(self: 'SessionWriter') -> None:
+        """Queue current chunk for compression."""
+        first = self.frames - self._count
+        with self._condition:
+            self._queue.append((self._chunk, self._count, first,
+                                self._timestamps, self._sequences))
+            self._condition.notify()
+        self._chunk = None
+        self._count = 0
+
+    def _run(self: 'SessionWriter') -> None:
+        """Background thread compressing and writing chunks."""
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                item = self._queue[0]
+            if item is None:
+                return
+            chunk, count, first, timestamps, sequences = item
+            try:
+                if not self._error:
+                    self._write_chunk(chunk[:count], first,
+                                      timestamps[:count], sequences[:count])
+            except Exception as e:
+                SessionWriter._logger.error(traceback.format_exc())
+                self._error = e
+            with self._condition:
+                self._queue.popleft()
+                self._free.append(chunk)
+                self._condition.notify_all()
+
+    def _write_chunk(self: 'SessionWriter', frames: np.ndarray, first: int,
+                     timestamps: np.ndarray, sequences: np.ndarray) -> None:
+        """Compress and write chunk. Modifies frames."""
+        data = _predict(frames, self._predictor).tobytes()
+        if self._codec == ArchiveCodec.Lzma:
+            data = lzma.compress(data, preset=6 if self._level is None
+                                 else self._level)
+        else:
+            data = zlib.compress(data, 1 if self._level is None
+                                 else self._level)
+        f = self._file
+        self._index.append((f.tell(), first, len(frames)))
+        f.write(_Format.CHUNK.pack(_Format.CHUNK_MAGIC, len(frames),
+                                   first, len(data)))
+        f.write(timestamps.tobytes())
+        f.write(sequences.tobytes())
+        f.write(data)
+        self.stored_bytes += len(data)
+        self._stored_frames += len(frames)
+
+    def _write_index(self: 'SessionWriter') -> None:
+        """Write chunk index and footer."""
+        f = self._file
+        offset = f.tell()
+        for x in self._index:
+            f.write(_Format.INDEX.pack(*x))
+        f.write(_Format.FOOTER.pack(offset, len(self._index),
+                                    _Format.MAGIC))
+
+
+class SessionReader:
+    """Reads frames from an archive written by "SessionWriter".
+
+    Only the chunk index and the frame timestamps are read on opening.
+    Frames are decoded lazily chunk by chunk. The last decoded chunk is
+    kept to speed up reading consecutive frames.
+
+    Archives without index, for example if writing has been interrupted,
+    are indexed by scanning the chunk headers. Incomplete chunks at the
+    end are ignored.
+    """
+
+    _logger = logging.getLogger("evcta.SessionReader")
+
+    class _Chunk:
+        """Chunk of archive."""
+        def __init__(self: 'SessionReader._Chunk', offset: int,
+                     first: int, count: int) -> None:
+            self.offset = offset
+            self.first = first
+            self.count = count
+
+    def __init__(self: 'SessionReader', path: str) -> None:
+        """Open archive.
+
+        Throws "Exception" if the file is not a session archive.
+
+        Keyword arguments:
+        path --- Path of archive file
+        """
+        self._file = open(path, 'rb')
+        try:
+            header = self._file.read(_Format.HEADER.size)
+            if len(header) < _Format.HEADER.size:
+                raise Exception("Not a session archive: {}".format(path))
+            magic, version, predictor, codec, self._width, self._height,\
+                self._chunk_frames = _Format.HEADER.unpack(header)
+            if magic != _Format.MAGIC or version != _Format.VERSION:
+                raise Exception("Not a session archive: {}".format(path))
+            self._predictor = ArchivePredictor(predictor)
+            self._codec = ArchiveCodec(codec)
+            self._chunks = self._read_index() or self._scan_chunks()
+            self._read_metadata()
+        except Exception:
+            self._file.close()
+            raise
+        self._cached: 'SessionReader._Chunk' = None
+        self._cached_frames: np.ndarray = None
+
+    @property
+    def width(self: 'SessionReader') -> int:
+        """Width of frames in pixels."""
+        return self._width
+
+    @property
+    def height(self: 'SessionReader') -> int:
+        """Height of frames in pixels."""
+        return self._height
+
+    @property
+    def timestamps(self: 'SessionReader') -> np.ndarray:
+        """Capture time of all frames in seconds."""
+        return self._timestamps
+
+    @property
+    def sequences(self: 'SessionReader') -> np.ndarray:
+        """Sequence number of all frames."""
+        return self._sequences
+
+    def __len__(self: 'SessionReader') -> int:
+        return len(self._timestamps)
+
+    def __getitem__(self: 'SessionReader', index: int | slice
+                    ) -> np.ndarray:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self.read(start, stop)[::step]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("frame index out of range")
+        return self.read(index, index + 1)[0]
+
+    def read(self: 'SessionReader', start: int, stop: int) -> np.ndarray:
+        """Frames in range as uint8 array of shape (count, height, width).
+
+        Decodes only the chunks containing the range.
+
+        Keyword arguments:
+        start --- Index of first frame
+        stop --- Index after the last frame
+        """
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        result = np.empty([max(stop - start, 0), self._height,
+                           self._width], dtype=np.uint8)
+        for chunk in self._chunks:
+            end = chunk.first + chunk.count
+            if end <= start or chunk.first >= stop:
+                continue
+            frames = self._decode(chunk)
+            low = max(start, chunk.first)
+            high = min(stop, end)
+            result[low - start:high - start] =\
+                frames[low - chunk.first:high - chunk.first]
+        return result
+
+    def close(self: 'SessionReader') -> None:
+        """Close archive."""
+        self._file.close()
+
+    def __enter__(self: 'SessionReader') -> 'SessionReader':
+        return self
+
+    def __exit__(self: 'SessionReader', *args) -> None:
+        self.close()
+
+    def _decode(self: 'SessionReader', chunk: 'SessionReader._Chunk'
+                ) -> np.ndarray:
+        """Decode frames of chunk."""
+        if chunk is self._cached:
+            return self._cached_frames
+        f = self._file
+        f.seek(chunk.offset)
+        magic, count, first, size = _Format.CHUNK.unpack(
+            f.read(_Format.CHUNK.size))
+        f.seek(count * 16, 1)
+        data = f.read(size)
+        if self._codec == ArchiveCodec.Lzma:
+            data = lzma.decompress(data)
+        else:
+            data = zlib.decompress(data)
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(
+            count, self._height, self._width)
+        self._cached = chunk
+        self._cached_frames = _reconstruct(frames, self._predictor)
+        return self._cached_frames
+
+    def _read_index(self: 'SessionReader'
+                    ) -> "list[SessionReader._Chunk] | None":
+        """Read chunk index or None if absent."""
+        f = self._file
+        size = f.seek(0, 2)
+        if size < _Format.HEADER.size + _Format.FOOTER.size:
+            return None
+        f.seek(size - _Format.FOOTER.size)
+        offset, count, magic = _Format.FOOTER.unpack(
+            f.read(_Format.FOOTER.size))
+        if magic != _Format.MAGIC\
+                or offset + count * _Format.INDEX.size\
+                + _Format.FOOTER.size != size:
+            return None
+        f.seek(offset)
+        data = f.read(count * _Format.INDEX.size)
+        return [SessionReader._Chunk(*x)
+                for x in _Format.INDEX.iter_unpack(data)]
+
+    def _scan_chunks(self: 'SessionReader') -> "list[SessionReader._Chunk]":
+        """Find chunks by scanning chunk headers."""
+        SessionReader._logger.warning(
+            "archive index missing. scanning chunks")
+        f = self._file
+        size = f.seek(0, 2)
+        offset = _Format.HEADER.size
+        chunks = []
+        while offset + _Format.CHUNK.size <= size:
+            f.seek(offset)
+            magic, count, first, length = _Format.CHUNK.unpack(
+                f.read(_Format.CHUNK.size))
+            end = offset + _Format.CHUNK.size + count * 16 + length
+            if magic != _Format.CHUNK_MAGIC or end > size:
+                break
+            chunks.append(SessionReader._Chunk(offset, first, count))
+            offset = end
+        return chunks
+
+    def _read_metadata(self: 'SessionReader') -> None:
+        """Read timestamps and sequence numbers of all chunks."""
+        count = sum(x.count for x in self._chunks)
+        self._timestamps = np.empty([count], dtype=np.float64)
+        self._sequences = np.empty([count], dtype=np.int64)
+        f = self._file
+        for chunk in self._chunks:
+            f.seek(chunk.offset + _Format.CHUNK.size)
+            data = f.read(chunk.count * 16)
+            index = slice(chunk.first, chunk.first + chunk.count)
+            self._timestamps[index] = np.frombuffer(
+                data, dtype=np.float64, count=chunk.count)
+            self._sequences[index] = np.frombuffer(
+                data, dtype=np.int64, offset=chunk.count * 8)
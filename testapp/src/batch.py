@@ -0,0 +1,247 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import copy
+import os
+
+import numpy as np
+import cv2 as cv
+from decoder import FrameRoi
+from filters import DarkFrame, FrameGeometry
+
+
+_worker_processor: 'BatchProcessor' = None
+_worker_source: np.ndarray = None
+
+
+def _init_worker(processor: 'BatchProcessor', source: str) -> None:
+    """Initialize pool process mapping the source file once."""
+    global _worker_processor, _worker_source
+    # chunks run in parallel already. more threads only compete
+    cv.setNumThreads(1)
+    _worker_processor = processor
+    _worker_source = np.load(source, mmap_mode='r')
+
+
+def _run_worker(start: int, end: int, path: str, compress: bool) -> int:
+    """Process chunk of source file writing it to path."""
+    _worker_processor.write_chunk(_worker_source[start:end], start, path,
+                                  compress)
+    return end - start
+
+
+class BatchProcessor:
+    """Offline processing of recorded frames in chunks.
+
+    Counterpart of "ViveTracker.process_frame()" for recorded sessions.
+    Frames are processed as chunks of shape (count, height, width)
+    instead of one at a time. Chunks are the unit of file access and
+    of parallel processing. Within a chunk the stages run frame by
+    frame through a single reused frame buffer writing directly into
+    the chunk result. Running each stage over the whole chunk instead
+    is slower since the intermediate chunks do not fit into the CPU
+    cache.
+
+    Stages in order:
+    1. Crop "crop" as a view. Default is the left eye image
+    2. Subtract "dark_frame" if set
+    3. Apply "lut" if set
+    4. Apply "geometry"
+    5. Stretch each frame to the full value range if "normalize" is set
+
+    The temporal denoiser is not applied since it depends on the frames
+    processed before. Chunks are thus independent and "process_file()"
+    can process them in parallel using a process pool.
+
+    Frames are grayscale uint8 frames as produced by
+    "OutputFormat.Gray8".
+    """
+
+    _logger = logging.getLogger("evcta.BatchProcessor")
+
+    def __init__(self: 'BatchProcessor',
+                 geometry: FrameGeometry | None = None,
+                 crop: FrameRoi | None = FrameRoi(0, 0, 200, 400),
+                 dark_frame: DarkFrame | None = None,
+                 lut: np.ndarray | None = None,
+                 normalize: bool = False) -> None:
+        """Create batch processor.
+
+        Keyword arguments:
+        geometry --- Geometry to apply or None to scale to 400x400
+        crop --- Region of frames to process or None for all
+        dark_frame --- Dark frame to subtract or None. Has to cover
+                       "crop"
+        lut --- Lookup table as uint8 array of 256 entries or None
+        normalize --- Stretch each frame to the full value range
+        """
+        self.geometry = geometry or FrameGeometry(400, 400)
+        """Geometry applied to each frame."""
+        self.crop = crop
+        """Region of frames to process or None for all."""
+        self.dark_frame = dark_frame
+        """Dark frame to subtract or None."""
+        self.lut = lut
+        """Lookup table as uint8 array of 256 entries or None."""
+        self.normalize = normalize
+        """Stretch each frame to the full value range."""
+        self._work: np.ndarray = None
+        self._result: np.ndarray = None
+
+    def __getstate__(self: 'BatchProcessor') -> dict:
+        state = self.__dict__.copy()
+        state['_work'] = state['_result'] = None
+        return state
+
+    @staticmethod
+    def from_tracker(tracker: 'ViveTracker', lut: np.ndarray | None = None,
+                     normalize: bool = False) -> 'BatchProcessor':
+        """Create batch processor matching the processing of a tracker.
+
+        Copies the geometry and the dark frame.
+
+        Keyword arguments:
+        tracker --- Tracker to copy parameters from
+        lut --- Lookup table as uint8 array of 256 entries or None
+        normalize --- Stretch each frame to the full value range
+        """
+        return BatchProcessor(copy.deepcopy(tracker.geometry),
+                              dark_frame=tracker.dark_frame,
+                              lut=lut, normalize=normalize)
+
+    def process(self: 'BatchProcessor', frames: np.ndarray) -> np.ndarray:
+        """Process chunk of frames.
+
+        The returned array is only valid until the next call.
+
+        Keyword arguments:
+        frames --- Frames as uint8 array of shape (count, height, width)
+        """
+        count = len(frames)
+        crop = self.crop
+        if crop:
+            frames = frames[:, crop.y:crop.y + crop.height,
+                            crop.x:crop.x + crop.width]
+
+        width, height = self.geometry.size
+        result = self._buffer('_result', (count, height, width))
+        work = None
+        if self.dark_frame or self.lut is not None:
+            work = self._buffer('_work', (1,) + frames.shape[1:])[0]
+        for i in range(count):
+            image = frames[i]
+            if self.dark_frame:
+                image = self.dark_frame.subtract(image, crop, work)
+            if self.lut is not None:
+                image = cv.LUT(image, self.lut, dst=work)
+            image = self.geometry.apply(image, result[i])
+            if self.normalize:
+                cv.normalize(image, image, 0, 255, cv.NORM_MINMAX)
+        return result
+
+    def write_chunk(self: 'BatchProcessor', frames: np.ndarray,
+                    start: int, path: str, compress: bool = False) -> None:
+        """Process chunk of frames and write it to a file.
+
+        The file is a NumPy ".npz" file containing the processed frames
+        as "frames" and the index of the first frame as "start".
+
+        Keyword arguments:
+        frames --- Frames as uint8 array of shape (count, height, width)
+        start --- Index of the first frame in the recording
+        path --- Path of file to write
+        compress --- Compress file using zlib. Smaller but slower
+        """
+        result = self.process(frames)
+        save = np.savez_compressed if compress else np.savez
+        with open(path + '.tmp', 'wb') as f:
+            save(f, frames=result, start=start)
+        os.replace(path + '.tmp', path)
+
+    def process_file(self: 'BatchProcessor', source: str, target: str,
+                     chunk_size: int = 256, workers: int | None = None,
+                     compress: bool = False) -> "list[str]":
+        """Process recording writing chunk files.
+
+        The recording is a NumPy ".npy" file of shape (count, height,
+        width). It is memory mapped hence only the chunks in flight are
+        loaded. Chunks are processed in parallel by a pool of processes
+        each writing its chunk to "target" as "chunk-<index>.npz". See
+        "write_chunk()" for the content. At most two chunks per process
+        are in flight.
+
+        Returns list of chunk file paths in order.
+
+        Keyword arguments:
+        source --- Path of recording
+        target --- Directory to write chunk files to. Created if absent
+        chunk_size --- Number of frames per chunk
+        workers --- Number of pool processes or None for the number of
+                    processors. With 1 chunks are processed in this
+                    process
+        compress --- Compress chunk files using zlib
+        """
+        count = len(np.load(source, mmap_mode='r'))
+        os.makedirs(target, exist_ok=True)
+        chunks = [(x, min(x + chunk_size, count), os.path.join(
+            target, "chunk-{:06d}.npz".format(x // chunk_size)))
+            for x in range(0, count, chunk_size)]
+        workers = workers or os.cpu_count() or 1
+        BatchProcessor._logger.info(
+            "process {}: {} frames, {} chunks, {} workers".format(
+                source, count, len(chunks), workers))
+
+        if workers == 1:
+            frames = np.load(source, mmap_mode='r')
+            for start, end, path in chunks:
+                self.write_chunk(frames[start:end], start, path, compress)
+            return [x[2] for x in chunks]
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(self, source)) as executor:
+            pending = set()
+            for start, end, path in chunks:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for x in done:
+                        x.result()
+                pending.add(executor.submit(
+                    _run_worker, start, end, path, compress))
+            for x in pending:
+                x.result()
+        return [x[2] for x in chunks]
+
+    def _buffer(self: 'BatchProcessor', name: str,
+                shape: tuple) -> np.ndarray:
+        """Reused buffer of at least shape returning a view of shape."""
+        buffer = getattr(self, name)
+        if buffer is None or buffer.shape[1:] != shape[1:]\
+                or len(buffer) < shape[0]:
+            buffer = np.empty(shape, dtype=np.uint8)
+            setattr(self, name, buffer)
+        return buffer[:shape[0]]
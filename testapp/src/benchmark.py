@@ -0,0 +1,182 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import timeit
+
+import numpy as np
+import cv2 as cv
+from decoder import DecoderRegistry, FrameRoi, OutputFormat, StereoSide
+from filters import TemporalDenoiser
+from stereo import DisparityEstimator, StereoCalibration, StereoRectifier
+
+
+class Benchmark:
+    """Micro benchmarks for frame processing.
+
+    Uses synthetic frames hence no device is required. Run from the
+    "src" directory using "python3 -m benchmark".
+    """
+
+    def __init__(self: 'Benchmark', width: int = 400, height: int = 400,
+                 repeat: int = 5, number: int = 200) -> None:
+        """Create benchmark.
+
+        Keyword arguments:
+        width --- Width of synthetic frames in pixels
+        height --- Height of synthetic frames in pixels
+        repeat --- Number of measurements. The best one is reported
+        number --- Number of calls per measurement
+        """
+        self.width = width
+        self.height = height
+        self.repeat = repeat
+        self.number = number
+        self.results: dict[str: float] = {}
+
+        self._data = np.random.default_rng(0).integers(
+            0, 256, [width * height * 2], dtype=np.uint8)
+
+    def measure(self: 'Benchmark', name: str, function) -> float:
+        """Measure function and store result.
+
+        Returns best time per call in milliseconds.
+
+        Keyword arguments:
+        name --- Name to store result under
+        function --- Callable without arguments to measure
+        """
+        timings = timeit.repeat(function, repeat=self.repeat,
+                                number=self.number)
+        result = min(timings) * 1000.0 / self.number
+        self.results[name] = result
+        return result
+
+    def run_decode(self: 'Benchmark') -> None:
+        """Measure frame decoding.
+
+        "decode legacy" is the decoding used before "FrameDecoder"
+        copying the frame and the channels before merging them.
+        """
+        data = self._data
+        frame = data.tobytes()
+        pixel_count = self.width * self.height
+        arr_data = np.zeros([pixel_count * 2], dtype=np.uint8)
+        arr_merge = np.zeros([pixel_count, 3], dtype=np.uint8)
+        arr_c2 = np.empty([pixel_count // 2], np.uint8)
+        arr_c3 = np.empty([pixel_count // 2], np.uint8)
+
+        def decode_legacy():
+            arr_data[:] = np.frombuffer(frame, dtype=np.uint8)
+            arr_merge[:, 0] = np.array(arr_data[0::2])
+            arr_c2[:] = np.array(arr_data[1::4])
+            arr_c3[:] = np.array(arr_data[3::4])
+            arr_merge[0:pixel_count:2, 1] = arr_c2
+            arr_merge[1:pixel_count:2, 1] = arr_c2
+            arr_merge[0:pixel_count:2, 2] = arr_c3
+            arr_merge[1:pixel_count:2, 2] = arr_c3
+
+        self.measure("decode legacy", decode_legacy)
+
+        rng = np.random.default_rng(0)
+        for name in DecoderRegistry.names():
+            decoder = DecoderRegistry.create(name, self.width, self.height)
+            if decoder.pixel_format != 'YUYV':
+                data = rng.integers(
+                    0, 256, [decoder.frame_bytes(self.width, self.height)],
+                    dtype=np.uint8)
+            else:
+                data = self._data
+            for output_format in OutputFormat:
+                def decode():
+                    decoder.set_frame(data)
+                    decoder.get(output_format)
+                self.measure("decode {} {}".format(
+                    name, output_format.value), decode)
+
+            decoder.set_roi(StereoSide.Left)
+            for output_format in [OutputFormat.YUV444, OutputFormat.Gray8]:
+                def decode():
+                    decoder.set_frame(data)
+                    decoder.get(output_format)
+                self.measure("decode {} {} roi left".format(
+                    name, output_format.value), decode)
+
+    def run_filter(self: 'Benchmark') -> None:
+        """Measure denoising of one eye."""
+        eye = self._data[0::2].reshape(
+            [self.height, self.width])[:, 0:self.width // 2]
+        self.measure("filter median blur", lambda: cv.medianBlur(eye, 5))
+
+        denoiser = TemporalDenoiser()
+        denoiser.process(eye)
+        self.measure("filter temporal denoise",
+                     lambda: denoiser.process(eye))
+
+    def run_stereo(self: 'Benchmark') -> None:
+        """Measure stereo rectification and disparity of the lower half.
+
+        Uses a nominal calibration without distortion.
+        """
+        half = self.width // 2
+        matrix = np.array([[half * 0.75, 0.0, half * 0.5],
+                           [0.0, self.height * 0.75, self.height * 0.5],
+                           [0.0, 0.0, 1.0]])
+        calibration = StereoCalibration(
+            half, self.height, matrix, np.zeros(5), matrix, np.zeros(5),
+            np.eye(3), [-20.0, 0.0, 0.0])
+        rectifier = StereoRectifier(calibration)
+        image = self._data[0::2].reshape([self.height, self.width])
+        self.measure("stereo rectify", lambda: rectifier.rectify(image))
+
+        left, right = rectifier.rectify(image)
+        estimator = DisparityEstimator(FrameRoi(
+            0, self.height // 2, half, self.height // 2))
+        self.measure("stereo disparity lower half",
+                     lambda: estimator.compute(left, right))
+
+    def run(self: 'Benchmark') -> None:
+        """Run all benchmarks."""
+        self.run_decode()
+        self.run_filter()
+        self.run_stereo()
+
+    def report(self: 'Benchmark', baseline: str) -> None:
+        """Print results.
+
+        Keyword arguments:
+        baseline --- Name of result to calculate speedups against
+        """
+        print("frame size: {}x{}".format(self.width, self.height))
+        reference = self.results.get(baseline)
+        for name, value in self.results.items():
+            line = "- {:40s} {:8.3f}ms".format(name, value)
+            if reference and name != baseline:
+                line += "  ({:.1f}x)".format(reference / value)
+            print(line)
+
+
+if __name__ == "__main__":
+    benchmark = Benchmark()
+    benchmark.run()
+    benchmark.report("decode legacy")
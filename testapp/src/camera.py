@@ -24,12 +24,21 @@ SOFTWARE.
 
 import asyncio as aio
 import traceback
+import threading
 import time
 import logging
+from collections import deque
 from enum import Enum
 
 import platform
 import numpy as np
+from fractions import Fraction
+from frame import EyeLayout, Frame, FramePool
+from startup import DeviceCache, StartupProfiler
+from controls import ControlManager
+from filters import ChangeDetector, DarkFrame, DarkFrameCalibration
+from decoder import FrameDecoder, FrameRoi, OutputFormat, StereoSide,\
+    DecoderRegistry
 
 isLinux = platform.system() == 'Linux'
 
@@ -37,7 +46,6 @@ if isLinux:
     import v4l2py as v4l
     import v4l2py.device as v4ld
 else:
-    import threading
     import pygrabber.dshow_graph as pgdsg
     import pygrabber.dshow_ids as pgdsi
 
@@ -50,12 +58,362 @@ class FTCamera:
         Boolean = 'bool'
         Select = 'select'
 
+    class QueuePolicy(Enum):
+        """How frames are delivered to a subscription."""
+        Inline = 'inline'
+        """Call callback directly while processing the captured frame.
+
+        Fastest way but a slow callback delays all other consumers and
+        the capturing."""
+        DropOldest = 'dropoldest'
+        """Queue frames for a worker thread calling the callback. If the
+        queue is full the oldest frame is dropped."""
+        DropNewest = 'dropnewest'
+        """Queue frames for a worker thread calling the callback. If the
+        queue is full the new frame is dropped."""
+
+    class CapturePolicy(Enum):
+        """How the capture mode is chosen among the modes of the device."""
+        Latency = 'latency'
+        """Highest frame rate then smallest frame size. Minimizes the time
+        between capturing and delivering frames."""
+        FrameRate = 'framerate'
+        """Highest frame rate then largest frame size."""
+        Bandwidth = 'bandwidth'
+        """Lowest number of bytes per second then largest frame size."""
+        Resolution = 'resolution'
+        """Largest frame size then highest frame rate."""
+
+    class CaptureMode:
+        """Combination of pixel format, frame size and frame rate."""
+        def __init__(self: 'FTCamera.CaptureMode', pixel_format,
+                     width: int, height: int, fps: Fraction,
+                     decoder_format: str, source) -> None:
+            """Create capture mode.
+
+            Keyword arguments:
+            pixel_format --- Pixel format
+            width --- Width of frames in pixels
+            height --- Height of frames in pixels
+            fps --- Frame rate
+            decoder_format --- Pixel format as used by "DecoderRegistry"
+            source --- Platform specific mode description
+            """
+            self.pixel_format = pixel_format
+            self.width = width
+            self.height = height
+            self.fps = fps
+            self.decoder_format = decoder_format
+            self.frame_bytes = DecoderRegistry.frame_bytes(
+                decoder_format, width, height)
+            self.source = source
+
+        @property
+        def bandwidth(self: 'FTCamera.CaptureMode') -> float:
+            """Number of bytes per second."""
+            return float(self.frame_bytes * self.fps)
+
+        def __repr__(self: 'FTCamera.CaptureMode') -> str:
+            return "({} {}x{} @ {:.2f}fps, {:.1f}MB/s)".format(
+                getattr(self.pixel_format, 'name', self.pixel_format),
+                self.width, self.height, float(self.fps),
+                self.bandwidth / 1e6)
+
+    class Subscription:
+        """Consumer subscribed to captured frames."""
+        def __init__(self: 'FTCamera.Subscription', callback,
+                     output_format: OutputFormat,
+                     target_fps: float | None = None,
+                     every_nth: int = 1,
+                     policy: 'FTCamera.QueuePolicy | None' = None,
+                     queue_size: int = 1,
+                     skip_static: bool = False) -> None:
+            """Create subscription.
+
+            Keyword arguments:
+            callback --- Callable with the signature
+                         "callback(frame: Frame) -> None"
+            output_format --- Format of frames send to callback
+            target_fps --- Deliver frames at this rate or None for all
+            every_nth --- Deliver only every n-th frame
+            policy --- Queue policy. None is "QueuePolicy.Inline"
+            queue_size --- Maximum number of queued frames
+            skip_static --- Skip frames "FTCamera.change_detector" finds
+                            unchanged
+            """
+            self.callback = callback
+            self.output_format = output_format
+            self.target_fps = target_fps
+            self.every_nth = every_nth
+            self.policy = policy or FTCamera.QueuePolicy.Inline
+            self.queue_size = max(queue_size, 1)
+            self.skip_static = skip_static
+            self.delivered: int = 0
+            """Number of frames delivered to callback."""
+            self.dropped: int = 0
+            """Number of frames dropped due to a full queue."""
+            self._frame_counter = 0
+            self._next_time: float = None
+            self._queue: deque = deque()
+            self._condition = threading.Condition()
+            self._running = False
+            self._thread: threading.Thread = None
+
+        @property
+        def is_queued(self: 'FTCamera.Subscription') -> bool:
+            """Frames are delivered using a worker thread."""
+            return self.policy != FTCamera.QueuePolicy.Inline
+
+        def _is_due(self: 'FTCamera.Subscription', timestamp: float,
+                    tolerance: float) -> bool:
+            """Frame captured at timestamp is to be delivered.
+
+            Applies "every_nth" first then "target_fps". The due time for
+            the next frame is advanced by the target interval instead of
+            being derived from the delivered frame. This keeps delivered
+            frames evenly spaced on average even if the target rate is
+            not an integer fraction of the capture rate. If the consumer
+            falls behind more than one interval the schedule restarts.
+
+            Keyword arguments:
+            timestamp --- Capture time of frame in seconds
+            tolerance --- Frames captured up to this many seconds early
+                          count as on time. Compensates timing jitter.
+            """
+            if self.every_nth > 1:
+                self._frame_counter += 1
+                if self._frame_counter < self.every_nth:
+                    return False
+                self._frame_counter = 0
+
+            if not self.target_fps:
+                return True
+            if self._next_time is not None\
+                    and timestamp < self._next_time - tolerance:
+                return False
+
+            interval = 1.0 / self.target_fps
+            if self._next_time is None\
+                    or timestamp - self._next_time > interval:
+                self._next_time = timestamp
+            self._next_time += interval
+            return True
+
+        def _start(self: 'FTCamera.Subscription') -> None:
+            """Start worker thread if queued."""
+            if not self.is_queued or self._thread:
+                return
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="FTCamera.Subscription",
+                daemon=True)
+            self._thread.start()
+
+        def _stop(self: 'FTCamera.Subscription') -> None:
+            """Stop worker thread if running dropping queued frames."""
+            if not self._thread:
+                return
+            with self._condition:
+                self._running = False
+                self._clear_queue()
+                self._condition.notify()
+            if self._thread is not threading.current_thread():
+                self._thread.join(1.0)
+            self._thread = None
+
+        def _push(self: 'FTCamera.Subscription', frame: Frame) -> None:
+            """Deliver frame directly or queue it for the worker thread.
+
+            Queued frames have to be pooled frames. A reference is held
+            while queued and delivering.
+            """
+            if not self.is_queued:
+                self.callback(frame)
+                self.delivered += 1
+                return
+
+            with self._condition:
+                if len(self._queue) >= self.queue_size:
+                    self.dropped += 1
+                    if self.policy == FTCamera.QueuePolicy.DropNewest:
+                        return
+                    self._queue.popleft().release()
+                frame._pool.retain(frame)
+                self._queue.append(frame)
+                self._condition.notify()
+
+        def _clear_queue(self: 'FTCamera.Subscription') -> None:
+            """Drop all queued frames."""
+            while self._queue:
+                self._queue.popleft().release()
+
+        def _run(self: 'FTCamera.Subscription') -> None:
+            """Worker thread delivering queued frames."""
+            while True:
+                with self._condition:
+                    while self._running and not self._queue:
+                        self._condition.wait()
+                    if not self._running:
+                        return
+                    frame = self._queue.popleft()
+                try:
+                    self.callback(frame)
+                except Exception:
+                    FTCamera._logger.error(traceback.format_exc())
+                finally:
+                    frame.release()
+                with self._condition:
+                    self.delivered += 1
+
+    class FrameStream(Subscription):
+        """Asynchronous iterator over captured frames.
+
+        Created by "FTCamera.frames()". Frames are queued by the capturing
+        into a bounded queue. If the consumer falls behind frames are
+        dropped according to the queue policy instead of blocking the
+        capturing. Iteration ends after "close()" is called or capturing
+        stops. Frames stay valid until the next frame is requested.
+        """
+        def __init__(self: 'FTCamera.FrameStream', ftcamera: 'FTCamera',
+                     output_format: OutputFormat, maxsize: int,
+                     policy: 'FTCamera.QueuePolicy',
+                     target_fps: float | None, every_nth: int,
+                     skip_static: bool = False) -> None:
+            """Create frame stream.
+
+            Keyword arguments:
+            ftcamera --- Camera to unsubscribe from on close
+            output_format --- Format of frames
+            maxsize --- Maximum number of queued frames
+            policy --- Queue policy. Has to drop frames
+            target_fps --- Deliver frames at this rate or None for all
+            every_nth --- Deliver only every n-th frame
+            skip_static --- Skip frames "FTCamera.change_detector" finds
+                            unchanged
+            """
+            if policy == FTCamera.QueuePolicy.Inline:
+                raise Exception("Frame stream requires dropping policy")
+            super().__init__(None, output_format, target_fps, every_nth,
+                             policy, maxsize, skip_static)
+            self._ftcamera = ftcamera
+            self._event = aio.Event()
+            self._ended = False
+            self._current: Frame = None
+            self.max_lag: int = 0
+            """Largest number of frames waiting in the queue so far."""
+
+        @property
+        def lag(self: 'FTCamera.FrameStream') -> int:
+            """Number of frames waiting in the queue."""
+            return len(self._queue)
+
+        def __aiter__(self: 'FTCamera.FrameStream') -> 'FTCamera.FrameStream':
+            return self
+
+        async def __anext__(self: 'FTCamera.FrameStream') -> Frame:
+            self._release_current()
+            while not self._queue:
+                if self._ended:
+                    raise StopAsyncIteration
+                self._event.clear()
+                await self._event.wait()
+            self.delivered += 1
+            self._current = self._queue.popleft()
+            return self._current
+
+        async def __aenter__(self: 'FTCamera.FrameStream'
+                             ) -> 'FTCamera.FrameStream':
+            return self
+
+        async def __aexit__(self: 'FTCamera.FrameStream', *args) -> None:
+            self.close()
+
+        def close(self: 'FTCamera.FrameStream') -> None:
+            """Unsubscribe and end iteration once the queue is empty."""
+            self._ftcamera.unsubscribe(self)
+
+        def _start(self: 'FTCamera.FrameStream') -> None:
+            pass
+
+        def _stop(self: 'FTCamera.FrameStream') -> None:
+            self._ended = True
+            self._event.set()
+
+        def _release_current(self: 'FTCamera.FrameStream') -> None:
+            """Release frame returned by the last iteration."""
+            if self._current:
+                self._current.release()
+                self._current = None
+
+        def _push(self: 'FTCamera.FrameStream', frame: Frame) -> None:
+            """Queue frame.
+
+            Called from the event loop thread processing captured frames.
+            """
+            if self._ended:
+                return
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                if self.policy == FTCamera.QueuePolicy.DropNewest:
+                    return
+                self._queue.popleft().release()
+            frame._pool.retain(frame)
+            self._queue.append(frame)
+            self.max_lag = max(self.max_lag, len(self._queue))
+            self._event.set()
+
     if isLinux:
+        class LazyDevice(v4l.Device):
+            """Video4Linux device reading device information on first use.
+
+            Opening "v4l.Device" enumerates all formats, frame sizes and
+            controls which takes a noticeable time. This device skips the
+            enumeration until "info" or "controls" is first accessed.
+            """
+            def open(self: 'FTCamera.LazyDevice') -> None:
+                if not self._fobj:
+                    self._fobj = self.io.open(self.filename, self._read_write)
+                    self.info = None
+                    self.controls = None
+
+            def close(self: 'FTCamera.LazyDevice') -> None:
+                if not self.closed:
+                    self._fobj.close()
+                    self._fobj = None
+
+            @property
+            def info(self: 'FTCamera.LazyDevice') -> v4ld.Info:
+                if self._info is None and not self.closed:
+                    self._info = v4ld.read_info(self.fileno())
+                return self._info
+
+            @info.setter
+            def info(self: 'FTCamera.LazyDevice', info: v4ld.Info) -> None:
+                self._info = info
+
+            @property
+            def controls(self: 'FTCamera.LazyDevice') -> v4ld.Controls:
+                if self._lazy_controls is None and not self.closed:
+                    self._lazy_controls = v4ld.Controls.from_device(self)
+                return self._lazy_controls
+
+            @controls.setter
+            def controls(self: 'FTCamera.LazyDevice',
+                         controls: v4ld.Controls) -> None:
+                self._lazy_controls = controls
+
         class Control:
-            """Control defined by the hardware."""
+            """Control defined by the hardware.
+
+            Values are cached and written coalesced by "ControlManager".
+            """
             def __init__(self: "FTCamera.ControlInfo",
-                         control: v4ld.BaseControl) -> None:
+                         control: v4ld.BaseControl,
+                         manager: ControlManager) -> None:
                 self._control = control
+                self._manager = manager
+                self._volatile = control.is_flagged_volatile
+                self.id = control.id
                 self.name = control.name
                 self.type = None
                 self.minimum: int = 0
@@ -83,11 +441,36 @@ class FTCamera:
 
             @property
             def value(self: "FTCamera.ControlInfo") -> int | bool:
-                return self._control.value
+                value = self._manager.get(self.id, self._volatile)
+                if self.type == FTCamera.ControlType.Boolean:
+                    return bool(value)
+                return value
 
             @value.setter
             def value(self: "FTCamera.ControlInfo", new_value: int | bool):
-                self._control.value = new_value
+                """Set value.
+
+                Throws "Exception" if the control is not writeable or the
+                value is out of range. Writing is delayed if another write
+                happened recently. See "ControlManager".
+                """
+                if not self.is_writeable:
+                    raise Exception("Control not writeable: {}".format(
+                        self.name))
+                new_value = int(new_value)
+                match self.type:
+                    case FTCamera.ControlType.Integer:
+                        if new_value < self.minimum\
+                                or new_value > self.maximum:
+                            raise Exception(
+                                "Value {} out of range for {}".format(
+                                    new_value, self.name))
+                    case FTCamera.ControlType.Select:
+                        if new_value not in self.choices:
+                            raise Exception(
+                                "Value {} not valid for {}".format(
+                                    new_value, self.name))
+                self._manager.set(self.id, new_value)
 
             @property
             def is_writeable(self: "FTCamera.ControlInfo") -> bool:
@@ -132,13 +515,20 @@ class FTCamera:
                 return "(pixel_format={}, description='{}')".format(
                     self.pixel_format, self.description)
 
+    if not isLinux:
+        # the sample grabber callback supports only YUY2 right now
+        _DSHOW_PIXEL_FORMATS = {'YUY2': 'YUYV'}
+
+    _IDLE_CHECK_INTERVAL = 1.0
+
     _logger = logging.getLogger("evcta.FTCamera")
 
     def __init__(self: 'FTCamera', index: int) -> None:
         """Create camera grabber.
 
-        The camera is not yet opened. Set "callback_frame" then call
-        "open()" to open the device and "start_read()" to start capturing.
+        The camera is not yet opened. Set "callback_frame" or use
+        "subscribe()" then call "open()" to open the device and
+        "start_read()" to start capturing.
 
         Keyword arguments:
         index -- Index of the camera. Under Linux this uses the device
@@ -150,31 +540,146 @@ class FTCamera:
         else:
             self._device: pgdsg.VideoInput = None
 
-        self._controls: "list[FRCamera.Control]" = []
+        self._controls: "list[FRCamera.Control] | None" = None
+        self._control_manager: ControlManager = None
+        self._device_key: str = None
+        self._capture_mode: FTCamera.CaptureMode = None
+        self._fps: float = 0.0
+        self._first_frame = False
+        self.last_frame_time: float | None = None
+        """Monotonic time the last non-empty frame arrived or capturing
+        started or None if capturing never started."""
+        self.frames_received: int = 0
+        """Number of non-empty frames received."""
+        self.empty_frames: int = 0
+        """Number of empty frames received. These are skipped."""
         self._task_read: aio.Task = None
-        self._arr_data: np.ndarray = None
-        self._arr_c2: np.ndarray = None
-        self._arr_c3: np.ndarray = None
-        self._arr_merge: np.ndarray = None
+        self._task_idle: aio.Task = None
+        self._task_resume: aio.Task = None
+        self._decoder: FrameDecoder = None
+        self._decoder_formats: "set[OutputFormat]" = set()
+        self._roi: "FrameRoi | StereoSide | None" = None
+        self._subscriptions: "list[FTCamera.Subscription]" = []
+        self._due: "list[FTCamera.Subscription]" = []
+        self._frame = Frame()
+        self._frame.device_index = index
+        self._inline_frames: "dict[OutputFormat, Frame]" = {}
+        self._pools: "dict[OutputFormat, FramePool]" = {}
+        self._snapshots: "dict[OutputFormat, Frame]" = {}
+        self._eye_layout = EyeLayout.SideBySide
+
+        self._callback_frame = None
+
+        self.output_format = OutputFormat.YUV444
+        """Format of the image send to "callback_frame".
+
+        With "OutputFormat.YUV444Planar" the image is a numpy array of
+        shape (3, height, width) with one contiguous plane per channel.
+        This is faster to produce than the interleaved layout and better
+        suited for consumers processing channels individually. See
+        "OutputFormat" for the other formats.
+
+        Output format can be changed while capturing.
+        """
 
-        self.callback_frame = None
-        """Callback to send captured frame data to.
+        self.exposure: int | None = None
+        """Exposure in effect stored in captured frames or None.
 
-        Has to be a callable object with the signature
-        "callback(data: np.ndarray) -> None". If callback_frame
-        is None no image is grabbed nor processed.
+        The camera does not know the sensor settings. Whoever changes
+        them, for example "ViveTracker", has to update this value.
+        """
 
-        The image send to the callback is a numpy array of shape
-        (height, width, 3). Channel format is YUV.
+        self.gain: int | None = None
+        """Gain in effect stored in captured frames or None.
 
-        Callback function can be changed while capturing.
+        The camera does not know the sensor settings. Whoever changes
+        them, for example "ViveTracker", has to update this value.
+        """
+
+        self.capture_policy = FTCamera.CapturePolicy.FrameRate
+        """Policy choosing the capture mode.
+
+        Ranks all combinations of supported pixel format, frame size and
+        frame rate. Has to be set before calling "open()".
+        """
+
+        self.min_fps: float = 30
+        """Minimum frame rate of capture modes to consider.
+
+        Has to be set before calling "open()".
+        """
+
+        self.fast_open: bool = False
+        """Open device using the last known-good configuration.
+
+        If a configuration has been cached for the device the format and
+        frame size are not searched. Formats, frame sizes and controls
+        are then not enumerated at all. Controls are enumerated the
+        first time "controls" is used. If the cached configuration
+        fails the device is opened the regular way. Configurations are
+        cached once the first frame has been captured.
+        """
+
+        self.control_profiles: "dict[str, dict[str, int]]" = {}
+        """Named control profiles.
+
+        Profiles map control names to values. Use
+        "save_control_profile()" and "restore_control_profile()". Profiles
+        are plain dictionaries and can be stored by the application.
+        """
+
+        self.profiler: StartupProfiler = None
+        """Profiler measuring the startup phases.
+
+        Created by "open()". The report is logged once the first frame
+        has been captured. Pass it on to add phases, for example to
+        "ViveTracker".
+        """
+
+        self.decoder_backend: str = None
+        """Name of decoder backend to use.
+
+        See "DecoderRegistry" for the available backends. If None the
+        fastest backend for the requested formats is selected. The
+        selection is done again if the requested formats change. Has to
+        be set before calling "open()".
+        """
+
+        self.idle_timeout: float | None = None
+        """Seconds without consumers after which the stream is suspended.
+
+        None never suspends. Requires "stream_switch". Checked about once
+        a second while capturing. The stream is resumed by the next
+        subscription or by setting "callback_frame".
+        """
+
+        self.stream_switch = None
+        """Callable enabling or disabling the device stream or None.
+
+        Has the signature "switch(enable: bool) -> None", for example
+        "ViveTracker.set_stream_enabled". Used to suspend the stream if
+        idle without closing the device.
+        """
+
+        self._idle_since: float | None = None
+        self._suspended = False
+
+        self.change_detector: ChangeDetector = None
+        """Detector flagging frames which changed or None.
+
+        If set each frame is compared against the last changed frame
+        before decoding. The result is stored in "Frame.changed".
+        Consumers subscribed with "skip_static" receive only changed
+        frames. Can be changed while capturing.
         """
 
     def open(self: 'FTCamera') -> None:
         """Open device if closed.
 
         This opens the device using Video4Linux. Finds frame size and
-        format to use. Also finds all supported controls.
+        format to use. Also finds all supported controls. With
+        "fast_open" the cached configuration is used instead if present.
+        Time spent per phase is measured by "profiler".
 
         This method does not start recording.
 
@@ -188,9 +693,50 @@ class FTCamera:
         if self._device:
             return
         FTCamera._logger.info("FTCamera.open: index {}".format(self._index))
+        self.profiler = StartupProfiler()
+        profiler = self.profiler
+        with profiler.phase("open device"):
+            self._open_device()
+
+        config = None
+        if self.fast_open:
+            config = DeviceCache.get(self._device_key)
+        if config:
+            try:
+                with profiler.phase("apply cached configuration"):
+                    self._apply_config(config)
+            except Exception as e:
+                FTCamera._logger.warning(
+                    "cached configuration failed, searching: {}".format(e))
+                DeviceCache.remove(self._device_key)
+                config = None
+        if not config:
+            with profiler.phase("find capture mode"):
+                self._find_capture_mode()
+            with profiler.phase("set format"):
+                self._set_frame_format()
+        with profiler.phase("init decoder"):
+            self._init_arrays()
+        if not self.fast_open:
+            with profiler.phase("find controls"):
+                self._find_controls()
+
+        if not isLinux:
+            with profiler.phase("prepare graph"):
+                self._filter_graph.prepare_preview_graph()
+            # self._filter_graph.print_debug_info()
+
+    def _open_device(self: 'FTCamera') -> None:
+        """Open device and find the key identifying it in caches."""
         if isLinux:
-            self._device = v4l.Device.from_id(self._index)
+            if self.fast_open:
+                self._device = FTCamera.LazyDevice.from_id(self._index)
+            else:
+                self._device = v4l.Device.from_id(self._index)
             self._device.open()
+            caps = v4ld.read_capabilities(self._device.fileno())
+            self._device_key = "v4l|{}|{}".format(
+                caps.card.decode(), caps.bus_info.decode())
         else:
             self._filter_graph = pgdsg.FilterGraph()
 
@@ -199,83 +745,242 @@ class FTCamera:
             FTCamera._logger.info("Video input filter: {}".format(
                 self._filter_video.Name))
             self._device = self._filter_video
+            self._device_key = "dshow|{}|{}".format(
+                self._filter_video.Name, self._index)
 
             self._filter_graph.add_sample_grabber(self._async_grabber)
             self._filter_grabber = self._filter_graph.filters[
                 pgdsg.FilterType.sample_grabber]
 
             self._filter_graph.add_null_render()
-        self._find_format()
-        self._find_frame_size()
+
+    def _device_config(self: 'FTCamera') -> dict:
+        """Configuration in use to store in "DeviceCache"."""
+        mode = self._capture_mode
+        if isLinux:
+            return dict(
+                pixel_format=mode.pixel_format.name,
+                description=self._format.description,
+                flags=int(self._format.flags),
+                width=mode.width,
+                height=mode.height,
+                interval_type=int(self._frame_size.type),
+                min_fps=str(self._frame_size.min_fps),
+                max_fps=str(self._frame_size.max_fps),
+                step_fps=str(self._frame_size.step_fps),
+                fps=str(mode.fps))
+        else:
+            return dict(
+                pixel_format=mode.pixel_format,
+                size_index=mode.source['index'],
+                width=mode.width,
+                height=mode.height,
+                fps=str(mode.fps))
+
+    def _apply_config(self: 'FTCamera', config: dict) -> None:
+        """Use configuration from "DeviceCache" instead of searching.
+
+        Throws "Exception" if the device rejects the configuration.
+
+        Keyword arguments:
+        config --- Configuration created by "_device_config()"
+        """
+        pixel_format = config['pixel_format']
+        decoder_format = FTCamera._decoder_format(pixel_format)
+        if not decoder_format:
+            raise Exception("No decoder for pixel format: {}".format(
+                pixel_format))
+        if isLinux:
+            pixel_format = v4l.PixelFormat[pixel_format]
+            source = (
+                v4ld.ImageFormat(
+                    type=v4ld.BufferType.VIDEO_CAPTURE,
+                    description=config['description'],
+                    flags=v4ld.ImageFormatFlag(config['flags']),
+                    pixel_format=pixel_format),
+                v4ld.FrameType(
+                    type=v4ld.FrameIntervalType(config['interval_type']),
+                    pixel_format=pixel_format,
+                    width=config['width'], height=config['height'],
+                    min_fps=Fraction(config['min_fps']),
+                    max_fps=Fraction(config['max_fps']),
+                    step_fps=Fraction(config['step_fps'])))
+        else:
+            source = dict(index=config['size_index'])
+        mode = FTCamera.CaptureMode(
+            pixel_format, config['width'], config['height'],
+            Fraction(config['fps']), decoder_format, source)
+        FTCamera._logger.info("using cached capture mode: {}".format(mode))
+        self._use_capture_mode(mode)
         self._set_frame_format()
-        self._init_arrays()
-        self._find_controls()
 
-        if not isLinux:
-            self._filter_graph.prepare_preview_graph()
-            # self._filter_graph.print_debug_info()
+        if isLinux:
+            actual = self._device.get_format(v4ld.BufferType.VIDEO_CAPTURE)
+            if actual.width != mode.width or actual.height != mode.height\
+                    or actual.pixel_format != pixel_format:
+                raise Exception("Device uses different format: {}".format(
+                    actual))
 
-    def _find_format(self: 'FTCamera') -> None:
-        """Logs all formats supported by camera and picks best one.
+    def _find_capture_mode(self: 'FTCamera') -> None:
+        """Logs all capture modes and picks the best one.
 
-        Picks the first format which is YUV and supports capturing.
+        Considers modes with a decodable pixel format and at least
+        "min_fps" frame rate. These are ranked using "capture_policy".
+        Ties keep the order the device lists the modes in.
 
-        Throws "Exception" if no suitable format is found.
+        Throws "Exception" if no suitable mode is found.
         """
+        modes = self._capture_modes()
+        FTCamera._logger.info("capture modes:")
+        for x in modes:
+            FTCamera._logger.info("- {}".format(x))
+
+        candidates = [x for x in modes if x.fps >= self.min_fps]
+        if not candidates:
+            raise Exception("No capture mode with at least {} fps".format(
+                self.min_fps))
+        candidates.sort(key=self._capture_mode_rank)
+        FTCamera._logger.info("using capture mode ({}): {}".format(
+            self.capture_policy.value, candidates[0]))
+        self._use_capture_mode(candidates[0])
+
+    def _capture_modes(self: 'FTCamera') -> "list[FTCamera.CaptureMode]":
+        """List of capture modes with decodable pixel format.
+
+        Pixel formats are decodable if "DecoderRegistry" has a backend
+        for them. Modes with a frame rate range add a mode for the
+        lowest and the highest frame rate.
+        """
+        modes = []
         FTCamera._logger.info("formats:")
         if isLinux:
+            formats = {}
             for x in self._device.info.formats:
                 FTCamera._logger.info("- {}".format(x))
-            self._format = next(x for x in self._device.info.formats
-                                if x.pixel_format == v4l.PixelFormat.YUYV
-                                and x.type == v4ld.BufferType.VIDEO_CAPTURE)
+                if x.type == v4ld.BufferType.VIDEO_CAPTURE\
+                        and FTCamera._decoder_format(x.pixel_format.name):
+                    formats[x.pixel_format] = x
+
+            for x in self._device.info.frame_sizes:
+                if x.pixel_format not in formats:
+                    continue
+                rates = [x.max_fps]
+                if x.min_fps != x.max_fps:
+                    rates.append(x.min_fps)
+                for fps in rates:
+                    if not fps:
+                        continue
+                    modes.append(FTCamera.CaptureMode(
+                        x.pixel_format, x.width, x.height,
+                        Fraction(fps).limit_denominator(1001),
+                        FTCamera._decoder_format(x.pixel_format.name),
+                        (formats[x.pixel_format], x)))
         else:
             for x in self._filter_video.get_formats():
                 FTCamera._logger.info(x)
-            fmt = next(x for x in self._filter_video.get_formats()
-                       if x['media_type_str'] in ['YUY2'])
-            self._format = FTCamera.FrameFormat(
-                fmt['media_type_str'], fmt['media_type_str'])
-        FTCamera._logger.info("using format: {}".format(self._format))
+                pixel_format = x['media_type_str']
+                decoder_format = FTCamera._decoder_format(pixel_format)
+                if not decoder_format:
+                    continue
+                modes.append(FTCamera.CaptureMode(
+                    pixel_format, x['width'], x['height'],
+                    Fraction(x['max_framerate']).limit_denominator(1001),
+                    decoder_format, x))
+        return modes
 
-    def _find_frame_size(self: 'FTCamera') -> None:
-        """Logs all sizes supported by camera and picks best one.
+    @staticmethod
+    def _decoder_format(pixel_format: str) -> str | None:
+        """Pixel format as used by "DecoderRegistry" or None.
 
-        Picks the first size with YUV format and a minimum FPS of 30.
+        Returns None if no decoder backend exists for the pixel format.
 
-        Throws "Exception" if no suitable size is found.
+        Keyword arguments:
+        pixel_format --- Name of pixel format as reported by the device
+        """
+        if not isLinux:
+            pixel_format = FTCamera._DSHOW_PIXEL_FORMATS.get(pixel_format)
+        if pixel_format in DecoderRegistry.pixel_formats():
+            return pixel_format
+        return None
+
+    def _capture_mode_rank(self: 'FTCamera',
+                           mode: 'FTCamera.CaptureMode') -> tuple:
+        """Sort key of capture mode. Lower is better.
+
+        Modes otherwise equal prefer the pixel format with the smaller
+        frame size in bytes.
+
+        Keyword arguments:
+        mode --- Capture mode to rank
         """
+        pixels = mode.width * mode.height
+        match self.capture_policy:
+            case FTCamera.CapturePolicy.Latency:
+                return (-mode.fps, pixels, mode.frame_bytes)
+            case FTCamera.CapturePolicy.Bandwidth:
+                return (mode.bandwidth, -pixels)
+            case FTCamera.CapturePolicy.Resolution:
+                return (-pixels, -mode.fps, mode.frame_bytes)
+            case _:
+                return (-mode.fps, -pixels, mode.frame_bytes)
+
+    def _use_capture_mode(self: 'FTCamera',
+                          mode: 'FTCamera.CaptureMode') -> None:
+        """Store capture mode to activate with "_set_frame_format()".
+
+        Keyword arguments:
+        mode --- Capture mode
+        """
+        self._capture_mode = mode
+        self._fps = float(mode.fps)
         if isLinux:
-            FTCamera._logger.info("sizes:")
-            for x in self._device.info.frame_sizes:
-                FTCamera._logger.info("- {}".format(x))
-            self._frame_size = next(x for x in self._device.info.frame_sizes
-                                    if x.pixel_format == v4l.PixelFormat.YUYV
-                                    and x.min_fps >= 30)
+            self._format, self._frame_size = mode.source
         else:
-            fsize = next(x for x in self._filter_video.get_formats()
-                         if x['media_type_str'] == self._format.pixel_format
-                         and x['min_framerate'] >= 30)
+            self._format = FTCamera.FrameFormat(
+                mode.pixel_format, mode.pixel_format)
             self._frame_size = FTCamera.FrameSize(
-                fsize['index'], fsize['width'], fsize['height'],
-                int(fsize['max_framerate']))
+                mode.source['index'], mode.width, mode.height,
+                int(mode.fps))
+        self._init_frame_dimensions(mode.width, mode.height)
 
-        FTCamera._logger.info("using frame size : {}".format(self._frame_size))
-        self._frame_width = self._frame_size.width
-        self._frame_height = self._frame_size.height
+    def _init_frame_dimensions(self: 'FTCamera', width: int,
+                               height: int) -> None:
+        """Store frame dimensions used by the decoding.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        self._frame_width = width
+        self._frame_height = height
         self._pixel_count = self._frame_width * self._frame_height
         self._half_pixel_count = self._pixel_count // 2
         self._half_frame_width = self._frame_width // 2
         self._half_frame_height = self._frame_height // 2
 
     def _set_frame_format(self: 'FTCamera') -> None:
-        """Activates the found format and size."""
+        """Activates the found capture mode.
+
+        Under Linux the frame interval is set explicitly. The frame rate
+        in effect is read back from the device afterwards. DirectShow
+        uses the default frame rate of the chosen format.
+        """
         if isLinux:
             self._device.set_format(
                 buffer_type=v4ld.BufferType.VIDEO_CAPTURE,
                 width=self._frame_size.width,
                 height=self._frame_size.height,
                 pixel_format=self._format.pixel_format)
+            try:
+                self._device.set_fps(v4ld.BufferType.VIDEO_CAPTURE,
+                                     self._capture_mode.fps)
+                self._fps = float(self._device.get_fps(
+                    v4ld.BufferType.VIDEO_CAPTURE))
+            except OSError as e:
+                FTCamera._logger.warning(
+                    "setting frame interval failed: {}".format(e))
+            FTCamera._logger.info("frame rate in effect: {:.2f}".format(
+                self._fps))
         else:
             self._filter_video.set_format(self._frame_size.index)
 
@@ -313,22 +1018,71 @@ class FTCamera:
             # an alternative is pgdsi.GUID_NULL accepting everything
 
     def _init_arrays(self: 'FTCamera') -> None:
-        """Create numpy arrays to fill during capturing."""
-        self._arr_data = np.zeros([self._pixel_count * 2], dtype=np.uint8)
-        self._arr_merge = np.zeros([self._pixel_count, 3], dtype=np.uint8)
-        self._arr_c2 = np.empty([self._half_pixel_count], np.uint8)
-        self._arr_c3 = np.empty([self._half_pixel_count], np.uint8)
+        """Create frame decoder filling numpy arrays during capturing.
+
+        Uses "decoder_backend" if set. Otherwise selects the fastest
+        backend for the pixel format of the capture mode and the
+        currently requested formats.
+
+        Throws "Exception" if "decoder_backend" does not decode the
+        pixel format of the capture mode.
+        """
+        decoder_format = self._capture_mode.decoder_format
+        backend = self.decoder_backend
+        if not backend:
+            backend = self._select_decoder()
+        elif backend not in DecoderRegistry.names(decoder_format):
+            raise Exception("Decoder backend {} can not decode {}".format(
+                backend, decoder_format))
+        self._create_decoder(backend)
+
+    def _select_decoder(self: 'FTCamera') -> str:
+        """Select fastest backend for the requested formats."""
+        formats = self._requested_formats()
+        self._decoder_formats = set(formats)
+        return DecoderRegistry.select(
+            self._frame_width, self._frame_height, formats,
+            pixel_format=self._capture_mode.decoder_format)
+
+    def _create_decoder(self: 'FTCamera', backend: str) -> None:
+        """Create decoder using backend."""
+        FTCamera._logger.info("using decoder backend: {}".format(backend))
+        self._decoder = DecoderRegistry.create(
+            backend, self._frame_width, self._frame_height)
+        self._decoder.set_roi(self._roi)
+        self._update_eye_layout()
+        self._inline_frames.clear()
+        self._pools.clear()
+
+    def _update_decoder(self: 'FTCamera') -> None:
+        """Select backend again if the requested formats changed.
+
+        Consumers usually subscribe after "open()" hence the backend
+        selected while opening did not know the formats. Benchmarking
+        is only done if no cached result exists for the formats.
+        """
+        if not self._decoder or self.decoder_backend\
+                or set(self._requested_formats()) == self._decoder_formats:
+            return
+        backend = self._select_decoder()
+        if backend != self._decoder.name:
+            self._create_decoder(backend)
 
     def _find_controls(self: 'FTCamera') -> None:
-        """Logs all controls and stores them for use."""
+        """Logs all controls and stores them for use.
+
+        Only called on first use of "controls" if "fast_open" is used.
+        """
         self._controls = []
         FTCamera._logger.info("controls:")
         if isLinux:
+            self._control_manager = ControlManager(self._device.fileno())
             for x in self._device.controls.values():
                 FTCamera._logger.info("- {}".format(x))
-                control = FTCamera.Control(x)
+                control = FTCamera.Control(x, self._control_manager)
                 if not control.type:
                     continue
+                self._control_manager.register(control.id)
                 self._controls.append(control)
 
     @property
@@ -362,17 +1116,27 @@ class FTCamera:
 
     @property
     def frame_fps(self: 'FTCamera') -> float:
-        """Capture frame rate.
+        """Capture frame rate in effect.
 
-        Only valid if device is open."""
-        return float(self._frame_size.min_fps)
+        Under Linux this is the frame rate reported by the device after
+        setting the frame interval. Only valid if device is open."""
+        return self._fps
 
     @property
     def frame_format(self: 'FTCamera') -> str:
         """Capture pixel format.
 
         Only valid if device is open."""
-        return self._frame_size.pixel_format.name
+        if isLinux:
+            return self._format.pixel_format.name
+        return self._format.pixel_format
+
+    @property
+    def capture_mode(self: 'FTCamera') -> 'FTCamera.CaptureMode':
+        """Capture mode in use.
+
+        Only valid if device is open."""
+        return self._capture_mode
 
     @property
     def frame_format_description(self: 'FTCamera') -> str:
@@ -381,22 +1145,354 @@ class FTCamera:
         Only valid if device is open."""
         return self._format.description
 
+    @property
+    def callback_frame(self: 'FTCamera'):
+        """Callback to send captured frame data to.
+
+        Deprecated. Use "subscribe()" which supports multiple consumers
+        each with their own format, rate and queue policy.
+
+        Has to be a callable object with the signature
+        "callback(data: np.ndarray) -> None". If callback_frame
+        is None and no consumers are subscribed no image is grabbed
+        nor processed.
+
+        The image send to the callback is a numpy array of shape
+        (height, width, 3). Channel format is YUV. Use "output_format"
+        to receive a different format.
+
+        Callback function can be changed while capturing.
+        """
+        return self._callback_frame
+
+    @callback_frame.setter
+    def callback_frame(self: 'FTCamera', callback) -> None:
+        self._callback_frame = callback
+        if callback:
+            self._update_decoder()
+            self.resume_stream()
+
+    @property
+    def is_suspended(self: 'FTCamera') -> bool:
+        """Stream is suspended due to having no consumers."""
+        return self._suspended
+
+    def suspend_stream(self: 'FTCamera') -> None:
+        """Suspend stream using "stream_switch" if not suspended."""
+        if self._suspended or not self.stream_switch:
+            return
+        FTCamera._logger.info("suspend idle stream")
+        self.stream_switch(False)
+        self._suspended = True
+
+    def resume_stream(self: 'FTCamera') -> None:
+        """Resume stream suspended by "suspend_stream()" or idle.
+
+        The switch is called in a worker thread by a task to not block
+        capturing. The stream stays suspended until the switch succeeded.
+        If the switch fails resuming is retried while capturing.
+        """
+        self._idle_since = None
+        if not self._suspended or self._task_resume:
+            return
+        self._task_resume = aio.create_task(self._async_resume())
+
+    async def _async_resume(self: 'FTCamera') -> None:
+        """Resume suspended stream using "stream_switch"."""
+        FTCamera._logger.info("resume stream")
+        try:
+            await aio.to_thread(self.stream_switch, True)
+            self._suspended = False
+            self.last_frame_time = time.monotonic()
+        except Exception:
+            FTCamera._logger.error(traceback.format_exc())
+        finally:
+            self._task_resume = None
+
+    @property
+    def device_key(self: 'FTCamera') -> str:
+        """Key identifying the device across sessions.
+
+        Used to store per device data. Only valid if device is open."""
+        return self._device_key
+
+    @property
+    def decoder_name(self: 'FTCamera') -> str:
+        """Name of decoder backend in use.
+
+        Only valid if device is open."""
+        return self._decoder.name
+
+    @property
+    def roi(self: 'FTCamera') -> "FrameRoi | StereoSide | None":
+        """Region of interest applied to captured frames.
+
+        Region of interest as rectangle in pixels, stereo side or None
+        to use the full frame. The region is applied before decoding.
+        Pixels outside the region are never touched. All output formats
+        are produced from the region only. See "FrameDecoder.set_roi()"
+        for how the region is aligned.
+
+        Can be set before opening the device and changed while capturing
+        without reallocating buffers.
+        """
+        return self._roi
+
+    @roi.setter
+    def roi(self: 'FTCamera', roi: "FrameRoi | StereoSide | None") -> None:
+        if self._decoder:
+            self._decoder.set_roi(roi)
+            self._update_eye_layout()
+        self._roi = roi
+
+    @property
+    def roi_effective(self: 'FTCamera') -> FrameRoi:
+        """Region of interest in effect after alignment.
+
+        Only valid if device is open."""
+        return self._decoder.roi
+
     @property
     def controls(self: 'FTCamera') -> "list[FTCamera.Control]":
         """List of all supported controls.
 
         Only valid if device is open."""
-        return self._controls
+        if self._controls is None and self._device:
+            self._find_controls()
+        return self._controls or []
+
+    def flush_controls(self: 'FTCamera') -> None:
+        """Write delayed control values right away.
+
+        Throws "Exception" if writing fails.
+        """
+        if self._control_manager:
+            self._control_manager.flush()
+
+    def refresh_controls(self: 'FTCamera') -> None:
+        """Read control values from the device replacing cached values."""
+        if self._control_manager:
+            self._control_manager.refresh()
+
+    def snapshot_controls(self: 'FTCamera') -> "dict[str, int]":
+        """Values of all writeable controls by control name.
+
+        Use "restore_controls()" to restore the values later on.
+        """
+        writeable = [x for x in self.controls if x.is_writeable]
+        if not writeable:
+            return {}
+        values = self._control_manager.snapshot([x.id for x in writeable])
+        return {x.name: values[x.id] for x in writeable}
+
+    def restore_controls(self: 'FTCamera', values: "dict[str, int]") -> None:
+        """Restore control values in one transaction.
+
+        Only values differing from the current ones are written. Names
+        of controls the device does not have are ignored.
+
+        Throws "Exception" if writing fails.
+
+        Keyword arguments:
+        values --- Values by control name from "snapshot_controls()"
+        """
+        restore = {x.id: int(values[x.name]) for x in self.controls
+                   if x.name in values and x.is_writeable}
+        if restore:
+            self._control_manager.restore(restore)
+
+    def save_control_profile(self: 'FTCamera', name: str) -> None:
+        """Store snapshot of controls as named profile.
+
+        Keyword arguments:
+        name --- Name of profile
+        """
+        self.control_profiles[name] = self.snapshot_controls()
+
+    def restore_control_profile(self: 'FTCamera', name: str) -> None:
+        """Restore named profile in one transaction.
+
+        Throws "Exception" if profile is absent or writing fails.
+
+        Keyword arguments:
+        name --- Name of profile
+        """
+        if name not in self.control_profiles:
+            raise Exception("Control profile not found: {}".format(name))
+        self.restore_controls(self.control_profiles[name])
+
+    async def calibrate_dark_frame(self: 'FTCamera',
+                                   count: int = 32) -> DarkFrame:
+        """Capture dark frame and store it for the device.
+
+        Averages "count" frames of the region of interest. No light must
+        reach the sensor meanwhile, for example by covering the cameras.
+        The dark frame is stored using "DarkFrame.save()" with
+        "device_key". Use "DarkFrame.load()" to load it later on.
+        Capturing has to be running.
 
-    async def close(self: 'FTCamera') -> None:
+        Throws "Exception" if capturing is not running or stops before
+        enough frames have been captured.
+
+        Keyword arguments:
+        count --- Number of frames to average
+        """
+        if not self._task_read:
+            raise Exception("Capturing is not running")
+        FTCamera._logger.info("calibrate dark frame using {} frames".format(
+            count))
+        calibration = DarkFrameCalibration(count)
+        async with self.frames(OutputFormat.Gray8, maxsize=count,
+                               policy=FTCamera.QueuePolicy.DropNewest
+                               ) as frames:
+            async for frame in frames:
+                if calibration.add(frame.data):
+                    break
+        if not calibration.complete:
+            raise Exception("Capturing stopped after {} frames".format(
+                calibration.added))
+        roi = self.roi_effective
+        dark_frame = calibration.result(
+            FrameRoi(roi.x, roi.y, roi.width, roi.height))
+        dark_frame.save(self._device_key)
+        return dark_frame
+
+    def subscribe(self: 'FTCamera', callback,
+                  output_format: OutputFormat = OutputFormat.YUV444,
+                  target_fps: float | None = None,
+                  every_nth: int = 1,
+                  policy: 'FTCamera.QueuePolicy | None' = None,
+                  queue_size: int = 1,
+                  skip_static: bool = False) -> 'FTCamera.Subscription':
+        """Subscribe consumer to captured frames.
+
+        Consumers declare the format they require. Frames are only
+        decoded into formats requested by at least one consumer. If
+        multiple consumers request the same format the frame is decoded
+        once and the same array is send to all of them. Consumers must
+        thus not modify the array.
+
+        Consumers receive "Frame" records holding the pixel data and the
+        frame metadata like timestamp and sequence number. Records are
+        reused and only valid during the callback. Keep the values
+        needed instead of the record itself.
+
+        Consumers not requiring the full frame rate can use "target_fps"
+        or "every_nth" to receive less frames. Frames no consumer is due
+        to receive are discarded before decoding.
+
+        By default the callback is called directly while processing the
+        captured frame. A slow callback thus delays all other consumers.
+        Using a queue policy other than "QueuePolicy.Inline" each
+        subscription gets a worker thread and a queue of up to
+        "queue_size" frames instead. The callback then runs without
+        blocking the capturing or other consumers. Queued frames are
+        read-only copies from a frame pool. Each format is copied once
+        per frame and shared among all queued subscriptions.
+
+        If "change_detector" is set consumers can use "skip_static" to
+        receive only frames which changed. All consumers can check
+        "Frame.changed" instead.
+
+        Subscriptions can be added and removed while capturing.
+
+        Returns subscription to use with "unsubscribe()".
+
+        Keyword arguments:
+        callback --- Callable with the signature
+                     "callback(frame: Frame) -> None"
+        output_format --- Format of frames send to callback
+        target_fps --- Deliver frames at this rate or None for all
+        every_nth --- Deliver only every n-th frame
+        policy --- Queue policy. None is "QueuePolicy.Inline"
+        queue_size --- Maximum number of queued frames
+        skip_static --- Skip frames "change_detector" finds unchanged
+        """
+        subscription = FTCamera.Subscription(
+            callback, output_format, target_fps, every_nth,
+            policy, queue_size, skip_static)
+        subscription._start()
+        self._subscriptions.append(subscription)
+        self._update_decoder()
+        self.resume_stream()
+        return subscription
+
+    def frames(self: 'FTCamera',
+               output_format: OutputFormat = OutputFormat.YUV444,
+               maxsize: int = 1,
+               policy: 'FTCamera.QueuePolicy | None' = None,
+               target_fps: float | None = None,
+               every_nth: int = 1,
+               skip_static: bool = False) -> 'FTCamera.FrameStream':
+        """Subscribe asynchronous iterator over captured frames.
+
+        Alternative to "subscribe()" pulling frames instead of pushing
+        them. Frames are "Frame" records with read-only copies queued in
+        a bounded queue of "maxsize" frames. A frame is valid until the
+        next frame is requested. If the queue is full frames are dropped as
+        defined by the policy. "FrameStream.dropped" and
+        "FrameStream.lag" tell how much the consumer falls behind.
+        A slow consumer never blocks the capturing.
+
+        Use it like this:
+        async with ftcamera.frames(OutputFormat.Gray8) as frames:
+            async for frame in frames:
+                ...
+
+        Iteration ends when capturing stops or the stream is closed.
+        Without "async with" call "FrameStream.close()" when done.
+
+        Keyword arguments:
+        output_format --- Format of frames
+        maxsize --- Maximum number of queued frames
+        policy --- "QueuePolicy.DropOldest" (default if None) or
+                   "QueuePolicy.DropNewest"
+        target_fps --- Deliver frames at this rate or None for all
+        every_nth --- Deliver only every n-th frame
+        skip_static --- Skip frames "change_detector" finds unchanged
+        """
+        stream = FTCamera.FrameStream(
+            self, output_format, max(maxsize, 1),
+            policy or FTCamera.QueuePolicy.DropOldest,
+            target_fps, every_nth, skip_static)
+        self._subscriptions.append(stream)
+        self._update_decoder()
+        self.resume_stream()
+        return stream
+
+    def unsubscribe(self: 'FTCamera',
+                    subscription: 'FTCamera.Subscription') -> None:
+        """Unsubscribe consumer if subscribed.
+
+        Keyword arguments:
+        subscription --- Subscription returned by "subscribe()"
+        """
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            subscription._stop()
+
+    async def close(self: 'FTCamera',
+                    keep_subscriptions: bool = False) -> None:
         """Closes the device if open.
 
-        If capturing stops capturing first.
+        If capturing stops capturing first. Unsubscribes all consumers
+        stopping their worker threads unless "keep_subscriptions" is True.
+
+        Keyword arguments:
+        keep_subscriptions --- Keep consumers subscribed to reopen the
+                               device with "open()" afterwards. Streams
+                               created by "frames()" end nevertheless
         """
         await self.stop_read()
+        if not keep_subscriptions:
+            for x in list(self._subscriptions):
+                self.unsubscribe(x)
         if not self._device:
             return
         FTCamera._logger.info("FTCamera.close: index {}".format(self._index))
+        if self._control_manager:
+            self._control_manager.close()
+            self._control_manager = None
         try:
             if isLinux:
                 self._device.close()
@@ -409,12 +1505,22 @@ class FTCamera:
         except Exception:
             pass
         self._device = None
+        self._controls = None
+
+    @property
+    def is_reading(self: 'FTCamera') -> bool:
+        """Capturing frames."""
+        return self._task_read is not None
 
     def start_read(self: 'FTCamera') -> None:
         """Start capturing frames if not capturing and device is open."""
         if self._task_read or not self._device:
             return
         FTCamera._logger.info("FTCamera.start_read: start read task")
+        self.resume_stream()
+        self._first_frame = True
+        self.last_frame_time = time.monotonic()
+        self._task_idle = aio.create_task(self._async_idle())
         if isLinux:
             self._task_read = aio.create_task(self._async_read())
         else:
@@ -428,25 +1534,29 @@ class FTCamera:
             self._task_process = aio.create_task(self._async_process())
 
     async def stop_read(self: 'FTCamera') -> None:
-        """Stop capturing frames if capturing."""
+        """Stop capturing frames if capturing.
+
+        Ends all frame streams created by "frames()".
+        """
+        for x in [x for x in self._subscriptions
+                  if isinstance(x, FTCamera.FrameStream)]:
+            self.unsubscribe(x)
         if not self._task_read or not self._device:
             return
         FTCamera._logger.info("FTCamera.stop_read: stop read task")
+        await self._cancel_task(self._task_idle)
+        self._task_idle = None
+        if self._task_resume:
+            await self._cancel_task(self._task_resume)
         if isLinux:
-            self._task_read.cancel()
-            try:
-                await self._task_read
-            except aio.CancelledError:
-                FTCamera._logger.info("FTCamera.stop_read: read task stopped")
+            await self._cancel_task(self._task_read)
+            FTCamera._logger.info("FTCamera.stop_read: read task stopped")
             self._task_read = None
         else:
             self._filter_graph.stop()
             self._task_read_stop = True
-            self._task_process.cancel()
-            try:
-                await self._task_process
-            except aio.CancelledError:
-                FTCamera._logger.info("FTCamera.stop_read: read task stopped")
+            await self._cancel_task(self._task_process)
+            FTCamera._logger.info("FTCamera.stop_read: read task stopped")
             self._task_process = None
             self._task_read.join(0.5)
             self._task_read = None
@@ -488,26 +1598,34 @@ class FTCamera:
         def _process_frame(self: 'FTCamera', frame: v4l.Frame) -> bool:
             """Process captured frames.
 
-            Operates only on YUV422 format right now. Calls _decode_yuv422
-            for processing the frame. See _decode_yuv422_y_only for an
-            optimized version producing only Y grayscale frame.
-
-            The captured frame is reshaped to (height, width, 3) before
-            sending it to "callback_frame".
+            The frame is decoded by "FrameDecoder" into the formats
+            requested by "callback_frame" and the subscribed consumers due
+            to receive this frame only. Setting the frame on the decoder
+            decodes nothing hence it is done before checking for due
+            consumers to allow detecting changes.
             """
-            if not self.callback_frame or len(frame.data) == 0:
+            if not self._count_frame(len(frame.data)):
+                return True
+            if self._first_frame:
+                self._on_first_frame()
+            if not self._has_consumers:
                 return True
 
             try:
-                match frame.pixel_format:
-                    case v4l.PixelFormat.YUYV:
-                        self._decode_yuv422(frame.data)
-                    case _:
-                        FTCamera._logger.error("Unsupported pixel format: {}".
-                                               format(frame.pixel_format))
-                        return False
-                self.callback_frame(self._arr_merge.reshape(
-                    [frame.height, frame.width, 3]))
+                self._frame.timestamp = frame.timestamp
+                self._frame.sequence = frame.frame_nb
+                if frame.pixel_format != self._format.pixel_format:
+                    FTCamera._logger.error("Unsupported pixel format: {}".
+                                           format(frame.pixel_format))
+                    return False
+                self._decoder.set_frame(
+                    np.frombuffer(frame.data, dtype=np.uint8))
+
+                due = self._due_subscriptions(
+                    frame.timestamp, self._detect_change())
+                if not due and not self._callback_frame:
+                    return True
+                self._send_frame(due)
 
             except aio.CancelledError:
                 raise
@@ -517,20 +1635,32 @@ class FTCamera:
             return True
     else:
         def _process_frame(self: 'FTCamera', frame: np.ndarray) -> bool:
-            if not self.callback_frame or len(frame) == 0:
+            if not self._count_frame(len(frame)):
+                return True
+            if self._first_frame:
+                self._on_first_frame()
+            if not self._has_consumers:
                 return True
             try:
+                self._frame.timestamp = time.monotonic()
+                self._frame.sequence += 1
                 match self._format.pixel_format:
                     case 'YUY2':
-                        self._decode_yuv422(frame)
+                        # frame is delivered with axes swapped. swapping
+                        # them back yields the memory order as a view
+                        self._decoder.set_frame(
+                            np.moveaxis(frame, 1, 0).reshape(-1))
                     case _:
                         FTCamera._logger.error(
                             "Unsupported pixel format: {}".format(
                                 self._format.pixel_format))
                         return False
-                self.callback_frame(
-                    self._arr_merge.reshape([self._frame_size.height,
-                                             self._frame_size.width, 3]))
+
+                due = self._due_subscriptions(
+                    self._frame.timestamp, self._detect_change())
+                if not due and not self._callback_frame:
+                    return True
+                self._send_frame(due)
             except aio.CancelledError:
                 raise
             except Exception:
@@ -538,39 +1668,212 @@ class FTCamera:
                 return False
             return True
 
-    if isLinux:
-        def _decode_yuv422(self: 'FTCamera', frame: list[bytes]) -> None:
-            """Decode YUV422 frame into YUV444 frame."""
-            self._arr_data[:] = np.frombuffer(frame, dtype=np.uint8)
-
-            self._arr_merge[:, 0] = np.array(self._arr_data[0::2])
-            self._arr_c2[:] = np.array(self._arr_data[1::4])
-            self._arr_c3[:] = np.array(self._arr_data[3::4])
-
-            self._arr_merge[0:self._pixel_count:2, 1] = self._arr_c2
-            self._arr_merge[1:self._pixel_count:2, 1] = self._arr_c2
-            self._arr_merge[0:self._pixel_count:2, 2] = self._arr_c3
-            self._arr_merge[1:self._pixel_count:2, 2] = self._arr_c3
-    else:
-        def _decode_yuv422(self: 'FTCamera', frame: np.ndarray) -> None:
-            self._arr_merge[:, 0] = frame[:, :, 0].ravel(order='F')
+    async def _async_idle(self: 'FTCamera') -> None:
+        """Suspend stream if idle for "idle_timeout" seconds.
+
+        Runs while capturing. The switch is called in a worker thread to
+        not block capturing. Consumers subscribing meanwhile resume the
+        stream once the switch is done. Failed switches are logged and
+        retried later.
+        """
+        while True:
+            await aio.sleep(FTCamera._IDLE_CHECK_INTERVAL)
+            if self.idle_timeout is None or not self.stream_switch:
+                continue
+            if self._has_consumers:
+                self._idle_since = None
+                if self._suspended:
+                    self.resume_stream()
+                continue
+            if self._suspended:
+                continue
+            now = time.monotonic()
+            if self._idle_since is None:
+                self._idle_since = now
+            if now - self._idle_since < self.idle_timeout:
+                continue
+            FTCamera._logger.info("suspend idle stream")
+            try:
+                await aio.to_thread(self.stream_switch, False)
+            except Exception:
+                FTCamera._logger.error(traceback.format_exc())
+                self._idle_since = time.monotonic()
+                continue
+            self._suspended = True
+            if self._has_consumers:
+                self.resume_stream()
 
-            self._arr_c2[:] = np.array(frame[:, :, 1:].ravel(order='F')[0::2])
-            self._arr_c3[:] = np.array(frame[:, :, 1:].ravel(order='F')[1::2])
+    async def _cancel_task(self: 'FTCamera', task: aio.Task) -> None:
+        """Cancel task and wait for it to finish.
 
-            self._arr_merge[0:self._pixel_count:2, 1] = self._arr_c2
-            self._arr_merge[1:self._pixel_count:2, 1] = self._arr_c2
-            self._arr_merge[0:self._pixel_count:2, 2] = self._arr_c3
-            self._arr_merge[1:self._pixel_count:2, 2] = self._arr_c3
+        Tolerates tasks finished already. Exceptions are logged.
 
-    def _decode_yuv422_y_only(self: 'FTCamera', frame: list[bytes]) -> None:
-        """Fast version of _decode_yuv422.
+        Keyword arguments:
+        task --- Task to cancel
+        """
+        task.cancel()
+        try:
+            await task
+        except aio.CancelledError:
+            pass
+        except Exception:
+            FTCamera._logger.error(traceback.format_exc())
 
-        This version is faster since it only copies the Y channel
-        of the image data. The result is thus a single channel
-        image (grayscale image). This is suitible for cameras
-        like the VIVE that output the same image on all channels
+    def _count_frame(self: 'FTCamera', size: int) -> bool:
+        """Update frame statistics. Returns False if the frame is empty.
+
+        Keyword arguments:
+        size --- Size of frame data in bytes
         """
-        self._arr_data[:] = np.frombuffer(frame, dtype=np.uint8)
+        if size == 0:
+            self.empty_frames += 1
+            return False
+        self.frames_received += 1
+        self.last_frame_time = time.monotonic()
+        return True
+
+    def _on_first_frame(self: 'FTCamera') -> None:
+        """First frame has been captured since capturing started.
+
+        Logs the startup profile and caches the configuration in use
+        as known-good for "fast_open".
+        """
+        self._first_frame = False
+        if self.profiler:
+            self.profiler.mark("first frame")
+            self.profiler.report()
+        DeviceCache.put(self._device_key, self._device_config())
+
+    def _requested_formats(self: 'FTCamera') -> "list[OutputFormat]":
+        """List of formats requested by callback and subscriptions."""
+        formats = []
+        if self._callback_frame:
+            formats.append(self.output_format)
+        for x in self._subscriptions:
+            if x.output_format not in formats:
+                formats.append(x.output_format)
+        return formats
+
+    @property
+    def _has_consumers(self: 'FTCamera') -> bool:
+        """Callback or subscriptions are present."""
+        return self._callback_frame is not None\
+            or len(self._subscriptions) > 0
+
+    def _detect_change(self: 'FTCamera') -> bool:
+        """Detect if the frame set on the decoder changed.
 
-        self._arr_merge[:, 0] = np.array(self._arr_data[0::2])
+        Updates "changed" and "difference" of the frame metadata.
+        Returns True if "change_detector" is not set.
+        """
+        detector = self.change_detector
+        if not detector:
+            self._frame.changed = True
+            self._frame.difference = None
+            return True
+        self._frame.changed = detector.update(
+            self._decoder.luma_sample(detector.step))
+        self._frame.difference = detector.difference
+        return self._frame.changed
+
+    def _due_subscriptions(self: 'FTCamera', timestamp: float,
+                           changed: bool) -> "list[FTCamera.Subscription]":
+        """List of subscriptions due to receive frame.
+
+        Subscriptions skipping static frames do not count unchanged
+        frames towards "every_nth" and "target_fps".
+
+        Keyword arguments:
+        timestamp --- Capture time of frame in seconds
+        changed --- Frame changed
+        """
+        tolerance = 0.5 / max(self.frame_fps, 1.0)
+        self._due.clear()
+        for x in self._subscriptions:
+            if (changed or not x.skip_static)\
+                    and x._is_due(timestamp, tolerance):
+                self._due.append(x)
+        return self._due
+
+    def _send_frame(self: 'FTCamera',
+                    due: "list[FTCamera.Subscription]") -> None:
+        """Send decoded frame to callback and subscriptions due.
+
+        Inline subscriptions receive a frame record per format reused
+        for every frame. Queued subscriptions receive a read-only copy
+        from a frame pool. Each format is copied once per frame and
+        shared among all queued subscriptions.
+
+        Keyword arguments:
+        due --- Subscriptions due to receive the frame
+        """
+        if self._callback_frame:
+            self._callback_frame(self._decoder.get(self.output_format))
+
+        metadata = self._frame
+        metadata.exposure = self.exposure
+        metadata.gain = self.gain
+        snapshots = self._snapshots
+        snapshots.clear()
+        for subscription in due:
+            output_format = subscription.output_format
+            frame = self._inline_frames.get(output_format)
+            if frame is None:
+                frame = Frame()
+                self._inline_frames[output_format] = frame
+            frame.copy_metadata(metadata)
+            frame.output_format = output_format
+            frame.eye_layout = self._frame_eye_layout(output_format)
+            frame.data = self._decoder.get(output_format)
+            if subscription.is_queued:
+                snapshot = snapshots.get(output_format)
+                if snapshot is None:
+                    snapshot = self._pool(output_format).acquire(
+                        frame.data, frame)
+                    snapshots[output_format] = snapshot
+                frame = snapshot
+            subscription._push(frame)
+
+    def _pool(self: 'FTCamera', output_format: OutputFormat) -> FramePool:
+        """Frame pool for format creating it if absent.
+
+        Pools are sized for the full frame hence changing the region
+        of interest does not reallocate them.
+
+        Keyword arguments:
+        output_format --- Format of frames
+        """
+        pool = self._pools.get(output_format)
+        if pool is None:
+            pool = FramePool(output_format,
+                             self._decoder.full_shape(output_format))
+            self._pools[output_format] = pool
+        return pool
+
+    def _update_eye_layout(self: 'FTCamera') -> None:
+        """Update eye layout of frames from region of interest."""
+        roi = self._decoder.roi
+        half = self._frame_width // 2
+        full = self._frame_height
+        if roi == FrameRoi(0, 0, half * 2, full):
+            self._eye_layout = EyeLayout.SideBySide
+        elif roi == FrameRoi(0, 0, half, full):
+            self._eye_layout = EyeLayout.Left
+        elif roi == FrameRoi(half, 0, half, full):
+            self._eye_layout = EyeLayout.Right
+        else:
+            self._eye_layout = EyeLayout.Region
+
+    def _frame_eye_layout(self: 'FTCamera',
+                          output_format: OutputFormat) -> EyeLayout:
+        """Eye layout of frames in format.
+
+        Keyword arguments:
+        output_format --- Format of frames
+        """
+        if self._eye_layout == EyeLayout.SideBySide:
+            if output_format == OutputFormat.EyeLeft:
+                return EyeLayout.Left
+            if output_format == OutputFormat.EyeRight:
+                return EyeLayout.Right
+        return self._eye_layout
@@ -0,0 +1,360 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import traceback
+import threading
+import platform
+import logging
+import ctypes
+import errno
+import time
+
+isLinux = platform.system() == 'Linux'
+
+if isLinux:
+    import fcntl
+    import v4l2py.raw as v4lr
+    import v4l2py.device as v4ld
+
+    class _v4l2_ext_control(ctypes.Structure):
+        class _u(ctypes.Union):
+            _pack_ = 1
+            _fields_ = [
+                ('value', ctypes.c_int32),
+                ('value64', ctypes.c_int64),
+                ('ptr', ctypes.c_void_p),
+            ]
+
+        _pack_ = 1
+        _anonymous_ = ('_u',)
+        _fields_ = [
+            ('id', ctypes.c_uint32),
+            ('size', ctypes.c_uint32),
+            ('reserved2', ctypes.c_uint32 * 1),
+            ('_u', _u),
+        ]
+
+    class _v4l2_ext_controls(ctypes.Structure):
+        _fields_ = [
+            ('which', ctypes.c_uint32),
+            ('count', ctypes.c_uint32),
+            ('error_idx', ctypes.c_uint32),
+            ('request_fd', ctypes.c_int32),
+            ('reserved', ctypes.c_uint32 * 1),
+            ('controls', ctypes.POINTER(_v4l2_ext_control)),
+        ]
+
+    # v4l2py defines these structures without "request_fd" and without
+    # packing. the resulting ioctl numbers are rejected by the kernel
+    _VIDIOC_G_EXT_CTRLS = v4lr._IOWR('V', 71, _v4l2_ext_controls)
+    _VIDIOC_S_EXT_CTRLS = v4lr._IOWR('V', 72, _v4l2_ext_controls)
+    _V4L2_CTRL_WHICH_CUR_VAL = 0
+
+
+class ControlManager:
+    """Cached, batched and coalesced access to device controls.
+
+    Reading a control value directly is an ioctl each time which with
+    UVC devices is a USB transfer competing with the streaming. This
+    manager caches values. The first read of an uncached value reads
+    all registered controls using a single "VIDIOC_G_EXT_CTRLS".
+    Volatile controls, for example values changed by the device itself,
+    are always read.
+
+    Writes are coalesced. Only the last value written to a control is
+    send to the device and writes are send at most once every
+    "min_interval" seconds using a single "VIDIOC_S_EXT_CTRLS". The
+    cached value is updated right away. If a delayed write fails the
+    error is logged and the cached values of the failed controls are
+    discarded. Use "flush()" to write right away and receive errors.
+
+    Falls back to per-control ioctls if the driver does not support
+    extended controls. Values are 32-bit integers.
+    """
+
+    _logger = logging.getLogger("evcta.ControlManager")
+
+    def __init__(self: 'ControlManager', fd: int,
+                 min_interval: float = 0.05) -> None:
+        """Create control manager.
+
+        Keyword arguments:
+        fd --- File descriptor of device
+        min_interval --- Minimum time in seconds between writes
+        """
+        self._fd = fd
+        self.min_interval = min_interval
+        """Minimum time in seconds between writes."""
+        self._ids: "list[int]" = []
+        self._values: "dict[int, int]" = {}
+        self._pending: "dict[int, int]" = {}
+        self._lock = threading.RLock()
+        self._timer: threading.Timer = None
+        self._last_write = 0.0
+        self._extended = True
+        self.reads: int = 0
+        """Number of read ioctls done."""
+        self.writes: int = 0
+        """Number of write ioctls done."""
+
+    def register(self: 'ControlManager', control_id: int) -> None:
+        """Register control to read along with other controls.
+
+        Keyword arguments:
+        control_id --- Identifier of control
+        """
+        if control_id not in self._ids:
+            self._ids.append(control_id)
+
+    def get(self: 'ControlManager', control_id: int,
+            volatile: bool = False) -> int:
+        """Value of control.
+
+        Keyword arguments:
+        control_id --- Identifier of control
+        volatile --- Value can change without being written. Always
+                     reads the value from the device.
+        """
+        with self._lock:
+            if volatile:
+                pending = self._pending.get(control_id)
+                if pending is not None:
+                    return pending
+                return self._read([control_id])[control_id]
+            value = self._values.get(control_id)
+            if value is None:
+                ids = [x for x in self._ids if x not in self._values]
+                if control_id not in ids:
+                    ids.append(control_id)
+                self._values.update(self._read(ids))
+                value = self._values[control_id]
+            return value
+
+    def set(self: 'ControlManager', control_id: int, value: int) -> None:
+        """Set value of control.
+
+        The value is written right away if no write happened during the
+        last "min_interval" seconds. Otherwise the write is delayed and
+        coalesced with other writes.
+
+        Throws "Exception" if writing right away fails.
+
+        Keyword arguments:
+        control_id --- Identifier of control
+        value --- Value to set
+        """
+        with self._lock:
+            self._pending[control_id] = value
+            self._values[control_id] = value
+            if self._timer:
+                return
+            delay = self._last_write + self.min_interval - time.monotonic()
+            if delay > 0:
+                self._timer = threading.Timer(delay, self._write_delayed)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            self.flush()
+
+    def flush(self: 'ControlManager') -> None:
+        """Write pending values right away.
+
+        Throws "Exception" if writing fails. Cached values of failed
+        controls are discarded.
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            values = self._pending
+            self._pending = {}
+            self.write(values)
+
+    def write(self: 'ControlManager', values: "dict[int, int]") -> None:
+        """Write values right away in one transaction.
+
+        Values are written ordered by control identifier. This writes
+        automatic mode controls before the controls they affect.
+
+        Throws "Exception" if writing fails. Cached values of failed
+        controls are discarded.
+
+        Keyword arguments:
+        values --- Dictionary mapping control identifier to value
+        """
+        with self._lock:
+            ids = sorted(values.keys())
+            for x in ids:
+                self._pending.pop(x, None)
+            self._last_write = time.monotonic()
+            try:
+                self._write(ids, values)
+                self._values.update(values)
+            except Exception:
+                self.invalidate(ids)
+                raise
+
+    def refresh(self: 'ControlManager') -> None:
+        """Read all registered controls from the device."""
+        with self._lock:
+            self._values.update(self._read(
+                [x for x in self._ids if x not in self._pending]))
+
+    def invalidate(self: 'ControlManager',
+                   ids: "list[int] | None" = None) -> None:
+        """Discard cached values.
+
+        Keyword arguments:
+        ids --- Identifiers of controls or None for all
+        """
+        with self._lock:
+            if ids is None:
+                self._values.clear()
+            else:
+                for x in ids:
+                    self._values.pop(x, None)
+
+    def snapshot(self: 'ControlManager',
+                 ids: "list[int]") -> "dict[int, int]":
+        """Values of controls.
+
+        Keyword arguments:
+        ids --- Identifiers of controls
+        """
+        with self._lock:
+            return {x: self.get(x) for x in ids}
+
+    def restore(self: 'ControlManager', values: "dict[int, int]") -> None:
+        """Write values differing from the current ones in one transaction.
+
+        Throws "Exception" if writing fails.
+
+        Keyword arguments:
+        values --- Dictionary mapping control identifier to value
+        """
+        with self._lock:
+            self.flush()
+            changed = {k: v for k, v in values.items() if self.get(k) != v}
+            if changed:
+                self.write(changed)
+
+    def close(self: 'ControlManager') -> None:
+        """Write pending values. Call before closing the device."""
+        try:
+            self.flush()
+        except Exception:
+            ControlManager._logger.error(traceback.format_exc())
+
+    def _write_delayed(self: 'ControlManager') -> None:
+        """Timer writing coalesced values."""
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                return  # cancelled while waiting for the lock
+            self._timer = None
+            try:
+                self.flush()
+            except Exception:
+                ControlManager._logger.error(traceback.format_exc())
+
+    def _read(self: 'ControlManager', ids: "list[int]") -> "dict[int, int]":
+        """Read values from device.
+
+        Keyword arguments:
+        ids --- Identifiers of controls
+        """
+        if self._extended:
+            try:
+                controls = self._ext_controls(ids, None)
+                self.reads += 1
+                fcntl.ioctl(self._fd, _VIDIOC_G_EXT_CTRLS, controls)
+                return {ids[i]: controls.controls[i].value
+                        for i in range(len(ids))}
+            except OSError as e:
+                if len(ids) == 1 and e.errno != errno.ENOTTY:
+                    raise
+                self._check_extended(e)
+        values = {}
+        for x in ids:
+            self.reads += 1
+            values[x] = v4ld.get_control(self._fd, x)
+        return values
+
+    def _write(self: 'ControlManager', ids: "list[int]",
+               values: "dict[int, int]") -> None:
+        """Write values to device.
+
+        Keyword arguments:
+        ids --- Identifiers of controls in the order to write
+        values --- Dictionary mapping control identifier to value
+        """
+        if self._extended:
+            try:
+                controls = self._ext_controls(ids, values)
+                self.writes += 1
+                fcntl.ioctl(self._fd, _VIDIOC_S_EXT_CTRLS, controls)
+                return
+            except OSError as e:
+                if len(ids) == 1 and e.errno != errno.ENOTTY:
+                    raise
+                self._check_extended(e)
+        # write one by one to find the failing control. writes the
+        # other controls nevertheless
+        error = None
+        for x in ids:
+            try:
+                self.writes += 1
+                v4ld.set_control(self._fd, x, values[x])
+            except OSError as e:
+                error = error or e
+        if error:
+            raise error
+
+    def _ext_controls(self: 'ControlManager', ids: "list[int]",
+                      values: "dict[int, int] | None"
+                      ) -> '_v4l2_ext_controls':
+        """Create extended controls structure.
+
+        Keyword arguments:
+        ids --- Identifiers of controls
+        values --- Dictionary mapping identifier to value or None
+        """
+        array = (_v4l2_ext_control * len(ids))()
+        for i, x in enumerate(ids):
+            array[i].id = x
+            if values:
+                array[i].value = values[x]
+        controls = _v4l2_ext_controls()
+        controls.which = _V4L2_CTRL_WHICH_CUR_VAL
+        controls.count = len(ids)
+        controls.controls = array
+        return controls
+
+    def _check_extended(self: 'ControlManager', error: OSError) -> None:
+        """Disable extended controls if unsupported by the driver."""
+        if error.errno == errno.ENOTTY:
+            ControlManager._logger.info(
+                "extended controls not supported. using single controls")
+            self._extended = False
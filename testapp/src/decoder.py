@@ -0,0 +1,893 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from enum import Enum
+import platform
+import logging
+import timeit
+import json
+import os
+
+import cv2 as cv
+import numpy as np
+
+
+class OutputFormat(Enum):
+    """Format of frames send to consumers."""
+    YUV444 = 'yuv444'
+    """Interleaved YUV444 of shape (height, width, 3)."""
+    YUV444Planar = 'yuv444p'
+    """Planar YUV444 of shape (3, height, width)."""
+    Gray8 = 'gray8'
+    """Y channel only of shape (height, width)."""
+    EyeLeft = 'eyeleft'
+    """Y channel of left half of shape (height, width / 2)."""
+    EyeRight = 'eyeright'
+    """Y channel of right half of shape (height, width / 2)."""
+    BGR = 'bgr'
+    """YUV converted to BGR of shape (height, width, 3)."""
+    Preview = 'preview'
+    """Y channel at half resolution of shape (height / 2, width / 2).
+
+    Odd sizes are rounded up."""
+
+
+class StereoSide(Enum):
+    """Side of stereo frames holding the image of one camera."""
+    Left = 'left'
+    Right = 'right'
+
+
+class FrameRoi:
+    """Region of interest in pixels."""
+    def __init__(self: 'FrameRoi', x: int, y: int,
+                 width: int, height: int) -> None:
+        """Create region of interest.
+
+        Keyword arguments:
+        x --- Left edge in pixels
+        y --- Top edge in pixels
+        width --- Width in pixels
+        height --- Height in pixels
+        """
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __repr__(self: 'FrameRoi') -> str:
+        return "(x={}, y={}, width={}, height={})".format(
+            self.x, self.y, self.width, self.height)
+
+    def __eq__(self: 'FrameRoi', other: object) -> bool:
+        return isinstance(other, FrameRoi)\
+            and self.x == other.x and self.y == other.y\
+            and self.width == other.width and self.height == other.height
+
+
+class FrameDecoder:
+    """Decodes captured YUV422 frames into output formats on demand.
+
+    This is the NumPy backend and the base class of all backends. See
+    "DecoderRegistry" for the available backends. Backends decoding
+    other pixel formats set "pixel_format" and "frame_bytes()".
+
+    Set the captured frame using "set_frame()" then call "get()" for
+    each format required. Each format is decoded directly from the
+    captured data using the cheapest way to produce it. Formats are
+    decoded at most once per frame. Consumers requesting the same
+    format share the same array.
+
+    An optional region of interest restricts decoding to a part of the
+    frame. All formats are produced from the region of interest only.
+    Pixels outside are never touched hence decoding cost scales with
+    the size of the region of interest.
+
+    Arrays are allocated on first use with the size of the full frame
+    and reused for all following frames. Changing the region of interest
+    only changes the views into these arrays. Arrays are thus only valid
+    until the next frame is set.
+    """
+
+    _CHROMA_SPLAT = np.uint16(0x0101)
+
+    pixel_format = 'YUYV'
+    """Pixel format decoded as Video4Linux four character code."""
+
+    @staticmethod
+    def frame_bytes(width: int, height: int) -> int:
+        """Size in bytes of captured frames.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        return width * height * 2
+
+    def __init__(self: 'FrameDecoder', width: int, height: int) -> None:
+        """Create frame decoder.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        self.name: str = None
+        """Name of backend set by "DecoderRegistry.create()"."""
+        self._frame_width = width
+        self._frame_height = height
+        self._roi = FrameRoi(0, 0, width, height)
+        self._width = width
+        self._height = height
+        self._half_width = width // 2
+        self._data: np.ndarray = None
+        self._region: np.ndarray = None
+        self._buffers: dict[OutputFormat: np.ndarray] = {}
+        self._arrays: dict[OutputFormat: np.ndarray] = {}
+        self._decoded: dict[OutputFormat: np.ndarray] = {}
+        self._decoders = {
+            OutputFormat.YUV444: self._decode_yuv444,
+            OutputFormat.YUV444Planar: self._decode_yuv444_planar,
+            OutputFormat.Gray8: self._decode_gray8,
+            OutputFormat.EyeLeft: self._decode_eye_left,
+            OutputFormat.EyeRight: self._decode_eye_right,
+            OutputFormat.BGR: self._decode_bgr,
+            OutputFormat.Preview: self._decode_preview}
+
+    @property
+    def frame_width(self: 'FrameDecoder') -> int:
+        """Width in pixels of captured frames."""
+        return self._frame_width
+
+    @property
+    def frame_height(self: 'FrameDecoder') -> int:
+        """Height in pixels of captured frames."""
+        return self._frame_height
+
+    @property
+    def width(self: 'FrameDecoder') -> int:
+        """Width in pixels of decoded frames."""
+        return self._width
+
+    @property
+    def height(self: 'FrameDecoder') -> int:
+        """Height in pixels of decoded frames."""
+        return self._height
+
+    @property
+    def roi(self: 'FrameDecoder') -> FrameRoi:
+        """Region of interest in effect."""
+        return self._roi
+
+    def set_roi(self: 'FrameDecoder',
+                roi: 'FrameRoi | StereoSide | None') -> None:
+        """Set region of interest.
+
+        The region is clamped to the frame. Since YUV422 stores chroma
+        for pairs of pixels the left edge is rounded down and the width
+        rounded up to multiples of 2. Use "roi" to get the region in
+        effect. Can be changed while capturing. The change is applied
+        with the next frame.
+
+        Throws "Exception" if the region is empty.
+
+        Keyword arguments:
+        roi --- Region of interest, stereo side or None to use the
+                full frame.
+        """
+        fw = self._frame_width
+        fh = self._frame_height
+        if roi is None:
+            roi = FrameRoi(0, 0, fw, fh)
+        elif isinstance(roi, StereoSide):
+            half = fw // 2
+            roi = FrameRoi(0 if roi == StereoSide.Left else half, 0, half, fh)
+
+        x = min(max(roi.x, 0), fw) & ~1
+        y = min(max(roi.y, 0), fh)
+        right = min(max(roi.x + roi.width, 0), fw)
+        right = min(right + (right - x) % 2, fw)
+        bottom = min(max(roi.y + roi.height, 0), fh)
+        if right - x < 2 or bottom - y < 1:
+            raise Exception("Empty region of interest: {}".format(roi))
+
+        roi = FrameRoi(x, y, right - x, bottom - y)
+        if roi == self._roi:
+            return
+        self._roi = roi
+        self._width = roi.width
+        self._height = roi.height
+        self._half_width = roi.width // 2
+        self._arrays.clear()
+        self._decoded.clear()
+        self._region = None
+
+    def shape(self: 'FrameDecoder', output_format: OutputFormat) -> tuple:
+        """Shape of decoded frames.
+
+        Keyword arguments:
+        output_format --- Output format
+        """
+        return self._shape(output_format, self._width, self._height)
+
+    def full_shape(self: 'FrameDecoder',
+                   output_format: OutputFormat) -> tuple:
+        """Shape of decoded frames without region of interest.
+
+        This is the largest shape "shape()" can return.
+
+        Keyword arguments:
+        output_format --- Output format
+        """
+        return self._shape(output_format, self._frame_width,
+                           self._frame_height)
+
+    def set_frame(self: 'FrameDecoder', data: np.ndarray) -> None:
+        """Set captured frame to decode.
+
+        Discards all formats decoded for the previous frame.
+
+        Keyword arguments:
+        data --- Captured frame as flat uint8 array in the byte order
+                 of "pixel_format"
+        """
+        self._data = data
+        self._region = None
+        self._decoded.clear()
+
+    def get(self: 'FrameDecoder', output_format: OutputFormat) -> np.ndarray:
+        """Get frame decoded into output format.
+
+        Decodes the frame if not decoded yet into this format.
+
+        Keyword arguments:
+        output_format --- Output format
+        """
+        image = self._decoded.get(output_format)
+        if image is None:
+            image = self._decoders[output_format](
+                self._array(output_format))
+            self._decoded[output_format] = image
+        return image
+
+    def _shape(self: 'FrameDecoder', output_format: OutputFormat,
+               width: int, height: int) -> tuple:
+        """Shape of frames of size decoded into output format."""
+        match output_format:
+            case OutputFormat.YUV444 | OutputFormat.BGR:
+                return (height, width, 3)
+            case OutputFormat.YUV444Planar:
+                return (3, height, width)
+            case OutputFormat.Gray8:
+                return (height, width)
+            case OutputFormat.EyeLeft | OutputFormat.EyeRight:
+                return (height, width // 2)
+            case OutputFormat.Preview:
+                return ((height + 1) // 2, (width + 1) // 2)
+
+    def _array(self: 'FrameDecoder',
+               output_format: OutputFormat) -> np.ndarray:
+        """Get array to decode format into.
+
+        The returned array is a contiguous view into a buffer large
+        enough for the full frame. The buffer is created if absent.
+        """
+        array = self._arrays.get(output_format)
+        if array is None:
+            buffer = self._buffers.get(output_format)
+            if buffer is None:
+                buffer = np.empty(self._shape(
+                    output_format, self._frame_width, self._frame_height),
+                    dtype=np.uint8).reshape(-1)
+                self._buffers[output_format] = buffer
+            shape = self.shape(output_format)
+            array = buffer[:np.prod(shape)].reshape(shape)
+            self._arrays[output_format] = array
+        return array
+
+    def luma_sample(self: 'FrameDecoder', step: int) -> np.ndarray:
+        """Strided view of the Y channel of the region of interest.
+
+        Only every step-th pixel of every step-th row is included. No
+        pixels are decoded or copied. Valid until the next frame is set.
+
+        Keyword arguments:
+        step --- Distance in pixels between samples
+        """
+        return self._rows()[::step, 0::2 * step]
+
+    def _rows(self: 'FrameDecoder') -> np.ndarray:
+        """View of region of interest of captured frame as rows of bytes."""
+        if self._region is None:
+            roi = self._roi
+            self._region = self._data.reshape(
+                [self._frame_height, self._frame_width * 2])[
+                    roi.y:roi.y + roi.height,
+                    roi.x * 2:(roi.x + roi.width) * 2]
+        return self._region
+
+    def _decode_yuv444(self: 'FrameDecoder', out: np.ndarray) -> np.ndarray:
+        """Decode into interleaved YUV444 using strided writes only."""
+        rows = self._rows()
+        out[:, :, 0] = rows[:, 0::2]
+        out[:, 0::2, 1] = rows[:, 1::4]
+        out[:, 1::2, 1] = rows[:, 1::4]
+        out[:, 0::2, 2] = rows[:, 3::4]
+        out[:, 1::2, 2] = rows[:, 3::4]
+        return out
+
+    def _decode_yuv444_planar(self: 'FrameDecoder',
+                              out: np.ndarray) -> np.ndarray:
+        """Decode into planar YUV444.
+
+        Each plane is written using a single vectorized operation. The
+        chroma planes are upsampled by viewing each plane as uint16 and
+        multiplying the U/V sample by 0x0101. This stores the sample into
+        both pixels of the macro pixel at once independent of byte order.
+        No temporary arrays are created.
+        """
+        rows = self._rows()
+        out[0] = rows[:, 0::2]
+        np.multiply(rows[:, 1::4], FrameDecoder._CHROMA_SPLAT,
+                    out=out[1].view(np.uint16))
+        np.multiply(rows[:, 3::4], FrameDecoder._CHROMA_SPLAT,
+                    out=out[2].view(np.uint16))
+        return out
+
+    def _decode_gray8(self: 'FrameDecoder', out: np.ndarray) -> np.ndarray:
+        """Decode Y channel only. The chroma bytes are never touched."""
+        out[:] = self._rows()[:, 0::2]
+        return out
+
+    def _decode_eye_left(self: 'FrameDecoder',
+                         out: np.ndarray) -> np.ndarray:
+        """Decode Y channel of left half only."""
+        out[:] = self._rows()[:, 0:self._half_width * 2:2]
+        return out
+
+    def _decode_eye_right(self: 'FrameDecoder',
+                          out: np.ndarray) -> np.ndarray:
+        """Decode Y channel of right half only."""
+        out[:] = self._rows()[:, self._width::2]
+        return out
+
+    def _decode_bgr(self: 'FrameDecoder', out: np.ndarray) -> np.ndarray:
+        """Convert YUV422 to BGR using OpenCV."""
+        cv.cvtColor(self._rows().reshape([self._height, self._width, 2]),
+                    cv.COLOR_YUV2BGR_YUYV, dst=out)
+        return out
+
+    def _decode_preview(self: 'FrameDecoder', out: np.ndarray) -> np.ndarray:
+        """Decode Y channel of every second pixel of every second row."""
+        out[:] = self._rows()[0::2, 0::4]
+        return out
+
+
+class FrameDecoderOpenCV(FrameDecoder):
+    """OpenCV backend of FrameDecoder.
+
+    Uses the optimized OpenCV conversions where OpenCV provides one.
+    All other formats are decoded the same way as the NumPy backend.
+    """
+
+    def __init__(self: 'FrameDecoderOpenCV', width: int, height: int) -> None:
+        """Create frame decoder.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        super().__init__(width, height)
+        self._arr_chroma = np.empty([height, (width + 1) // 2], np.uint8)
+
+    def _macro_pixels(self: 'FrameDecoderOpenCV') -> np.ndarray:
+        """View of region of interest as 4-channel macro pixels."""
+        return self._rows().reshape([self._height, self._half_width, 4])
+
+    def _decode_yuv444_planar(self: 'FrameDecoderOpenCV',
+                              out: np.ndarray) -> np.ndarray:
+        """Decode into planar YUV444.
+
+        Extracts the channels using "cv.extractChannel". The chroma
+        channels are upsampled using nearest neighbor "cv.resize".
+        """
+        pixels = self._macro_pixels()
+        chroma = self._arr_chroma[:self._height, :self._half_width]
+        size = (self._width, self._height)
+        cv.extractChannel(self._rows().reshape(
+            [self._height, self._width, 2]), 0, dst=out[0])
+        cv.extractChannel(pixels, 1, dst=chroma)
+        cv.resize(chroma, size, dst=out[1], interpolation=cv.INTER_NEAREST)
+        cv.extractChannel(pixels, 3, dst=chroma)
+        cv.resize(chroma, size, dst=out[2], interpolation=cv.INTER_NEAREST)
+        return out
+
+    def _decode_gray8(self: 'FrameDecoderOpenCV',
+                      out: np.ndarray) -> np.ndarray:
+        """Decode Y channel only using "cv.cvtColor"."""
+        cv.cvtColor(self._rows().reshape([self._height, self._width, 2]),
+                    cv.COLOR_YUV2GRAY_YUYV, dst=out)
+        return out
+
+    def _decode_eye_left(self: 'FrameDecoderOpenCV',
+                         out: np.ndarray) -> np.ndarray:
+        """Decode Y channel of left half only using "cv.extractChannel"."""
+        cv.extractChannel(self._rows()[:, 0:self._half_width * 2].reshape(
+            [self._height, self._half_width, 2]), 0, dst=out)
+        return out
+
+    def _decode_eye_right(self: 'FrameDecoderOpenCV',
+                          out: np.ndarray) -> np.ndarray:
+        """Decode Y channel of right half only using "cv.extractChannel"."""
+        cv.extractChannel(self._rows()[:, self._width:].reshape(
+            [self._height, self._half_width, 2]), 0, dst=out)
+        return out
+
+
+class FrameDecoderView(FrameDecoder):
+    """Pure view backend of FrameDecoder.
+
+    Formats containing only the Y channel are returned as strided views
+    into the captured frame without copying any pixels. All other
+    formats are decoded the same way as the NumPy backend.
+
+    The views are read-only and not contiguous. They are only valid as
+    long as the captured frame is. Under Linux each captured frame is
+    a new buffer kept alive by the view. Under Windows the buffer is
+    reused by DirectShow hence views must not be kept past the callback.
+    Because of these restrictions this backend is not auto-selected.
+    """
+
+    def _array(self: 'FrameDecoderView',
+               output_format: OutputFormat) -> np.ndarray:
+        match output_format:
+            case OutputFormat.Gray8 | OutputFormat.EyeLeft\
+                    | OutputFormat.EyeRight | OutputFormat.Preview:
+                return None
+        return super()._array(output_format)
+
+    def _decode_gray8(self: 'FrameDecoderView', out: None) -> np.ndarray:
+        return self._rows()[:, 0::2]
+
+    def _decode_eye_left(self: 'FrameDecoderView', out: None) -> np.ndarray:
+        return self._rows()[:, 0:self._half_width * 2:2]
+
+    def _decode_eye_right(self: 'FrameDecoderView', out: None) -> np.ndarray:
+        return self._rows()[:, self._width::2]
+
+    def _decode_preview(self: 'FrameDecoderView', out: None) -> np.ndarray:
+        return self._rows()[0::2, 0::4]
+
+
+class FrameDecoderLuma(FrameDecoder):
+    """Base class of decoders for formats with a full resolution Y plane.
+
+    Formats containing only the Y channel are returned as read-only
+    strided views into the captured frame without copying any pixels.
+    The views are only valid as long as the captured frame is. Under
+    Linux each captured frame is a new buffer kept alive by the view.
+
+    The Y plane starts the captured frame. Subclasses set the distance
+    in bytes between Y samples and the offset of the Y byte inside a
+    sample. Formats without chroma use the neutral chroma value 128.
+    """
+
+    _CHROMA_NEUTRAL = 128
+
+    _luma_step = 1
+    """Distance in bytes between Y samples."""
+
+    _luma_offset = 0
+    """Offset in bytes of the Y byte inside a sample."""
+
+    def _luma(self: 'FrameDecoderLuma') -> np.ndarray:
+        """View of region of interest of the Y plane as uint8."""
+        if self._region is None:
+            roi = self._roi
+            step = self._luma_step
+            fw = self._frame_width * step
+            fh = self._frame_height
+            self._region = self._data[:fw * fh].reshape([fh, fw])[
+                roi.y:roi.y + roi.height,
+                roi.x * step + self._luma_offset:
+                (roi.x + roi.width) * step:step]
+        return self._region
+
+    def luma_sample(self: 'FrameDecoderLuma', step: int) -> np.ndarray:
+        return self._luma()[::step, ::step]
+
+    def _array(self: 'FrameDecoderLuma',
+               output_format: OutputFormat) -> np.ndarray:
+        """Get array to decode format into.
+
+        Chroma of YUV arrays is filled with the neutral value once the
+        array is created. Decoding then copies only the Y channel.
+        """
+        match output_format:
+            case OutputFormat.Gray8 | OutputFormat.EyeLeft\
+                    | OutputFormat.EyeRight | OutputFormat.Preview:
+                return None
+        array = self._arrays.get(output_format)
+        if array is None:
+            array = super()._array(output_format)
+            match output_format:
+                case OutputFormat.YUV444:
+                    array[:, :, 1:] = FrameDecoderLuma._CHROMA_NEUTRAL
+                case OutputFormat.YUV444Planar:
+                    array[1:] = FrameDecoderLuma._CHROMA_NEUTRAL
+        return array
+
+    def _decode_yuv444(self: 'FrameDecoderLuma',
+                       out: np.ndarray) -> np.ndarray:
+        out[:, :, 0] = self._luma()
+        return out
+
+    def _decode_yuv444_planar(self: 'FrameDecoderLuma',
+                              out: np.ndarray) -> np.ndarray:
+        out[0] = self._luma()
+        return out
+
+    def _decode_gray8(self: 'FrameDecoderLuma', out: None) -> np.ndarray:
+        return self._luma()
+
+    def _decode_eye_left(self: 'FrameDecoderLuma', out: None) -> np.ndarray:
+        return self._luma()[:, 0:self._half_width]
+
+    def _decode_eye_right(self: 'FrameDecoderLuma', out: None) -> np.ndarray:
+        return self._luma()[:, self._width - self._half_width:]
+
+    def _decode_bgr(self: 'FrameDecoderLuma', out: np.ndarray) -> np.ndarray:
+        cv.cvtColor(self._luma(), cv.COLOR_GRAY2BGR, dst=out)
+        return out
+
+    def _decode_preview(self: 'FrameDecoderLuma', out: None) -> np.ndarray:
+        return self._luma()[0::2, 0::2]
+
+
+class FrameDecoderGrey(FrameDecoderLuma):
+    """Decoder for 8-bit grayscale frames (GREY, also known as Y8)."""
+
+    pixel_format = 'GREY'
+
+    @staticmethod
+    def frame_bytes(width: int, height: int) -> int:
+        return width * height
+
+
+class FrameDecoderY16(FrameDecoderLuma):
+    """Decoder for 16-bit little endian grayscale frames (Y16).
+
+    The 8-bit Y channel is the high byte of each sample. It is viewed
+    directly hence no conversion pass is required.
+    """
+
+    pixel_format = 'Y16'
+    _luma_step = 2
+    _luma_offset = 1
+
+    @staticmethod
+    def frame_bytes(width: int, height: int) -> int:
+        return width * height * 2
+
+
+class FrameDecoderNV12(FrameDecoderLuma):
+    """Decoder for NV12 frames.
+
+    NV12 stores the Y plane followed by a plane of interleaved U and V
+    samples at half resolution in both directions. The Y plane is
+    viewed directly. Chroma is upsampled using strided writes.
+    """
+
+    pixel_format = 'NV12'
+
+    @staticmethod
+    def frame_bytes(width: int, height: int) -> int:
+        return width * height + width * ((height + 1) // 2)
+
+    def _chroma(self: 'FrameDecoderNV12') -> tuple:
+        """U and V planes of region of interest rows at half resolution.
+
+        Returns tuple (u, v, even, odd) where even and odd are the
+        chroma row ranges used by the even and odd output rows.
+        """
+        roi = self._roi
+        fw = self._frame_width
+        fh = self._frame_height
+        plane = self._data[fw * fh:].reshape([(fh + 1) // 2, fw])
+        u = plane[:, roi.x:roi.x + roi.width:2]
+        v = plane[:, roi.x + 1:roi.x + roi.width:2]
+        # output row i uses chroma row (roi.y + i) // 2
+        first = roi.y // 2
+        even = slice(first, first + (roi.height + 1) // 2)
+        first += roi.y % 2
+        odd = slice(first, first + roi.height // 2)
+        return u, v, even, odd
+
+    def _decode_yuv444(self: 'FrameDecoderNV12',
+                       out: np.ndarray) -> np.ndarray:
+        u, v, even, odd = self._chroma()
+        out[:, :, 0] = self._luma()
+        for channel, plane in ((1, u), (2, v)):
+            out[0::2, 0::2, channel] = plane[even]
+            out[0::2, 1::2, channel] = plane[even]
+            out[1::2, 0::2, channel] = plane[odd]
+            out[1::2, 1::2, channel] = plane[odd]
+        return out
+
+    def _decode_yuv444_planar(self: 'FrameDecoderNV12',
+                              out: np.ndarray) -> np.ndarray:
+        """Decode into planar YUV444.
+
+        Chroma is upsampled horizontally using the uint16 view trick of
+        "FrameDecoder" and vertically by writing even and odd rows.
+        """
+        u, v, even, odd = self._chroma()
+        out[0] = self._luma()
+        for channel, plane in ((1, u), (2, v)):
+            np.multiply(plane[even], FrameDecoder._CHROMA_SPLAT,
+                        out=out[channel][0::2].view(np.uint16))
+            np.multiply(plane[odd], FrameDecoder._CHROMA_SPLAT,
+                        out=out[channel][1::2].view(np.uint16))
+        return out
+
+    def _decode_bgr(self: 'FrameDecoderNV12', out: np.ndarray) -> np.ndarray:
+        """Convert to BGR using OpenCV.
+
+        Converts the full frame then copies the region of interest.
+        """
+        if self._roi == FrameRoi(0, 0, self._frame_width, self._frame_height):
+            cv.cvtColor(self._nv12_rows(), cv.COLOR_YUV2BGR_NV12, dst=out)
+        else:
+            roi = self._roi
+            full = cv.cvtColor(self._nv12_rows(), cv.COLOR_YUV2BGR_NV12)
+            out[:] = full[roi.y:roi.y + roi.height, roi.x:roi.x + roi.width]
+        return out
+
+    def _nv12_rows(self: 'FrameDecoderNV12') -> np.ndarray:
+        """Captured frame as rows of bytes as expected by OpenCV."""
+        return self._data.reshape([-1, self._frame_width])
+
+
+class DecoderRegistry:
+    """Registry of frame decoder backends.
+
+    Backends are subclasses of "FrameDecoder" registered by name. Each
+    backend decodes one pixel format. Which backend is the fastest
+    depends on the host CPU and the installed NumPy and OpenCV versions.
+    "select()" runs a quick micro-benchmark to find the fastest backend
+    for a pixel format. The result is cached per machine in the user
+    cache directory to avoid running the benchmark each time.
+    """
+
+    _backends: "dict[str: type]" = {}
+    _auto_select: "list[str]" = []
+    _logger = logging.getLogger("evcta.DecoderRegistry")
+
+    DEFAULT_FORMATS = [OutputFormat.YUV444, OutputFormat.Gray8]
+    """Formats to benchmark if no formats are requested."""
+
+    @staticmethod
+    def register(name: str, decoder_class: type,
+                 auto_select: bool = True) -> None:
+        """Register backend.
+
+        Keyword arguments:
+        name --- Unique name of backend
+        decoder_class --- Subclass of "FrameDecoder"
+        auto_select --- Backend can be chosen by "select()"
+        """
+        DecoderRegistry._backends[name] = decoder_class
+        if auto_select and name not in DecoderRegistry._auto_select:
+            DecoderRegistry._auto_select.append(name)
+
+    @staticmethod
+    def names(pixel_format: str | None = None) -> "list[str]":
+        """Names of registered backends.
+
+        Keyword arguments:
+        pixel_format --- Pixel format to decode or None for all
+        """
+        return [k for k, v in DecoderRegistry._backends.items()
+                if not pixel_format or v.pixel_format == pixel_format]
+
+    @staticmethod
+    def pixel_formats() -> "list[str]":
+        """Pixel formats with at least one auto-selectable backend."""
+        formats = []
+        for name in DecoderRegistry._auto_select:
+            pixel_format = DecoderRegistry._backends[name].pixel_format
+            if pixel_format not in formats:
+                formats.append(pixel_format)
+        return formats
+
+    @staticmethod
+    def frame_bytes(pixel_format: str, width: int, height: int) -> int:
+        """Size in bytes of captured frames in pixel format.
+
+        Throws "Exception" if no backend decodes the pixel format.
+
+        Keyword arguments:
+        pixel_format --- Pixel format
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        names = DecoderRegistry.names(pixel_format)
+        if not names:
+            raise Exception("No decoder for pixel format: {}".format(
+                pixel_format))
+        return DecoderRegistry._backends[names[0]].frame_bytes(
+            width, height)
+
+    @staticmethod
+    def create(name: str, width: int, height: int) -> FrameDecoder:
+        """Create decoder using backend.
+
+        Throws "Exception" if backend is not registered.
+
+        Keyword arguments:
+        name --- Name of backend
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        """
+        decoder_class = DecoderRegistry._backends.get(name)
+        if not decoder_class:
+            raise Exception("Unknown decoder backend: {}".format(name))
+        decoder = decoder_class(width, height)
+        decoder.name = name
+        return decoder
+
+    @staticmethod
+    def benchmark(width: int, height: int,
+                  formats: "list[OutputFormat]",
+                  names: "list[str] | None" = None,
+                  number: int = 20) -> "dict[str: float]":
+        """Measure backends decoding synthetic frames.
+
+        Returns dictionary with the best time in seconds to decode one
+        frame into all formats for each backend.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        formats --- Formats to decode each frame into
+        names --- Names of backends to measure or None for all
+        number --- Number of frames per measurement
+        """
+        rng = np.random.default_rng(0)
+        results = {}
+        for name in names or DecoderRegistry.names():
+            decoder = DecoderRegistry.create(name, width, height)
+            data = rng.integers(0, 256, [decoder.frame_bytes(width, height)],
+                                dtype=np.uint8)
+
+            def decode():
+                decoder.set_frame(data)
+                for output_format in formats:
+                    decoder.get(output_format)
+
+            decode()  # warm up allocating arrays
+            results[name] = min(timeit.repeat(
+                decode, repeat=3, number=number)) / number
+        return results
+
+    @staticmethod
+    def select(width: int, height: int,
+               formats: "list[OutputFormat] | None" = None,
+               use_cache: bool = True, pixel_format: str = 'YUYV') -> str:
+        """Select fastest backend for this machine.
+
+        Uses cached result if present. Otherwise runs "benchmark()" on
+        all auto-selectable backends of the pixel format and caches the
+        result. If only one backend decodes the pixel format it is used
+        without benchmarking.
+
+        Returns name of fastest backend.
+
+        Throws "Exception" if no backend decodes the pixel format.
+
+        Keyword arguments:
+        width --- Width of frame in pixels
+        height --- Height of frame in pixels
+        formats --- Formats to decode or None to use "DEFAULT_FORMATS"
+        use_cache --- Use and update the cache
+        pixel_format --- Pixel format to decode
+        """
+        candidates = [x for x in DecoderRegistry._auto_select
+                      if DecoderRegistry._backends[x].pixel_format
+                      == pixel_format]
+        if not candidates:
+            raise Exception("No decoder for pixel format: {}".format(
+                pixel_format))
+        if len(candidates) == 1:
+            return candidates[0]
+
+        formats = formats or DecoderRegistry.DEFAULT_FORMATS
+        key = DecoderRegistry._cache_key(width, height, formats,
+                                         pixel_format)
+        cache = DecoderRegistry._load_cache() if use_cache else {}
+        name = cache.get(key)
+        if name in candidates:
+            DecoderRegistry._logger.info(
+                "select: using cached backend {}".format(name))
+            return name
+
+        results = DecoderRegistry.benchmark(
+            width, height, formats, candidates)
+        for n, t in results.items():
+            DecoderRegistry._logger.info(
+                "select: backend {} {:.3f}ms".format(n, t * 1000.0))
+        name = min(results, key=results.get)
+        DecoderRegistry._logger.info("select: using backend {}".format(name))
+
+        if use_cache:
+            cache[key] = name
+            DecoderRegistry._save_cache(cache)
+        return name
+
+    @staticmethod
+    def _cache_key(width: int, height: int,
+                   formats: "list[OutputFormat]", pixel_format: str) -> str:
+        """Key identifying machine, library versions and formats."""
+        return "{}|{}|{}|numpy-{}|opencv-{}|{}x{}|{}|{}".format(
+            platform.node(), platform.machine(), platform.processor(),
+            np.__version__, cv.__version__, width, height, pixel_format,
+            ",".join(sorted(x.value for x in formats)))
+
+    @staticmethod
+    def _cache_path() -> str:
+        """Path of cache file."""
+        if platform.system() == 'Windows':
+            base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base = os.environ.get('XDG_CACHE_HOME',
+                                  os.path.expanduser('~/.cache'))
+        return os.path.join(base, 'vivefacialtracker', 'decoder.json')
+
+    @staticmethod
+    def _load_cache() -> dict:
+        """Load cache returning empty dictionary if absent or broken."""
+        try:
+            with open(DecoderRegistry._cache_path(), 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    @staticmethod
+    def _save_cache(cache: dict) -> None:
+        """Save cache. Failing to save is logged but not an error."""
+        path = DecoderRegistry._cache_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except Exception as e:
+            DecoderRegistry._logger.warning(
+                "save cache {} failed: {}".format(path, e))
+
+
+DecoderRegistry.register('numpy', FrameDecoder)
+DecoderRegistry.register('opencv', FrameDecoderOpenCV)
+DecoderRegistry.register('view', FrameDecoderView, auto_select=False)
+DecoderRegistry.register('grey', FrameDecoderGrey)
+DecoderRegistry.register('y16', FrameDecoderY16)
+DecoderRegistry.register('nv12', FrameDecoderNV12)
@@ -0,0 +1,688 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import hashlib
+import logging
+import os
+import timeit
+
+import numpy as np
+import cv2 as cv
+from decoder import FrameRoi
+from startup import DeviceCache
+
+
+class TemporalDenoiser:
+    """Temporal denoising of grayscale frames using a moving average.
+
+    Each pixel is an exponential moving average of the captured frames.
+    The average is kept as fixed-point accumulator with 7 fractional
+    bits in a preallocated int16 array updated in place. The blend
+    factor is a power of two hence blending is a shift instead of a
+    multiplication.
+
+    The blend factor adapts to motion. Pixels differing little from
+    the last result are averaged strongly. Pixels differing by
+    "motion_threshold" or more take the captured value right away.
+    This removes sensor noise without smearing moving parts of the
+    image. This is considerably cheaper than a spatial median filter.
+
+    Use one denoiser per image stream, for example one per eye. The
+    returned array is reused for the next frame.
+    """
+
+    _FRACTION_BITS = 7
+
+    def __init__(self: 'TemporalDenoiser', strength: int = 2,
+                 motion_threshold: int = 24) -> None:
+        """Create temporal denoiser.
+
+        Keyword arguments:
+        strength --- Blend factor of static pixels as power of two. The
+                     captured value is blended by 1 / (2 ** strength).
+                     0 disables filtering. Maximum is 7.
+        motion_threshold --- Difference in gray levels from which on
+                             pixels count as moving
+        """
+        if strength < 0 or strength > TemporalDenoiser._FRACTION_BITS:
+            raise Exception("Invalid strength: {}".format(strength))
+        if motion_threshold < 1:
+            raise Exception("Invalid motion threshold: {}".format(
+                motion_threshold))
+        self._strength = strength
+        self._motion_threshold = motion_threshold
+        self._shift_lut = self._create_shift_lut()
+        self._accum: np.ndarray = None
+        self._target: np.ndarray = None
+        self._delta: np.ndarray = None
+        self._difference: np.ndarray = None
+        self._shift: np.ndarray = None
+        self._result: np.ndarray = None
+
+    @property
+    def strength(self: 'TemporalDenoiser') -> int:
+        """Blend factor of static pixels as power of two."""
+        return self._strength
+
+    @property
+    def motion_threshold(self: 'TemporalDenoiser') -> int:
+        """Difference in gray levels from which on pixels count as moving."""
+        return self._motion_threshold
+
+    def reset(self: 'TemporalDenoiser') -> None:
+        """Discard the average. The next frame is used as is."""
+        self._accum = None
+
+    def process(self: 'TemporalDenoiser', image: np.ndarray) -> np.ndarray:
+        """Add frame to the average and return the denoised frame.
+
+        The returned array is only valid until the next call. Changing
+        the frame shape resets the average.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+        """
+        if self._accum is None or self._accum.shape != image.shape:
+            self._init_arrays(image)
+            return self._result
+
+        fraction_bits = TemporalDenoiser._FRACTION_BITS
+        cv.absdiff(image, self._result, dst=self._difference)
+        cv.LUT(self._difference, self._shift_lut, dst=self._shift)
+        np.left_shift(image, fraction_bits, out=self._target,
+                      dtype=np.int16)
+        np.subtract(self._target, self._accum, out=self._delta)
+        np.right_shift(self._delta, self._shift, out=self._delta)
+        np.add(self._accum, self._delta, out=self._accum)
+
+        # round to nearest
+        np.add(self._accum, 1 << (fraction_bits - 1), out=self._delta)
+        np.right_shift(self._delta, fraction_bits, out=self._delta)
+        np.copyto(self._result, self._delta, casting='unsafe')
+        return self._result
+
+    def _create_shift_lut(self: 'TemporalDenoiser') -> np.ndarray:
+        """Lookup table mapping pixel difference to blend shift.
+
+        The shift drops linearly from "strength" for identical pixels
+        to 0 at "motion_threshold".
+        """
+        difference = np.arange(256, dtype=np.int32)
+        shift = self._strength - (difference * self._strength
+                                  // self._motion_threshold)
+        return np.clip(shift, 0, self._strength).astype(np.uint8)
+
+    def _init_arrays(self: 'TemporalDenoiser', image: np.ndarray) -> None:
+        """Allocate arrays and start the average with the frame."""
+        self._accum = np.left_shift(image, TemporalDenoiser._FRACTION_BITS,
+                                    dtype=np.int16)
+        self._target = np.empty_like(self._accum)
+        self._delta = np.empty_like(self._accum)
+        self._difference = np.empty(image.shape, dtype=np.uint8)
+        self._shift = np.empty_like(self._difference)
+        self._result = np.array(image, dtype=np.uint8)
+
+
+class FrameGeometry:
+    """Crop, scale, flip and undistort frames in a single pass.
+
+    With undistortion all transformations are folded into one
+    precomputed map applied using "cv.remap". The map is rebuilt only
+    if parameters or the input size change. Without undistortion the
+    crop is a view and scaling is done by "cv.resize" which is faster
+    than remapping. Flipping is folded into a map too unless resizing
+    and flipping in place measures faster. The choice is measured once
+    per geometry. Output arrays are reused.
+
+    Undistortion uses the OpenCV camera model. The camera matrix and
+    distortion coefficients refer to the input frame coordinates.
+    """
+
+    _flip_plans: "dict[tuple, bool]" = {}
+
+    def __init__(self: 'FrameGeometry', width: int, height: int,
+                 crop: FrameRoi | None = None,
+                 flip_horizontal: bool = False,
+                 flip_vertical: bool = False,
+                 camera_matrix: np.ndarray | None = None,
+                 distortion: np.ndarray | None = None,
+                 interpolation: int = cv.INTER_LINEAR) -> None:
+        """Create frame geometry.
+
+        Keyword arguments:
+        width --- Width of output frames in pixels
+        height --- Height of output frames in pixels
+        crop --- Region of input frames to use or None for all
+        flip_horizontal --- Mirror output horizontally
+        flip_vertical --- Mirror output vertically
+        camera_matrix --- Camera matrix (3x3) to undistort with or None
+        distortion --- Distortion coefficients to undistort with or None
+        interpolation --- OpenCV interpolation like "cv.INTER_LINEAR"
+        """
+        self._width = width
+        self._height = height
+        self._crop = crop
+        self._flip_horizontal = flip_horizontal
+        self._flip_vertical = flip_vertical
+        self._camera_matrix = camera_matrix
+        self._distortion = distortion
+        self.interpolation = interpolation
+        """OpenCV interpolation used for remapping. Changing it does not
+        require rebuilding the map."""
+        self._input_shape: tuple = None
+        self._built = False
+        self._map_x: np.ndarray = None
+        self._map_y: np.ndarray = None
+        self._map_cropped = False
+        self._flip_code: int | None = None
+        self._result = np.empty([height, width], dtype=np.uint8)
+
+    @property
+    def size(self: 'FrameGeometry') -> "tuple[int, int]":
+        """Size of output frames as tuple (width, height)."""
+        return (self._width, self._height)
+
+    @size.setter
+    def size(self: 'FrameGeometry', size: "tuple[int, int]") -> None:
+        self._width, self._height = size
+        self._result = np.empty([self._height, self._width], dtype=np.uint8)
+        self.invalidate()
+
+    @property
+    def crop(self: 'FrameGeometry') -> FrameRoi | None:
+        """Region of input frames to use or None for all."""
+        return self._crop
+
+    @crop.setter
+    def crop(self: 'FrameGeometry', crop: FrameRoi | None) -> None:
+        self._crop = crop
+        self.invalidate()
+
+    @property
+    def flip_horizontal(self: 'FrameGeometry') -> bool:
+        """Mirror output horizontally."""
+        return self._flip_horizontal
+
+    @flip_horizontal.setter
+    def flip_horizontal(self: 'FrameGeometry', flip: bool) -> None:
+        self._flip_horizontal = flip
+        self.invalidate()
+
+    @property
+    def flip_vertical(self: 'FrameGeometry') -> bool:
+        """Mirror output vertically."""
+        return self._flip_vertical
+
+    @flip_vertical.setter
+    def flip_vertical(self: 'FrameGeometry', flip: bool) -> None:
+        self._flip_vertical = flip
+        self.invalidate()
+
+    def set_undistortion(self: 'FrameGeometry',
+                         camera_matrix: np.ndarray | None,
+                         distortion: np.ndarray | None) -> None:
+        """Set lens undistortion.
+
+        Keyword arguments:
+        camera_matrix --- Camera matrix (3x3) or None to not undistort
+        distortion --- Distortion coefficients or None
+        """
+        self._camera_matrix = camera_matrix
+        self._distortion = distortion
+        self.invalidate()
+
+    def invalidate(self: 'FrameGeometry') -> None:
+        """Rebuild the map with the next frame."""
+        self._built = False
+
+    def apply(self: 'FrameGeometry', image: np.ndarray,
+              dst: np.ndarray | None = None) -> np.ndarray:
+        """Transform frame.
+
+        The returned array is only valid until the next call unless
+        "dst" is used.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+        dst --- Array of shape (height, width) of "size" to store the
+                result in or None
+        """
+        if not self._built or image.shape != self._input_shape:
+            self._input_shape = image.shape
+            self._build_map()
+        result = self._result if dst is None else dst
+
+        crop = self._crop
+        if crop and (self._map_x is None or self._map_cropped):
+            image = image[crop.y:crop.y + crop.height,
+                          crop.x:crop.x + crop.width]
+
+        if self._map_x is not None:
+            cv.remap(image, self._map_x, self._map_y, self.interpolation,
+                     dst=result, borderMode=cv.BORDER_REPLICATE)
+            return result
+
+        cv.resize(image, (self._width, self._height), dst=result,
+                  interpolation=self.interpolation)
+        if self._flip_code is not None:
+            cv.flip(result, self._flip_code, dst=result)
+        return result
+
+    def _build_map(self: 'FrameGeometry') -> None:
+        """Build map from output pixels to input pixels.
+
+        Pixel centers are mapped the same way "cv.resize" does. Without
+        undistortion a map is only used for flipping if faster.
+        """
+        self._built = True
+        self._map_x = self._map_y = None
+        self._map_cropped = False
+        if self._flip_horizontal and self._flip_vertical:
+            self._flip_code = -1
+        elif self._flip_horizontal:
+            self._flip_code = 1
+        elif self._flip_vertical:
+            self._flip_code = 0
+        else:
+            self._flip_code = None
+        if self._camera_matrix is None:
+            if self._flip_code is not None and self._flip_by_map():
+                # the map applies to the cropped view to sample the crop
+                # borders the same way "cv.resize" does
+                self._map_x, self._map_y = self._pixel_map(True)
+                self._map_cropped = True
+            return
+
+        map_x, map_y = self._pixel_map(False)
+
+        # input pixels are distorted. project the undistorted position
+        # of each output pixel to find the input pixel. floating point
+        # maps remap faster than fixed-point maps with current OpenCV
+        matrix = np.asarray(self._camera_matrix, dtype=np.float64)
+        distortion = np.zeros(5) if self._distortion is None\
+            else np.asarray(self._distortion, dtype=np.float64)
+        points = np.empty([map_x.size, 3], dtype=np.float64)
+        points[:, 0] = (map_x.ravel() - matrix[0, 2]) / matrix[0, 0]
+        points[:, 1] = (map_y.ravel() - matrix[1, 2]) / matrix[1, 1]
+        points[:, 2] = 1.0
+        projected, _ = cv.projectPoints(
+            points, np.zeros(3), np.zeros(3), matrix, distortion)
+        projected = projected.reshape([self._height, self._width, 2])
+        self._map_x = np.ascontiguousarray(projected[:, :, 0],
+                                           dtype=np.float32)
+        self._map_y = np.ascontiguousarray(projected[:, :, 1],
+                                           dtype=np.float32)
+
+    def _pixel_map(self: 'FrameGeometry',
+                   cropped: bool) -> "tuple[np.ndarray, np.ndarray]":
+        """Map from output pixels to input pixels without undistortion.
+
+        Returns tuple (map_x, map_y) with float32 arrays of output shape.
+
+        Keyword arguments:
+        cropped --- Map to the cropped view instead of the input frame
+        """
+        height, width = self._input_shape
+        crop = self._crop or FrameRoi(0, 0, width, height)
+        x, y = (0, 0) if cropped else (crop.x, crop.y)
+        u = (np.arange(self._width, dtype=np.float32) + 0.5)\
+            * (crop.width / self._width) - 0.5 + x
+        v = (np.arange(self._height, dtype=np.float32) + 0.5)\
+            * (crop.height / self._height) - 0.5 + y
+        if self._flip_horizontal:
+            u = u[::-1]
+        if self._flip_vertical:
+            v = v[::-1]
+        return np.meshgrid(u, v)
+
+    def _flip_by_map(self: 'FrameGeometry') -> bool:
+        """Flipping using a map is faster than resizing and flipping.
+
+        Measures both on a synthetic frame. The result is kept for the
+        process per input shape, crop size, output size, flip and
+        interpolation.
+        """
+        height, width = self._input_shape
+        crop = self._crop or FrameRoi(0, 0, width, height)
+        key = (self._input_shape, crop.width, crop.height, self._width,
+               self._height, self._flip_code, self.interpolation)
+        by_map = FrameGeometry._flip_plans.get(key)
+        if by_map is not None:
+            return by_map
+
+        image = np.random.default_rng(0).integers(
+            0, 256, self._input_shape, dtype=np.uint8)
+        map_x, map_y = self._pixel_map(True)
+        result = self._result
+        size = (self._width, self._height)
+        view = image[crop.y:crop.y + crop.height,
+                     crop.x:crop.x + crop.width]
+
+        def remap():
+            cv.remap(view, map_x, map_y, self.interpolation, dst=result,
+                     borderMode=cv.BORDER_REPLICATE)
+
+        def resize():
+            cv.resize(view, size, dst=result,
+                      interpolation=self.interpolation)
+            cv.flip(result, self._flip_code, dst=result)
+
+        times = [min(timeit.repeat(x, repeat=3, number=10))
+                 for x in (remap, resize)]
+        by_map = times[0] < times[1]
+        FrameGeometry._flip_plans[key] = by_map
+        return by_map
+
+
+class ChangeDetector:
+    """Detects frames differing from the last changed frame.
+
+    Compares a strided subsample of the Y channel against the last
+    frame found to have changed. Comparing against the last changed
+    frame instead of the previous frame prevents slow motion going
+    unnoticed. Pixels differing by more than "pixel_threshold" gray
+    levels count as changed. This ignores sensor noise. The frame has
+    changed if the fraction of changed pixels is "threshold" or more.
+
+    Only a few thousand pixels are compared hence detection costs a
+    fraction of decoding the frame. All arrays are preallocated.
+    """
+
+    def __init__(self: 'ChangeDetector', threshold: float = 0.02,
+                 pixel_threshold: int = 16, step: int = 8) -> None:
+        """Create change detector.
+
+        Keyword arguments:
+        threshold --- Fraction of changed pixels from which on the
+                      frame counts as changed
+        pixel_threshold --- Difference in gray levels from which on a
+                            pixel counts as changed
+        step --- Distance in pixels between samples
+        """
+        if step < 1:
+            raise Exception("Invalid step: {}".format(step))
+        self.threshold = threshold
+        """Fraction of changed pixels from which on the frame changed."""
+        self.pixel_threshold = pixel_threshold
+        """Difference in gray levels from which on a pixel changed."""
+        self._step = step
+        self._reference: np.ndarray = None
+        self._current: np.ndarray = None
+        self._difference: np.ndarray = None
+        self.difference: float = 1.0
+        """Fraction of changed pixels of the last frame."""
+
+    @property
+    def step(self: 'ChangeDetector') -> int:
+        """Distance in pixels between samples."""
+        return self._step
+
+    def reset(self: 'ChangeDetector') -> None:
+        """Forget the last changed frame. The next frame counts as changed."""
+        self._reference = None
+
+    def update(self: 'ChangeDetector', sample: np.ndarray) -> bool:
+        """Compare frame against the last changed frame.
+
+        Returns True if the frame changed. The frame becomes then the
+        frame the next frames are compared against.
+
+        Keyword arguments:
+        sample --- Subsample of the Y channel as uint8 array of shape
+                   (height, width), for example from
+                   "FrameDecoder.luma_sample()" using "step"
+        """
+        if self._reference is None or self._reference.shape != sample.shape:
+            self._reference = np.array(sample, dtype=np.uint8)
+            self._current = np.empty_like(self._reference)
+            self._difference = np.empty_like(self._reference)
+            self.difference = 1.0
+            return True
+
+        np.copyto(self._current, sample)
+        cv.absdiff(self._current, self._reference, dst=self._difference)
+        cv.threshold(self._difference, self.pixel_threshold, 255,
+                     cv.THRESH_BINARY, dst=self._difference)
+        self.difference = cv.countNonZero(self._difference)\
+            / self._difference.size
+        if self.difference < self.threshold:
+            return False
+        self._reference, self._current = self._current, self._reference
+        return True
+
+
+class DarkFrame:
+    """Per-pixel offset map of the sensor fixed-pattern noise.
+
+    The map is the average of frames captured without light reaching
+    the sensor. See "DarkFrameCalibration" for creating it. Subtracting
+    the map removes the fixed-pattern noise. Subtraction is a saturating
+    uint8 subtraction of the precomputed map hence no floating point
+    math is done per frame.
+
+    The map covers the region of interest used during calibration.
+    Frames can cover the same region or a region inside it. Maps are
+    stored per device in the user cache directory using "save()".
+    """
+
+    _logger = logging.getLogger("evcta.DarkFrame")
+
+    def __init__(self: 'DarkFrame', offset: np.ndarray,
+                 roi: FrameRoi | None = None) -> None:
+        """Create dark frame.
+
+        Keyword arguments:
+        offset --- Offset map as uint8 array of shape (height, width)
+        roi --- Region of interest the map covers or None if the map
+                covers the full frame
+        """
+        self._offset = np.ascontiguousarray(offset, dtype=np.uint8)
+        height, width = self._offset.shape
+        self._roi = roi or FrameRoi(0, 0, width, height)
+        if self._roi.width != width or self._roi.height != height:
+            raise Exception("Offset map size does not match {}".format(
+                self._roi))
+        self._view_key: tuple = None
+        self._view: np.ndarray = None
+        self._result: np.ndarray = None
+
+    @property
+    def offset(self: 'DarkFrame') -> np.ndarray:
+        """Offset map as uint8 array of shape (height, width)."""
+        return self._offset
+
+    @property
+    def roi(self: 'DarkFrame') -> FrameRoi:
+        """Region of interest the map covers."""
+        return self._roi
+
+    def subtract(self: 'DarkFrame', image: np.ndarray,
+                 roi: FrameRoi | None = None,
+                 dst: np.ndarray | None = None) -> np.ndarray:
+        """Subtract offset map from frame clamping at 0.
+
+        The returned array is only valid until the next call unless
+        "dst" is used.
+
+        Throws "Exception" if the map does not cover the region.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+        roi --- Region of interest of frame or None if the frame covers
+                the region of the map. Width and height are taken from
+                the frame
+        dst --- Array of the frame shape to store the result in or None
+        """
+        x = roi.x if roi else self._roi.x
+        y = roi.y if roi else self._roi.y
+        key = (x, y, image.shape)
+        if key != self._view_key:
+            self._view = np.ascontiguousarray(
+                self._offset_view(x, y, image.shape))
+            self._view_key = key
+        offset = self._view
+        if dst is not None:
+            cv.subtract(image, offset, dst=dst)
+            return dst
+        if self._result is None or self._result.shape != image.shape:
+            self._result = np.empty(image.shape, dtype=np.uint8)
+        cv.subtract(image, offset, dst=self._result)
+        return self._result
+
+    def save(self: 'DarkFrame', key: str) -> None:
+        """Store dark frame for device. Failing is logged but no error.
+
+        Keyword arguments:
+        key --- Key identifying device, for example "FTCamera.device_key"
+        """
+        path = DarkFrame._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            roi = self._roi
+            with open(path, 'wb') as f:
+                np.savez(f, offset=self._offset, key=key,
+                         roi=np.array([roi.x, roi.y, roi.width, roi.height]))
+        except Exception as e:
+            DarkFrame._logger.warning(
+                "save dark frame {} failed: {}".format(path, e))
+
+    @staticmethod
+    def load(key: str) -> 'DarkFrame | None':
+        """Stored dark frame of device or None if absent.
+
+        Keyword arguments:
+        key --- Key identifying device, for example "FTCamera.device_key"
+        """
+        try:
+            with np.load(DarkFrame._path(key)) as data:
+                if str(data['key']) != key:
+                    return None
+                return DarkFrame(data['offset'],
+                                 FrameRoi(*(int(x) for x in data['roi'])))
+        except Exception:
+            return None
+
+    @staticmethod
+    def remove(key: str) -> None:
+        """Remove stored dark frame of device if present.
+
+        Keyword arguments:
+        key --- Key identifying device
+        """
+        try:
+            os.remove(DarkFrame._path(key))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _path(key: str) -> str:
+        """Path of dark frame file of device."""
+        return os.path.join(DeviceCache.directory(), "darkframe-{}.npz".format(
+            hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+    def _offset_view(self: 'DarkFrame', x: int, y: int,
+                     shape: tuple) -> np.ndarray:
+        """View of offset map covering region."""
+        roi = self._roi
+        left = x - roi.x
+        top = y - roi.y
+        height, width = shape
+        if left < 0 or top < 0 or left + width > roi.width\
+                or top + height > roi.height:
+            raise Exception("Dark frame {} does not cover {}".format(
+                roi, FrameRoi(x, y, width, height)))
+        return self._offset[top:top + height, left:left + width]
+
+
+class DarkFrameCalibration:
+    """Creates a "DarkFrame" by averaging captured frames.
+
+    No light must reach the sensor while capturing the frames, for
+    example by covering the cameras. Use the same exposure and gain as
+    used later on since the fixed-pattern noise depends on them.
+    """
+
+    def __init__(self: 'DarkFrameCalibration', count: int = 32) -> None:
+        """Create calibration.
+
+        Keyword arguments:
+        count --- Number of frames to average
+        """
+        if count < 1:
+            raise Exception("Invalid frame count: {}".format(count))
+        self._count = count
+        self._added = 0
+        self._sum: np.ndarray = None
+
+    @property
+    def count(self: 'DarkFrameCalibration') -> int:
+        """Number of frames to average."""
+        return self._count
+
+    @property
+    def added(self: 'DarkFrameCalibration') -> int:
+        """Number of frames added so far."""
+        return self._added
+
+    @property
+    def complete(self: 'DarkFrameCalibration') -> bool:
+        """All frames have been added."""
+        return self._added >= self._count
+
+    def add(self: 'DarkFrameCalibration', image: np.ndarray) -> bool:
+        """Add frame to the average.
+
+        Returns True if all frames have been added.
+
+        Throws "Exception" if the frame shape changed.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+        """
+        if self.complete:
+            return True
+        if self._sum is None:
+            self._sum = np.zeros(image.shape, dtype=np.uint32)
+        elif self._sum.shape != image.shape:
+            raise Exception("Frame shape changed from {} to {}".format(
+                self._sum.shape, image.shape))
+        np.add(self._sum, image, out=self._sum)
+        self._added += 1
+        return self.complete
+
+    def result(self: 'DarkFrameCalibration',
+               roi: FrameRoi | None = None) -> DarkFrame:
+        """Dark frame averaging the added frames.
+
+        Throws "Exception" if no frame has been added.
+
+        Keyword arguments:
+        roi --- Region of interest of the added frames or None for the
+                full frame
+        """
+        if not self._added:
+            raise Exception("No frames added")
+        offset = (self._sum + self._added // 2) // self._added
+        return DarkFrame(offset.astype(np.uint8), roi)
@@ -0,0 +1,218 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from enum import Enum
+import threading
+
+import numpy as np
+from decoder import OutputFormat
+
+
+class EyeLayout(Enum):
+    """Which eye images a frame contains."""
+    SideBySide = 'sidebyside'
+    """Left and right camera image side by side."""
+    Left = 'left'
+    """Left camera image only."""
+    Right = 'right'
+    """Right camera image only."""
+    Region = 'region'
+    """Region of interest not matching a single camera image."""
+
+
+class Frame:
+    """Captured frame with metadata.
+
+    Frames are records reused from a "FramePool" or by "FTCamera" for
+    each captured frame. No objects are allocated per frame. Frames are
+    thus only valid during the callback receiving them unless stated
+    otherwise.
+    """
+    __slots__ = ('data', 'timestamp', 'sequence', 'device_index',
+                 'output_format', 'eye_layout', 'exposure', 'gain',
+                 'changed', 'difference', '_pool', '_refs', '_buffer',
+                 '_view', '_view_readonly')
+
+    def __init__(self: 'Frame') -> None:
+        self.data: np.ndarray = None
+        """Pixel data in the format given by "output_format"."""
+        self.timestamp: float = 0.0
+        """Capture time in seconds. Under Linux this is the driver
+        timestamp otherwise the monotonic time the frame arrived."""
+        self.sequence: int = 0
+        """Sequence number of frame. Gaps indicate dropped frames."""
+        self.device_index: int = 0
+        """Index of device the frame has been captured with."""
+        self.output_format: OutputFormat = None
+        """Format of pixel data."""
+        self.eye_layout: EyeLayout = EyeLayout.SideBySide
+        """Which eye images the pixel data contains."""
+        self.exposure: int | None = None
+        """Exposure in effect at capture time or None if unknown."""
+        self.gain: int | None = None
+        """Gain in effect at capture time or None if unknown."""
+        self.changed: bool = True
+        """Frame differs from the last changed frame. Always True if
+        "FTCamera.change_detector" is not set."""
+        self.difference: float | None = None
+        """Fraction of sampled pixels which changed or None if change
+        detection is not used."""
+        self._pool: 'FramePool' = None
+        self._refs: int = 0
+        self._buffer: np.ndarray = None
+        self._view: np.ndarray = None
+        self._view_readonly: np.ndarray = None
+
+    def __repr__(self: 'Frame') -> str:
+        return ("(sequence={}, timestamp={:.6f}, device={}, format={},"
+                " layout={}, shape={})").format(
+            self.sequence, self.timestamp, self.device_index,
+            self.output_format.value if self.output_format else None,
+            self.eye_layout.value,
+            self.data.shape if self.data is not None else None)
+
+    def copy_metadata(self: 'Frame', frame: 'Frame') -> None:
+        """Copy metadata from another frame.
+
+        Keyword arguments:
+        frame --- Frame to copy metadata from
+        """
+        self.timestamp = frame.timestamp
+        self.sequence = frame.sequence
+        self.device_index = frame.device_index
+        self.output_format = frame.output_format
+        self.eye_layout = frame.eye_layout
+        self.exposure = frame.exposure
+        self.gain = frame.gain
+        self.changed = frame.changed
+        self.difference = frame.difference
+
+    def release(self: 'Frame') -> None:
+        """Release reference to pooled frame.
+
+        Frame returns to the pool once all references are released.
+        Does nothing for frames not from a pool.
+        """
+        if self._pool:
+            self._pool.release(self)
+
+
+class FramePool:
+    """Pool of frame records with preallocated pixel buffers.
+
+    Used to hand out copies of frames which have to stay valid after
+    the next frame has been captured, for example while queued. Each
+    frame is reference counted. Frames are reused once all references
+    have been released. If no frame is free the pool grows. Once the
+    pool has grown to the number of frames in flight no more memory is
+    allocated.
+
+    All frames of a pool use the same format. Buffers are allocated
+    for the largest shape. Smaller shapes, for example due to a region
+    of interest, use a view into the buffer.
+    """
+
+    def __init__(self: 'FramePool', output_format: OutputFormat,
+                 max_shape: tuple, capacity: int = 2) -> None:
+        """Create frame pool.
+
+        Keyword arguments:
+        output_format --- Format of frames
+        max_shape --- Largest shape of pixel data
+        capacity --- Number of frames to preallocate
+        """
+        self._output_format = output_format
+        self._buffer_size = int(np.prod(max_shape))
+        self._frames: 'list[Frame]' = []
+        self._next = 0
+        self._lock = threading.Lock()
+        for _ in range(capacity):
+            self._add_frame()
+
+    @property
+    def size(self: 'FramePool') -> int:
+        """Number of frames in the pool."""
+        return len(self._frames)
+
+    def acquire(self: 'FramePool', data: np.ndarray, frame: Frame) -> Frame:
+        """Acquire free frame storing a read-only copy of a frame.
+
+        The frame is acquired without references. Call "retain()" for
+        each consumer before handing the frame out. Frames without
+        references are reused by the next call to "acquire()". Only
+        one thread is allowed to acquire frames.
+
+        Keyword arguments:
+        data --- Pixel data to copy
+        frame --- Frame to copy metadata from
+        """
+        with self._lock:
+            pooled = self._find_free()
+
+        if pooled._view is None or pooled._view.shape != data.shape:
+            pooled._view = pooled._buffer[:data.size].reshape(data.shape)
+            pooled._view_readonly = pooled._view.view()
+            pooled._view_readonly.flags.writeable = False
+        np.copyto(pooled._view, data)
+        pooled.data = pooled._view_readonly
+        pooled.copy_metadata(frame)
+        return pooled
+
+    def retain(self: 'FramePool', frame: Frame) -> None:
+        """Add reference to frame.
+
+        Keyword arguments:
+        frame --- Frame acquired from this pool
+        """
+        with self._lock:
+            frame._refs += 1
+
+    def release(self: 'FramePool', frame: Frame) -> None:
+        """Release one reference of frame.
+
+        Keyword arguments:
+        frame --- Frame acquired from this pool
+        """
+        with self._lock:
+            if frame._refs > 0:
+                frame._refs -= 1
+
+    def _find_free(self: 'FramePool') -> Frame:
+        """Find free frame round robin adding one if none is free."""
+        count = len(self._frames)
+        for i in range(count):
+            frame = self._frames[(self._next + i) % count]
+            if frame._refs == 0:
+                self._next = (self._next + i + 1) % count
+                return frame
+        return self._add_frame()
+
+    def _add_frame(self: 'FramePool') -> Frame:
+        """Add frame to pool."""
+        frame = Frame()
+        frame._pool = self
+        frame._buffer = np.empty([self._buffer_size], dtype=np.uint8)
+        frame.output_format = self._output_format
+        self._frames.append(frame)
+        return frame
@@ -0,0 +1,315 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from collections import deque
+import threading
+import traceback
+import logging
+import time
+import os
+
+import numpy as np
+from frame import Frame
+
+
+_worker_function = None
+_worker_memory: shared_memory.SharedMemory = None
+
+
+def _init_worker(function, name: str) -> None:
+    """Initialize pool process attaching the shared memory once."""
+    global _worker_function, _worker_memory
+    _worker_function = function
+    _worker_memory = shared_memory.SharedMemory(name)
+
+
+def _run_worker(offset: int, shape: tuple):
+    """Run function on image in a shared memory slot."""
+    image = np.ndarray(shape, np.uint8, _worker_memory.buf, offset)
+    image.flags.writeable = False
+    return _worker_function(image)
+
+
+class ProcessPipeline:
+    """Runs heavy per-frame analysis in a process pool.
+
+    Analysis too slow to run at the capture rate, for example
+    landmarking, disparity or optical flow, is farmed out to a pool of
+    processes. Frames are copied into slots of a shared memory block
+    instead of pickling the arrays. Pool processes attach the block
+    once and only receive the slot offset and shape per frame.
+
+    The number of slots bounds the frames in flight. If all slots are
+    busy "submit()" drops the frame. Results are delivered to
+    "callback" in the order frames have been submitted. A result is
+    held back until the results of all earlier frames are delivered.
+    If "max_latency" is set a result arriving later than this is
+    dropped. An earlier frame still running after "max_latency" is
+    skipped once a later result is ready, so a single slow frame does
+    not hold back the results of the others.
+
+    "function" runs in the pool processes and has to be picklable, for
+    example a module level function. It receives a read-only image
+    valid only during the call and returns a picklable result.
+
+    Use it as a subscription callback like this:
+    pipeline = ProcessPipeline(analyse, (400, 200), on_result)
+    ftcamera.subscribe(pipeline.submit, OutputFormat.Gray8)
+    """
+
+    class _Slot:
+        """Shared memory slot of a frame in flight."""
+        def __init__(self: 'ProcessPipeline._Slot', index: int,
+                     offset: int) -> None:
+            self.index = index
+            self.offset = offset
+            self.frame = Frame()
+            self.future: Future = None
+            self.submitted: float = 0.0
+            self.skipped = False
+
+    _logger = logging.getLogger("evcta.ProcessPipeline")
+
+    def __init__(self: 'ProcessPipeline', function, max_shape: tuple,
+                 callback, workers: int | None = None,
+                 max_in_flight: int | None = None,
+                 max_latency: float | None = None) -> None:
+        """Create pipeline starting the process pool.
+
+        Keyword arguments:
+        function --- Picklable callable with the signature
+                     "function(image: np.ndarray) -> result"
+        max_shape --- Largest shape of submitted images
+        callback --- Callable with the signature
+                     "callback(frame: Frame, result) -> None". Called
+                     from a pool management thread. Frame holds the
+                     metadata and the image and is only valid during
+                     the call.
+        workers --- Number of pool processes or None for the number of
+                    processors
+        max_in_flight --- Number of slots or None for twice the number
+                          of pool processes
+        max_latency --- Seconds from submitting until a result is
+                        dropped or None to never drop results
+        """
+        self.callback = callback
+        self.max_latency = max_latency
+        """Seconds from submitting until a result is dropped or None."""
+        workers = workers or os.cpu_count() or 1
+        count = max_in_flight or 2 * workers
+        self._slot_size = int(np.prod(max_shape))
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=self._slot_size * count)
+        self._slots = [ProcessPipeline._Slot(i, i * self._slot_size)
+                       for i in range(count)]
+        self._free: "deque[ProcessPipeline._Slot]" = deque(self._slots)
+        self._pending: "deque[ProcessPipeline._Slot]" = deque()
+        self._lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+        self._closed = False
+        self._timer: threading.Timer = None
+        self._executor = ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(function, self._memory.name))
+        self.submitted: int = 0
+        """Number of frames submitted."""
+        self.delivered: int = 0
+        """Number of results delivered to callback."""
+        self.dropped: int = 0
+        """Number of frames dropped due to all slots being busy."""
+        self.late: int = 0
+        """Number of results dropped due to "max_latency"."""
+        self.failed: int = 0
+        """Number of frames the function raised an exception for."""
+
+    @property
+    def in_flight(self: 'ProcessPipeline') -> int:
+        """Number of busy slots."""
+        return len(self._slots) - len(self._free)
+
+    @property
+    def max_in_flight(self: 'ProcessPipeline') -> int:
+        """Number of slots."""
+        return len(self._slots)
+
+    def submit(self: 'ProcessPipeline', frame: Frame) -> bool:
+        """Submit frame for processing.
+
+        Copies the image into a free slot. Returns False if the frame
+        has been dropped since all slots are busy. Frames can be
+        submitted from any thread.
+
+        Keyword arguments:
+        frame --- Frame to process. Only accessed during the call
+        """
+        data = frame.data
+        if data.size > self._slot_size:
+            raise Exception("Image size {} exceeds slot size {}".format(
+                data.size, self._slot_size))
+        with self._lock:
+            if self._closed:
+                return False
+            if not self._free:
+                self.dropped += 1
+                return False
+            slot = self._free.popleft()
+
+        view = np.ndarray(data.shape, np.uint8, self._memory.buf,
+                          slot.offset)
+        np.copyto(view, data)
+        view.flags.writeable = False
+        slot.frame.copy_metadata(frame)
+        slot.frame.data = view
+        slot.submitted = time.monotonic()
+
+        with self._lock:
+            try:
+                future = self._executor.submit(
+                    _run_worker, slot.offset, data.shape)
+            except Exception:
+                self._release(slot)
+                raise
+            slot.future = future
+            self._pending.append(slot)
+            self.submitted += 1
+        future.add_done_callback(lambda _: self._on_done(slot))
+        return True
+
+    def close(self: 'ProcessPipeline') -> None:
+        """Stop the process pool dropping frames in flight."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._deliver_lock, self._lock:
+            for slot in self._slots:
+                slot.frame.data = None
+            self._pending.clear()
+        try:
+            self._memory.close()
+        except BufferError:
+            ProcessPipeline._logger.warning(
+                "frame data still referenced. memory freed on exit")
+        self._memory.unlink()
+
+    def _on_done(self: 'ProcessPipeline', slot: 'ProcessPipeline._Slot'
+                 ) -> None:
+        """Deliver results ready in order once a frame finished."""
+        with self._lock:
+            if slot.skipped:
+                slot.skipped = False
+                self._release(slot)
+        self._deliver_ready()
+
+    def _deliver_ready(self: 'ProcessPipeline') -> None:
+        """Deliver results ready in order."""
+        with self._deliver_lock:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        return
+                    slot, late = self._next_ready()
+                if not slot:
+                    return
+                try:
+                    self._deliver(slot, late)
+                finally:
+                    with self._lock:
+                        self._release(slot)
+
+    def _next_ready(self: 'ProcessPipeline'
+                    ) -> "tuple[ProcessPipeline._Slot | None, bool]":
+        """Dequeue next slot to deliver in order.
+
+        Skips the first pending slot if it is late and a later slot is
+        ready. If the first pending slot is not late yet but a later
+        slot is ready a timer delivers again once it becomes late.
+        Returns tuple (slot, late) or (None, False) if the next slot is
+        not ready yet.
+        """
+        now = time.monotonic()
+        while self._pending:
+            slot = self._pending[0]
+            late = self.max_latency is not None\
+                and now - slot.submitted > self.max_latency
+            if slot.future.done():
+                self._pending.popleft()
+                return slot, late
+            if self.max_latency is None or not any(
+                    x.future.done() for x in self._pending):
+                break
+            if not late:
+                if not self._timer:
+                    self._timer = threading.Timer(
+                        slot.submitted + self.max_latency - now,
+                        self._deliver_delayed)
+                    self._timer.daemon = True
+                    self._timer.start()
+                break
+            # released once running finished
+            self._pending.popleft()
+            slot.skipped = True
+            self.late += 1
+        return None, False
+
+    def _deliver_delayed(self: 'ProcessPipeline') -> None:
+        """Timer delivering results held back by a late slot."""
+        with self._lock:
+            self._timer = None
+        self._deliver_ready()
+
+    def _deliver(self: 'ProcessPipeline', slot: 'ProcessPipeline._Slot',
+                 late: bool) -> None:
+        """Send result of slot to callback unless failed or late."""
+        if slot.future.cancelled():
+            return
+        error = slot.future.exception()
+        if error:
+            self.failed += 1
+            ProcessPipeline._logger.error("frame {} failed: {}".format(
+                slot.frame.sequence, "".join(traceback.format_exception(
+                    error))))
+            return
+        if late:
+            self.late += 1
+            return
+        try:
+            self.callback(slot.frame, slot.future.result())
+        except Exception:
+            ProcessPipeline._logger.error(traceback.format_exc())
+        self.delivered += 1
+
+    def _release(self: 'ProcessPipeline',
+                 slot: 'ProcessPipeline._Slot') -> None:
+        """Return slot to the free slots."""
+        slot.future = None
+        slot.frame.data = None
+        self._free.append(slot)
@@ -0,0 +1,178 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from contextlib import contextmanager
+import platform
+import logging
+import json
+import time
+import os
+
+
+class StartupProfiler:
+    """Measures time spent in the phases of starting up a device.
+
+    Phases are measured using "phase()" and can be nested. Events like
+    receiving the first frame are recorded using "mark()" as the time
+    since the profiler has been created. Use "report()" to log the
+    result.
+    """
+
+    _logger = logging.getLogger("evcta.StartupProfiler")
+
+    def __init__(self: 'StartupProfiler') -> None:
+        """Create profiler starting the clock."""
+        self._start = time.perf_counter()
+        self._depth = 0
+        self.phases: "list[tuple[str, float]]" = []
+        """List of tuples (name, seconds) of finished phases in the
+        order they started. Nested phases have their name prefixed by
+        the parent phase names."""
+        self.marks: "list[tuple[str, float]]" = []
+        """List of tuples (name, seconds since start) of events."""
+        self._names: "list[str]" = []
+
+    @property
+    def elapsed(self: 'StartupProfiler') -> float:
+        """Seconds elapsed since the profiler has been created."""
+        return time.perf_counter() - self._start
+
+    @contextmanager
+    def phase(self: 'StartupProfiler', name: str):
+        """Context manager measuring a phase.
+
+        Keyword arguments:
+        name --- Name of phase
+        """
+        self._names.append(name)
+        full_name = "/".join(self._names)
+        index = len(self.phases)
+        self.phases.append((full_name, 0.0))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[index] = (full_name, time.perf_counter() - start)
+            self._names.pop()
+
+    def mark(self: 'StartupProfiler', name: str) -> None:
+        """Record event at the current time.
+
+        Keyword arguments:
+        name --- Name of event
+        """
+        self.marks.append((name, self.elapsed))
+
+    def report(self: 'StartupProfiler') -> None:
+        """Log time per phase and events."""
+        StartupProfiler._logger.info("startup profile:")
+        for name, seconds in self.phases:
+            StartupProfiler._logger.info("- {:40s} {:8.1f}ms".format(
+                name, seconds * 1000.0))
+        for name, seconds in self.marks:
+            StartupProfiler._logger.info("- {:40s} {:8.1f}ms".format(
+                "@" + name, seconds * 1000.0))
+
+
+class DeviceCache:
+    """Cache of known-good device configurations.
+
+    Stores per device the configuration which has been used to
+    successfully capture frames. Devices are identified by a string
+    the device can be cheaply queried for, for example the card name
+    and bus location. The cache is stored in the user cache directory.
+    """
+
+    _logger = logging.getLogger("evcta.DeviceCache")
+
+    @staticmethod
+    def get(key: str) -> dict | None:
+        """Cached configuration of device or None if absent.
+
+        Keyword arguments:
+        key --- Key identifying device
+        """
+        return DeviceCache._load().get(key)
+
+    @staticmethod
+    def put(key: str, config: dict) -> None:
+        """Store configuration of device.
+
+        Keyword arguments:
+        key --- Key identifying device
+        config --- Dictionary of JSON serializable values
+        """
+        cache = DeviceCache._load()
+        if cache.get(key) == config:
+            return
+        cache[key] = config
+        DeviceCache._save(cache)
+
+    @staticmethod
+    def remove(key: str) -> None:
+        """Remove configuration of device if present.
+
+        Keyword arguments:
+        key --- Key identifying device
+        """
+        cache = DeviceCache._load()
+        if key in cache:
+            del cache[key]
+            DeviceCache._save(cache)
+
+    @staticmethod
+    def directory() -> str:
+        """Directory to store cache files in. Can be absent."""
+        if platform.system() == 'Windows':
+            base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base = os.environ.get('XDG_CACHE_HOME',
+                                  os.path.expanduser('~/.cache'))
+        return os.path.join(base, 'vivefacialtracker')
+
+    @staticmethod
+    def _path() -> str:
+        """Path of cache file."""
+        return os.path.join(DeviceCache.directory(), 'devices.json')
+
+    @staticmethod
+    def _load() -> dict:
+        """Load cache returning empty dictionary if absent or broken."""
+        try:
+            with open(DeviceCache._path(), 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    @staticmethod
+    def _save(cache: dict) -> None:
+        """Save cache. Failing to save is logged but not an error."""
+        path = DeviceCache._path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except Exception as e:
+            DeviceCache._logger.warning(
+                "save cache {} failed: {}".format(path, e))
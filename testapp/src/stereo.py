@@ -0,0 +1,347 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import hashlib
+import logging
+import json
+import os
+
+import numpy as np
+import cv2 as cv
+from decoder import FrameRoi
+from startup import DeviceCache
+
+
+class StereoCalibration:
+    """Intrinsic and extrinsic calibration of the two cameras.
+
+    The VIVE Facial Tracker has two cameras side by side. Each camera
+    image is shrunk horizontally to half the frame width. Calibrate
+    using the eye images as captured. The intrinsics then contain the
+    horizontal shrinking.
+    """
+
+    def __init__(self: 'StereoCalibration', width: int, height: int,
+                 matrix_left: np.ndarray, distortion_left: np.ndarray,
+                 matrix_right: np.ndarray, distortion_right: np.ndarray,
+                 rotation: np.ndarray, translation: np.ndarray) -> None:
+        """Create stereo calibration.
+
+        Keyword arguments:
+        width --- Width of eye images in pixels
+        height --- Height of eye images in pixels
+        matrix_left --- Camera matrix of left camera (3x3)
+        distortion_left --- Distortion coefficients of left camera
+        matrix_right --- Camera matrix of right camera (3x3)
+        distortion_right --- Distortion coefficients of right camera
+        rotation --- Rotation from left to right camera (3x3)
+        translation --- Translation from left to right camera (3)
+        """
+        self.width = width
+        self.height = height
+        self.matrix_left = np.asarray(matrix_left, dtype=np.float64)
+        self.distortion_left = np.asarray(distortion_left, dtype=np.float64)
+        self.matrix_right = np.asarray(matrix_right, dtype=np.float64)
+        self.distortion_right = np.asarray(distortion_right,
+                                           dtype=np.float64)
+        self.rotation = np.asarray(rotation, dtype=np.float64)
+        self.translation = np.asarray(
+            translation, dtype=np.float64).reshape([3, 1])
+
+    @staticmethod
+    def calibrate(object_points: "list[np.ndarray]",
+                  points_left: "list[np.ndarray]",
+                  points_right: "list[np.ndarray]",
+                  width: int, height: int) -> 'StereoCalibration':
+        """Calibrate from pattern points found in both eye images.
+
+        Use for example "cv.findChessboardCorners" on pairs of eye
+        images to find the points.
+
+        Keyword arguments:
+        object_points --- Pattern points in pattern space per image pair
+        points_left --- Pattern points in left eye image per image pair
+        points_right --- Pattern points in right eye image per image pair
+        width --- Width of eye images in pixels
+        height --- Height of eye images in pixels
+        """
+        size = (width, height)
+        _, ml, dl, _, _ = cv.calibrateCamera(
+            object_points, points_left, size, None, None)
+        _, mr, dr, _, _ = cv.calibrateCamera(
+            object_points, points_right, size, None, None)
+        _, ml, dl, mr, dr, rotation, translation, _, _ = cv.stereoCalibrate(
+            object_points, points_left, points_right, ml, dl, mr, dr, size,
+            flags=cv.CALIB_FIX_INTRINSIC)
+        return StereoCalibration(width, height, ml, dl, mr, dr,
+                                 rotation, translation)
+
+    def to_dict(self: 'StereoCalibration') -> dict:
+        """Calibration as dictionary of JSON serializable values."""
+        return dict(
+            width=self.width,
+            height=self.height,
+            matrix_left=self.matrix_left.tolist(),
+            distortion_left=self.distortion_left.ravel().tolist(),
+            matrix_right=self.matrix_right.tolist(),
+            distortion_right=self.distortion_right.ravel().tolist(),
+            rotation=self.rotation.tolist(),
+            translation=self.translation.ravel().tolist())
+
+    @staticmethod
+    def from_dict(values: dict) -> 'StereoCalibration':
+        """Create calibration from dictionary created by "to_dict()".
+
+        Keyword arguments:
+        values --- Dictionary of values
+        """
+        return StereoCalibration(
+            values['width'], values['height'],
+            values['matrix_left'], values['distortion_left'],
+            values['matrix_right'], values['distortion_right'],
+            values['rotation'], values['translation'])
+
+    @property
+    def fingerprint(self: 'StereoCalibration') -> str:
+        """Hash identifying the calibration values."""
+        return hashlib.sha1(json.dumps(
+            self.to_dict(), sort_keys=True).encode()).hexdigest()
+
+
+class StereoRectifier:
+    """Rectifies the eye images of side by side stereo frames.
+
+    Rectification maps are computed once from the calibration. This is
+    expensive hence the maps are cached per device in the user cache
+    directory. Rectifying a frame is then a single "cv.remap" per eye
+    using fixed-point maps into preallocated buffers.
+    """
+
+    _CACHE_VERSION = 2
+
+    _logger = logging.getLogger("evcta.StereoRectifier")
+
+    def __init__(self: 'StereoRectifier', calibration: StereoCalibration,
+                 key: str | None = None,
+                 interpolation: int = cv.INTER_LINEAR) -> None:
+        """Create stereo rectifier.
+
+        Keyword arguments:
+        calibration --- Calibration of the cameras
+        key --- Key identifying device, for example "FTCamera.device_key",
+                or None to not cache the maps
+        interpolation --- OpenCV interpolation used for remapping
+        """
+        self._calibration = calibration
+        self._key = key
+        self.interpolation = interpolation
+        """OpenCV interpolation used for remapping."""
+        self._maps: "list[tuple[np.ndarray, np.ndarray]]" = None
+        self._q: np.ndarray = None
+        if key:
+            self._load()
+        if self._maps is None:
+            self._create_maps()
+            if key:
+                self._save()
+        size = (calibration.height, calibration.width)
+        self._left = np.empty(size, dtype=np.uint8)
+        self._right = np.empty(size, dtype=np.uint8)
+
+    @property
+    def calibration(self: 'StereoRectifier') -> StereoCalibration:
+        """Calibration of the cameras."""
+        return self._calibration
+
+    @property
+    def disparity_to_depth(self: 'StereoRectifier') -> np.ndarray:
+        """Disparity to depth matrix (4x4) as from "cv.stereoRectify"."""
+        return self._q
+
+    def rectify(self: 'StereoRectifier',
+                image: np.ndarray) -> "tuple[np.ndarray, np.ndarray]":
+        """Rectify eye images of side by side frame.
+
+        Returns tuple (left, right) of rectified eye images. The arrays
+        are reused and only valid until the next call.
+
+        Keyword arguments:
+        image --- Grayscale frame as uint8 array of shape (height, width)
+                  with the eye images side by side
+        """
+        width = self._calibration.width
+        maps = self._maps
+        cv.remap(image[:, 0:width], maps[0][0], maps[0][1],
+                 self.interpolation, dst=self._left)
+        cv.remap(image[:, width:width * 2], maps[1][0], maps[1][1],
+                 self.interpolation, dst=self._right)
+        return self._left, self._right
+
+    def depth(self: 'StereoRectifier', disparity: float) -> float:
+        """Distance along the optical axis for disparity.
+
+        The unit is the unit of the calibration translation. Returns
+        infinity if disparity is 0 or less.
+
+        Keyword arguments:
+        disparity --- Disparity in pixels
+        """
+        if disparity <= 0:
+            return float('inf')
+        q = self._q
+        return float(q[2, 3] / (q[3, 2] * disparity + q[3, 3]))
+
+    def _create_maps(self: 'StereoRectifier') -> None:
+        """Compute rectification maps.
+
+        Rectification yields square pixels. The eye images are shrunk
+        horizontally hence they are rectified to the unshrunk width first
+        and the horizontal projection is then scaled back. This keeps the
+        entire eye image instead of cropping it horizontally. Disparities
+        are in pixels of the shrunk images.
+        """
+        c = self._calibration
+        size = (c.width, c.height)
+        scale = c.matrix_left[0, 0] / c.matrix_left[1, 1]
+        rl, rr, pl, pr, q, _, _ = cv.stereoRectify(
+            c.matrix_left, c.distortion_left, c.matrix_right,
+            c.distortion_right, size, c.rotation, c.translation, alpha=0,
+            newImageSize=(round(c.width / scale), c.height))
+        pl[0] *= scale
+        pr[0] *= scale
+        self._q = q @ np.diag([1.0 / scale, 1.0, 1.0 / scale, 1.0])
+        self._maps = [
+            cv.initUndistortRectifyMap(c.matrix_left, c.distortion_left,
+                                       rl, pl, size, cv.CV_16SC2),
+            cv.initUndistortRectifyMap(c.matrix_right, c.distortion_right,
+                                       rr, pr, size, cv.CV_16SC2)]
+
+    def _path(self: 'StereoRectifier') -> str:
+        """Path of cached maps of device."""
+        return os.path.join(DeviceCache.directory(), "stereo-{}.npz".format(
+            hashlib.sha1(self._key.encode()).hexdigest()[:16]))
+
+    def _load(self: 'StereoRectifier') -> None:
+        """Load cached maps if present and matching the calibration."""
+        try:
+            with np.load(self._path()) as data:
+                if str(data['key']) != self._key or str(
+                        data['fingerprint']) != self._calibration.fingerprint\
+                        or int(data['version'])\
+                        != StereoRectifier._CACHE_VERSION:
+                    return
+                self._maps = [(data['left1'], data['left2']),
+                              (data['right1'], data['right2'])]
+                self._q = data['q']
+        except Exception:
+            pass
+
+    def _save(self: 'StereoRectifier') -> None:
+        """Cache maps. Failing is logged but no error."""
+        path = self._path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                np.savez(f, key=self._key,
+                         version=StereoRectifier._CACHE_VERSION,
+                         fingerprint=self._calibration.fingerprint,
+                         left1=self._maps[0][0], left2=self._maps[0][1],
+                         right1=self._maps[1][0], right2=self._maps[1][1],
+                         q=self._q)
+        except Exception as e:
+            StereoRectifier._logger.warning(
+                "save stereo maps {} failed: {}".format(path, e))
+
+
+class DisparityEstimator:
+    """Coarse disparity of a region of rectified eye images.
+
+    Uses block matching which is fast enough to run each frame. Intended
+    for coarse depth of the lower face, for example jaw and lip
+    protrusion, not for a dense depth map. Restricting the region of
+    interest to the area of interest reduces the cost.
+    """
+
+    def __init__(self: 'DisparityEstimator', roi: FrameRoi | None = None,
+                 num_disparities: int = 32, block_size: int = 15) -> None:
+        """Create disparity estimator.
+
+        Keyword arguments:
+        roi --- Region of interest in eye image coordinates or None for
+                the full eye image. Pixels left of it are used for the
+                matching
+        num_disparities --- Search range in pixels. Multiple of 16
+        block_size --- Size of matching block in pixels. Odd number
+        """
+        if num_disparities < 16 or num_disparities % 16:
+            raise Exception("Invalid number of disparities: {}".format(
+                num_disparities))
+        if block_size < 5 or block_size % 2 == 0:
+            raise Exception("Invalid block size: {}".format(block_size))
+        self.roi = roi
+        """Region of interest in eye image coordinates or None."""
+        self._num_disparities = num_disparities
+        self._matcher = cv.StereoBM_create(num_disparities, block_size)
+        self._raw: np.ndarray = None
+        self._disparity: np.ndarray = None
+
+    def compute(self: 'DisparityEstimator', left: np.ndarray,
+                right: np.ndarray) -> np.ndarray:
+        """Disparity in pixels of the region of interest.
+
+        Pixels without match have a negative disparity. The returned
+        array is reused and only valid until the next call.
+
+        Keyword arguments:
+        left --- Rectified left eye image as uint8 array
+        right --- Rectified right eye image as uint8 array
+        """
+        height, width = left.shape
+        roi = self.roi or FrameRoi(0, 0, width, height)
+        # block matching needs the search range left of the region
+        x = max(roi.x - self._num_disparities, 0)
+        rows = slice(roi.y, roi.y + roi.height)
+        columns = slice(x, roi.x + roi.width)
+        shape = (roi.height, roi.x + roi.width - x)
+        if self._raw is None or self._raw.shape != shape:
+            self._raw = np.empty(shape, dtype=np.int16)
+            self._disparity = np.empty((roi.height, roi.width),
+                                       dtype=np.float32)
+        self._matcher.compute(np.ascontiguousarray(left[rows, columns]),
+                              np.ascontiguousarray(right[rows, columns]),
+                              self._raw)
+        # disparities are fixed-point with 4 fractional bits
+        np.multiply(self._raw[:, roi.x - x:], 1.0 / 16.0,
+                    out=self._disparity)
+        return self._disparity
+
+    def median(self: 'DisparityEstimator', disparity: np.ndarray) -> float:
+        """Median of valid disparities or 0 if none is valid.
+
+        Keyword arguments:
+        disparity --- Disparity returned by "compute()"
+        """
+        valid = disparity[disparity > 0]
+        return float(np.median(valid)) if valid.size else 0.0
@@ -0,0 +1,287 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from collections import deque
+import threading
+import bisect
+import traceback
+import logging
+import time
+
+import numpy as np
+from frame import Frame, FramePool
+
+
+class FrameSynchronizer:
+    """Matches frames of multiple devices captured at the same time.
+
+    Pairing frames by the time they arrive fails under load since
+    devices deliver with different and varying latency. Instead the
+    capture timestamps of each device are mapped onto the monotonic
+    clock using a "Clock" per device. Frames are then matched by the
+    mapped capture time.
+
+    Frames are pushed using "push()", for example as inline subscription
+    callback of each device. Frames are copied into a frame pool per
+    device and buffered. Once every device has a frame buffered the
+    oldest frames are compared. Frames captured more than "tolerance"
+    seconds before the latest of them can not be matched anymore and
+    are dropped. Otherwise the frames are delivered as a tuple to
+    "callback". At most "max_buffered" frames per device are buffered.
+    If a device stops delivering frames the oldest frames of the other
+    devices are dropped.
+    """
+
+    class Clock:
+        """Maps device timestamps onto the monotonic clock.
+
+        The difference between the time a frame arrived and its device
+        timestamp is the clock offset plus a varying latency. The
+        smallest difference seen during a window of "window" seconds is
+        the offset plus the smallest latency. A line fitted through the
+        smallest differences of the last "windows" windows gives the
+        offset and the drift of the device clock relative to the
+        monotonic clock.
+        """
+        def __init__(self: 'FrameSynchronizer.Clock', window: float = 1.0,
+                     windows: int = 30) -> None:
+            """Create clock.
+
+            Keyword arguments:
+            window --- Length of window in seconds
+            windows --- Number of windows to fit the line through
+            """
+            self.window = window
+            """Length of window in seconds."""
+            self._minima: deque = deque(maxlen=windows)
+            self._origin: float = None
+            self._window_start = 0.0
+            self._offset = 0.0
+            self._drift = 0.0
+            self._dirty = False
+
+        @property
+        def offset(self: 'FrameSynchronizer.Clock') -> float:
+            """Seconds to add to the latest device timestamp."""
+            self._fit()
+            return self._offset + self._drift * self._latest()
+
+        @property
+        def drift(self: 'FrameSynchronizer.Clock') -> float:
+            """Drift of device clock in seconds per second.
+
+            Positive if the device clock runs slow. Requires at least
+            two windows to estimate otherwise 0.
+            """
+            self._fit()
+            return self._drift
+
+        def add(self: 'FrameSynchronizer.Clock', device_time: float,
+                host_time: float) -> None:
+            """Add frame timestamp.
+
+            Keyword arguments:
+            device_time --- Timestamp of frame in seconds
+            host_time --- Monotonic time the frame arrived in seconds
+            """
+            if self._origin is None:
+                self._origin = device_time
+            t = device_time - self._origin
+            delta = host_time - device_time
+            if not self._minima or t - self._window_start >= self.window:
+                self._window_start = t
+                self._minima.append([t, delta])
+                self._dirty = True
+            elif delta < self._minima[-1][1]:
+                self._minima[-1] = [t, delta]
+                self._dirty = self._dirty or len(self._minima) == 1
+
+        def map(self: 'FrameSynchronizer.Clock',
+                device_time: float) -> float:
+            """Map device timestamp to monotonic time.
+
+            Keyword arguments:
+            device_time --- Timestamp in seconds
+            """
+            if self._origin is None:
+                return device_time
+            self._fit()
+            t = device_time - self._origin
+            return device_time + self._offset + self._drift * t
+
+        def reset(self: 'FrameSynchronizer.Clock') -> None:
+            """Forget all timestamps."""
+            self._minima.clear()
+            self._origin = None
+            self._offset = 0.0
+            self._drift = 0.0
+            self._dirty = False
+
+        def _latest(self: 'FrameSynchronizer.Clock') -> float:
+            """Latest window time relative to the first timestamp."""
+            return self._minima[-1][0] if self._minima else 0.0
+
+        def _fit(self: 'FrameSynchronizer.Clock') -> None:
+            """Fit line through window minima if changed."""
+            if not self._dirty:
+                return
+            self._dirty = False
+            # the minimum of the window still filling up is based on a
+            # few frames only. using it causes the offset to jump each
+            # time a window starts. use it only until a window completed
+            points = np.array(self._minima)
+            if len(points) > 1:
+                points = points[:-1]
+            if len(points) < 2:
+                self._offset = points[0, 1]
+                self._drift = 0.0
+                return
+            self._drift, self._offset = np.polyfit(
+                points[:, 0], points[:, 1], 1)
+
+    _logger = logging.getLogger("evcta.FrameSynchronizer")
+
+    def __init__(self: 'FrameSynchronizer', devices: "list[int]",
+                 callback, tolerance: float = 0.008,
+                 max_buffered: int = 8) -> None:
+        """Create synchronizer.
+
+        Keyword arguments:
+        devices --- Indices of devices to match frames of. Frames are
+                    identified by "Frame.device_index"
+        callback --- Callable with the signature
+                     "callback(timestamp: float, frames: tuple[Frame])".
+                     Timestamp is the mean mapped capture time. Frames
+                     are ordered like "devices" and only valid during
+                     the call
+        tolerance --- Maximum difference in seconds between the mapped
+                      capture times of matched frames
+        max_buffered --- Maximum number of frames buffered per device
+        """
+        self._devices = list(devices)
+        self.callback = callback
+        self.tolerance = tolerance
+        """Maximum difference in seconds between matched frames."""
+        self.max_buffered = max(max_buffered, 1)
+        """Maximum number of frames buffered per device."""
+        self._clocks = {x: FrameSynchronizer.Clock() for x in devices}
+        self._buffers: "dict[int, deque[tuple[float, Frame]]]" = {
+            x: deque() for x in devices}
+        self._pools: "dict[int, tuple[FramePool, int]]" = {}
+        self._lock = threading.Lock()
+        self.matched: int = 0
+        """Number of frame tuples delivered."""
+        self.dropped: "dict[int, int]" = {x: 0 for x in devices}
+        """Number of frames dropped per device."""
+
+    def clock(self: 'FrameSynchronizer',
+              device_index: int) -> 'FrameSynchronizer.Clock':
+        """Clock of device.
+
+        Keyword arguments:
+        device_index --- Index of device
+        """
+        return self._clocks[device_index]
+
+    def push(self: 'FrameSynchronizer', frame: Frame,
+             arrival: float | None = None) -> None:
+        """Add frame of a device.
+
+        Frames of devices not given to the constructor are ignored.
+        Suitable as subscription callback. Push frames as soon as they
+        arrive since the arrival time is used to map the timestamps.
+        Frames of each device have to be pushed from a single thread.
+
+        Keyword arguments:
+        frame --- Frame to add. Only accessed during the call
+        arrival --- Monotonic time the frame arrived or None for now
+        """
+        if arrival is None:
+            arrival = time.monotonic()
+        device = frame.device_index
+        clock = self._clocks.get(device)
+        if clock is None:
+            return
+
+        pool, size = self._pools.get(device, (None, 0))
+        if size < frame.data.size:
+            pool = FramePool(frame.output_format, frame.data.shape,
+                             self.max_buffered + 1)
+            self._pools[device] = (pool, frame.data.size)
+        pooled = pool.acquire(frame.data, frame)
+        pool.retain(pooled)
+
+        with self._lock:
+            clock.add(frame.timestamp, arrival)
+            buffer = self._buffers[device]
+            mapped = clock.map(frame.timestamp)
+            if buffer and mapped < buffer[-1][0]:
+                # clock estimate changed. keep buffer ordered
+                buffer.insert(bisect.bisect([x[0] for x in buffer],
+                                            mapped), (mapped, pooled))
+            else:
+                buffer.append((mapped, pooled))
+            if len(buffer) > self.max_buffered:
+                self._drop(device)
+            self._match()
+
+    def reset(self: 'FrameSynchronizer') -> None:
+        """Drop buffered frames and forget clock estimates.
+
+        Use after restarting capturing of a device.
+        """
+        with self._lock:
+            for device, buffer in self._buffers.items():
+                while buffer:
+                    buffer.popleft()[1].release()
+                self._clocks[device].reset()
+
+    def _drop(self: 'FrameSynchronizer', device: int) -> None:
+        """Drop oldest frame of device."""
+        self._buffers[device].popleft()[1].release()
+        self.dropped[device] += 1
+
+    def _match(self: 'FrameSynchronizer') -> None:
+        """Deliver matching frames dropping frames unable to match."""
+        buffers = [self._buffers[x] for x in self._devices]
+        while all(buffers):
+            latest = max(x[0][0] for x in buffers)
+            stale = [d for d, x in zip(self._devices, buffers)
+                     if x[0][0] < latest - self.tolerance]
+            if stale:
+                for device in stale:
+                    self._drop(device)
+                continue
+
+            heads = [x.popleft() for x in buffers]
+            timestamp = sum(x[0] for x in heads) / len(heads)
+            try:
+                self.callback(timestamp, tuple(x[1] for x in heads))
+            except Exception:
+                FrameSynchronizer._logger.error(traceback.format_exc())
+            finally:
+                for x in heads:
+                    x[1].release()
+            self.matched += 1
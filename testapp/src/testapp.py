@@ -23,7 +23,6 @@ SOFTWARE.
 """
 
 from enum import Enum
-from timeit import default_timer as timer
 import traceback
 import logging
 import asyncio as aio
@@ -35,7 +34,10 @@ import numpy as np
 from PIL import Image
 import cv2 as cv
 from camera import FTCamera
+from decoder import OutputFormat, StereoSide
+from filters import DarkFrame
 from vivetracker import ViveTracker
+from watchdog import StreamWatchdog
 
 isLinux = platform.system() == 'Linux'
 
@@ -65,6 +67,8 @@ class TestApp(toga.App):
             on_exit=self.on_exit_app)
         self.ftcamera: FTCamera = None
         self.vivetracker: ViveTracker = None
+        self.subscription: FTCamera.Subscription = None
+        self.watchdog: StreamWatchdog = None
         self.logger = logging.getLogger("evcta.TestApp")
 
     async def on_switch_enable(self: "TestApp",
@@ -88,11 +92,66 @@ class TestApp(toga.App):
 
     async def on_selection_show_change(self: "TestApp",
                                        widget: toga.Selection) -> None:
-        pass
+        if self.ftcamera and self.chk_preview.value:
+            self._subscribe_preview()
+
+    async def on_switch_preview(self: "TestApp",
+                                widget: toga.Switch) -> None:
+        if not self.ftcamera:
+            return
+        if widget.value:
+            self._subscribe_preview()
+        else:
+            self._unsubscribe_preview()
+            self.view_camera.image = Image.new("L", (400, 400), 40)
+
+    def _subscribe_preview(self: "TestApp") -> None:
+        """Subscribe preview replacing the previous subscription.
+
+        Frames are processed by a worker thread keeping only the latest
+        frame. This way slow processing drops frames instead of blocking
+        the capturing. The selected show type is passed along since
+        widgets must not be accessed from the worker thread.
+        """
+        self._unsubscribe_preview()
+        show = self.sel_show.value.value
+        self.subscription = self.ftcamera.subscribe(
+            lambda frame: self.process_frame(frame.data, show),
+            self._show_output_format(),
+            policy=FTCamera.QueuePolicy.DropOldest, queue_size=1)
+
+    def _unsubscribe_preview(self: "TestApp") -> None:
+        """Unsubscribe preview if subscribed.
+
+        Without consumers the stream is suspended after "idle_timeout".
+        """
+        if self.subscription:
+            self.ftcamera.unsubscribe(self.subscription)
+            self.subscription = None
+
+    def _show_output_format(self: "TestApp") -> OutputFormat:
+        """Output format to request for the selected show type.
+
+        Requests only the channels actually shown. With the VIVE Facial
+        Tracker all channels are identical after processing hence the
+        grayscale frame is enough unless a color conversion is shown.
+        """
+        match self.sel_show.value.value:
+            case TestApp.ShowType.Y:
+                return OutputFormat.Gray8
+            case TestApp.ShowType.YUV:
+                if self.vivetracker:
+                    return OutputFormat.Gray8
+                return OutputFormat.YUV444
+            case TestApp.ShowType.U | TestApp.ShowType.V:
+                if self.vivetracker:
+                    return OutputFormat.Gray8
+                return OutputFormat.YUV444Planar
+            case _:
+                return OutputFormat.YUV444
 
     async def on_selection_control_change(self: "TestApp",
                                           widget: toga.Selection) -> None:
-        self._set_no_update()
         c = widget.value.value if widget.value else None
 
         if c and c.type == FTCamera.ControlType.Integer:
@@ -139,6 +198,9 @@ class TestApp(toga.App):
         self.sld_control.tick_count = tickcount
         self.sld_control.value = value
         self.sld_control.enabled = is_writeable
+        # the slider rounds the value to ticks. remember the shown value to
+        # not write the rounded value back when the change event arrives
+        self._slider_shown = self.sld_control.value
 
     def _update_control_select(self: "TestApp",
                                control: "FTCamera.Control | None") -> None:
@@ -174,25 +236,22 @@ class TestApp(toga.App):
 
     async def on_slider_control_changed(self: "TestApp",
                                         widget: toga.Slider) -> None:
-        if self._is_no_update:
-            return
         c = self.sel_control.value.value if self.sel_control.value else None
-        if c and c.type == FTCamera.ControlType.Integer:
+        if c and c.type == FTCamera.ControlType.Integer\
+                and widget.value != self._slider_shown:
             old_val = c.value
             new_val = widget.value
             if new_val != old_val:
                 try:
                     c.value = new_val
                 except Exception:
-                    self._set_no_update()
                     self._update_control_slider(c)
                     return
+            self._slider_shown = widget.value
         self._update_control_info(c)
 
     async def on_selection_control_sel_changed(self: "TestApp",
                                                widget: toga.Selection) -> None:
-        if self._is_no_update:
-            return
         c = self.sel_control.value.value if self.sel_control.value else None
         if c and c.type == FTCamera.ControlType.Select\
                 and self.sel_control_sel.value:
@@ -202,15 +261,12 @@ class TestApp(toga.App):
                 try:
                     c.value = new_val
                 except Exception:
-                    self._set_no_update()
                     self._update_control_select(c)
                     return
         self._update_control_info(c)
 
     async def on_switch_control(self: "TestApp",
                                 widget: toga.Switch) -> None:
-        if self._is_no_update:
-            return
         c = self.sel_control.value.value if self.sel_control.value else None
         if c and c.type == FTCamera.ControlType.Boolean:
             old_val = c.value
@@ -219,7 +275,6 @@ class TestApp(toga.App):
                 try:
                     c.value = new_val
                 except Exception:
-                    self._set_no_update()
                     self._update_control_switch(c)
                     return
         self._update_control_info(c)
@@ -233,12 +288,61 @@ class TestApp(toga.App):
                 try:
                     c.value = c.default
                 finally:
-                    self._set_no_update()
                     self._update_control_slider(c)
                     self._update_control_select(c)
                     self._update_control_switch(c)
                     self._update_control_info(c)
 
+    async def on_button_load_controls(self: "TestApp",
+                                      widget: toga.Button) -> None:
+        """Enumerate controls on first use of the control panel.
+
+        Enumerating queries every control from the device. This is
+        skipped by "fast_open" to open the device faster.
+        """
+        if not self.ftcamera or len(self.sel_control.items) > 0:
+            return
+        try:
+            self.sel_control.items = [dict(name=x.name, value=x)
+                                      for x in self.ftcamera.controls]
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+    async def on_button_control_snapshot(self: "TestApp",
+                                         widget: toga.Button) -> None:
+        if self.ftcamera:
+            self.ftcamera.save_control_profile("testapp")
+
+    async def on_button_dark_frame(self: "TestApp",
+                                   widget: toga.Button) -> None:
+        if not self.vivetracker:
+            return
+        await self.main_window.info_dialog(
+            title="Dark Frame",
+            message="Cover both cameras then press OK")
+        self.vivetracker.dark_frame = None
+        try:
+            self.vivetracker.dark_frame =\
+                await self.ftcamera.calibrate_dark_frame()
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+    async def on_button_control_restore(self: "TestApp",
+                                        widget: toga.Button) -> None:
+        if not self.ftcamera\
+                or "testapp" not in self.ftcamera.control_profiles:
+            return
+        c = self.sel_control.value.value if self.sel_control.value else None
+        try:
+            self.ftcamera.restore_control_profile("testapp")
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        finally:
+            self._update_control_slider(c)
+            self._update_control_select(c)
+            self._update_control_switch(c)
+            self._update_control_info(c)
+
     def _update_control_info(self: "TestApp",
                              control: FTCamera.Control | None) -> None:
         if control:
@@ -249,18 +353,20 @@ class TestApp(toga.App):
         else:
             self.lab_control_info.text = "Control: -"
 
-    def process_frame(self: "TestApp", data: np.ndarray) -> None:
-        if self.vivetracker:
-            data = self.vivetracker.process_frame(data)
-        match self.sel_show.value.value:
-            case TestApp.ShowType.YUV:
+    def process_frame(self: "TestApp", data: np.ndarray,
+                      show: "TestApp.ShowType") -> None:
+        vivetracker = self.vivetracker
+        if vivetracker:
+            data = vivetracker.process_frame(data)
+        match show:
+            case TestApp.ShowType.YUV | TestApp.ShowType.Y:
                 pass
-            case TestApp.ShowType.Y:
-                data = cv.split(data)[0]
             case TestApp.ShowType.U:
-                data = cv.split(data)[1]
+                if data.ndim == 3:
+                    data = data[1]
             case TestApp.ShowType.V:
-                data = cv.split(data)[2]
+                if data.ndim == 3:
+                    data = data[2]
             case TestApp.ShowType.RGB:
                 data = cv.cvtColor(data, cv.COLOR_YUV2RGB)
             case TestApp.ShowType.SimulateFix:
@@ -274,29 +380,29 @@ class TestApp(toga.App):
                 data = cv.cvtColor(data, cv.COLOR_YUV2BGR)
                 data = cv.cvtColor(data, cv.COLOR_BGR2YUV)
                 data = cv.split(data)[0]
-        image = Image.fromarray(data)
+        # the image is shown later by the loop thread. copy it since the
+        # frame and the processing result buffers are reused
+        image = Image.fromarray(data.copy())
 
-        if isLinux:
-            self.view_camera.image = image
-        else:
-            def do_it():
+        def do_it():
+            if self.subscription:
                 self.view_camera.image = image
-            aio.get_event_loop().call_later(0, do_it)
+        self._loop.call_soon_threadsafe(do_it)
 
     async def open_ftcamera(self: "TestApp") -> None:
         if self.ftcamera:
             return
         try:
+            self._loop = aio.get_running_loop()
             self.ftcamera = FTCamera(int(self.edit_device.value))
+            self.ftcamera.fast_open = True
             self.ftcamera.open()
-            self.ftcamera.callback_frame = self.process_frame
             self.ftcamera.start_read()
             self.chk_enable.value = True
-            self.lab_cam_info.text = "Camera: {}x{} @ {:.1f} ({})".format(
+            self.lab_cam_info.text = "Camera: {}x{} @ {:.1f} ({}, {})".format(
                 self.ftcamera.frame_width, self.ftcamera.frame_height,
-                self.ftcamera.frame_fps, self.ftcamera.frame_format_description)
-            self.sel_control.items = [dict(name=x.name, value=x)
-                                      for x in self.ftcamera.controls]
+                self.ftcamera.frame_fps, self.ftcamera.frame_format_description,
+                self.ftcamera.decoder_name)
         except Exception:
             self.logger.error(traceback.format_exc())
             await self.close_ftcamera()
@@ -307,14 +413,38 @@ class TestApp(toga.App):
         if ViveTracker.is_camera_vive_tracker(self.ftcamera.device):
             try:
                 if isLinux:
-                    self.vivetracker = ViveTracker(self.ftcamera.device.fileno())
+                    self.vivetracker = ViveTracker(
+                        self.ftcamera.device.fileno(), self.ftcamera.profiler)
                 else:
-                    self.vivetracker = ViveTracker(self.ftcamera.device,
-                                                   self.ftcamera.device_index)
+                    self.vivetracker = ViveTracker(
+                        self.ftcamera.device, self.ftcamera.device_index,
+                        self.ftcamera.profiler)
             except Exception:
                 self.logger.error(traceback.format_exc())
 
+        if self.vivetracker:
+            # processing uses only the image of the left camera
+            self.ftcamera.roi = StereoSide.Left
+            self.vivetracker.dark_frame = DarkFrame.load(
+                self.ftcamera.device_key)
+            self.ftcamera.exposure = self.vivetracker.exposure
+            self.ftcamera.gain = self.vivetracker.gain
+            self.ftcamera.stream_switch = self.vivetracker.set_stream_enabled
+            self.ftcamera.idle_timeout = 10.0
+        self.watchdog = StreamWatchdog(self.ftcamera, self.vivetracker)
+        self.watchdog.start()
+        if self.chk_preview.value:
+            self._subscribe_preview()
+
     async def close_ftcamera(self: "TestApp") -> None:
+        if self.watchdog:
+            await self.watchdog.stop()
+            self.logger.info("stream stalls: {} (failed {})".format(
+                self.watchdog.stats.stalls, self.watchdog.stats.failed))
+            self.watchdog = None
+
+        self._unsubscribe_preview()
+
         if self.vivetracker:
             self.vivetracker.dispose()
             self.vivetracker = None
@@ -329,22 +459,8 @@ class TestApp(toga.App):
         self.lab_cam_info.text = "Camera: -"
         self.sel_control.items = []
 
-    def _set_no_update(self: "TestApp") -> None:
-        self._timer_no_update = timer()
-
-    @property
-    def _is_no_update(self: "TestApp") -> bool:
-        if self._timer_no_update:
-            if (timer() - self._timer_no_update) < 0.25:
-                return True
-            self._timer_no_update = None
-        return False
-
-    def _reset_no_update(self: "TestApp") -> None:
-        self._timer_no_update = False
-
     def startup(self: "TestApp") -> None:
-        self._timer_no_update = None
+        self._slider_shown = None
         content = toga.Box(style=tp.Pack(direction=tp.COLUMN))
 
         # styles
@@ -364,6 +480,11 @@ class TestApp(toga.App):
             on_change=self.on_switch_enable)
         box_line.add(self.chk_enable)
 
+        self.chk_preview = toga.Switch(
+            "Preview", style=tp.Pack(flex=1), value=True,
+            on_change=self.on_switch_preview)
+        box_line.add(self.chk_preview)
+
         self.sel_show = toga.Selection(
             items=SelectionHelper.from_enum(TestApp.ShowType),
             style=tp.Pack(flex=2), accessor="title",
@@ -384,6 +505,10 @@ class TestApp(toga.App):
         box_line = toga.Box(style=tp.Pack(direction=tp.ROW))
         content.add(box_line)
 
+        self.btn_load_controls = toga.Button(
+            "C", on_press=self.on_button_load_controls)
+        box_line.add(self.btn_load_controls)
+
         self.sel_control = toga.Selection(
             items=[], accessor="name",
             on_change=self.on_selection_control_change)
@@ -412,6 +537,18 @@ class TestApp(toga.App):
             "R", on_press=self.on_button_controlreset)
         box_line.add(self.btn_reset_control)
 
+        self.btn_snapshot_controls = toga.Button(
+            "S", on_press=self.on_button_control_snapshot)
+        box_line.add(self.btn_snapshot_controls)
+
+        self.btn_restore_controls = toga.Button(
+            "L", on_press=self.on_button_control_restore)
+        box_line.add(self.btn_restore_controls)
+
+        self.btn_dark_frame = toga.Button(
+            "D", on_press=self.on_button_dark_frame)
+        box_line.add(self.btn_dark_frame)
+
         # line
         box_line = toga.Box(style=tp.Pack(direction=tp.ROW))
         content.add(box_line)
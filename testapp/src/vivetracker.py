@@ -26,15 +26,19 @@ from timeit import default_timer as timer
 
 import platform
 import logging
+import threading
 import ctypes
 import time
 import cv2 as cv
 import numpy as np
+from startup import StartupProfiler
+from filters import DarkFrame, FrameGeometry, TemporalDenoiser
 
 isLinux = platform.system() == 'Linux'
 
 if isLinux:
     import fcntl
+    import v4l2py.device as v4ld
 
     _IOC_NRBITS = 8
     _IOC_TYPEBITS = 8
@@ -318,10 +322,28 @@ else:
 
 
 class ViveTracker:
-    """Provides support to activate data steam on VIVE Facial Tracker camera."""
+    """Provides support to activate data steam on VIVE Facial Tracker camera.
+
+    Public methods can be called from different threads. Requests to the
+    device are serialized since they share the same buffers.
+    """
     _XU_TASK_SET = 0x50
     _XU_TASK_GET = 0x51
     _XU_REG_SENSOR = 0xab
+    _XU_MAX_VALUE_LEN = 4
+
+    _SENSOR_PARAMETERS = (
+        (0x00, 0x40), (0x08, 0x01), (0x70, 0x00),
+        (0x02, 0xff), (0x03, 0xff), (0x04, 0xff),
+        (0x0e, 0x00),
+        (0x05, 0xb2), (0x06, 0xb2), (0x07, 0xb2),
+        (0x0f, 0x03))
+
+    # registers 0x02-0x04 hold the exposure and 0x05-0x07 the gain
+    _EXPOSURE_ADDRESS = 0x02
+    _GAIN_ADDRESS = 0x05
+    _SENSOR_VALUE_LEN = 3
+    """Sensor register addresses and values written during activation."""
 
     if isLinux:
         _UVC_SET_CUR = 0x01
@@ -347,7 +369,8 @@ class ViveTracker:
     _logger = logging.getLogger("evcta.ViveTracker")
 
     if isLinux:
-        def __init__(self: 'ViveTracker', fd: int) -> None:
+        def __init__(self: 'ViveTracker', fd: int,
+                     profiler: StartupProfiler | None = None) -> None:
             """Create VIVE Face Tracker instance.
 
             Constructor tries first to detect if this is a VIVE Face Tracker.
@@ -361,15 +384,22 @@ class ViveTracker:
             fd --- File descriptor of device. Using Video4Linux device use
                 "device.fileno()" for this argument. Using FTCamera use
                 "ftcamera.device.fileno()" for this argument.
+            profiler --- Profiler to measure startup phases with or None.
+                         Using FTCamera use "ftcamera.profiler"
             """
             ViveTracker._logger.info("create vive tracker")
             if not fd:
                 raise Exception("Missing camera file descriptor")
             self._fd: int = fd
+            self._lock = threading.RLock()
+            self._profiler = profiler or StartupProfiler()
+            self._exposure: int | None = None
+            self._gain: int | None = None
             self._init_common()
     else:
         def __init__(self: 'ViveTracker', device: pgdsg.VideoInput,
-                     index: int) -> None:
+                     index: int,
+                     profiler: StartupProfiler | None = None) -> None:
             """Create VIVE Face Tracker instance.
 
             Constructor tries first to detect if this is a VIVE Face Tracker.
@@ -381,15 +411,23 @@ class ViveTracker:
 
             Keyword arguments:
             device --- DirectShow device
+            index --- Index of device
+            profiler --- Profiler to measure startup phases with or None.
+                         Using FTCamera use "ftcamera.profiler"
             """
             self._device = device
             self._device_index = index
             self._xu_control: IKsControl = None
+            self._lock = threading.RLock()
+            self._profiler = profiler or StartupProfiler()
+            self._exposure: int | None = None
+            self._gain: int | None = None
 
             ViveTracker._logger.info("create vive tracker")
 
             try:
-                self._open_controller()
+                with self._profiler.phase("vive tracker open controller"):
+                    self._open_controller()
                 self._init_common()
             except Exception:
                 self.dispose()
@@ -398,11 +436,36 @@ class ViveTracker:
         self._dataBufLen = 384
         self._resize_data_buf()
         self._bufferRegister: list[ctypes.c_uint8] = (ctypes.c_uint8 * 17)()
+        self._ranged_reads: bool | None = None
 
         self._debug = False
 
-        self._detect_vive_tracker()
-        self._activate_tracker()
+        self.denoisers: "list[TemporalDenoiser] | None" = None
+        """Temporal denoiser for the left and right eye or None.
+
+        Set to "[TemporalDenoiser(), TemporalDenoiser()]" to denoise
+        frames in "process_frame()". Denoisers keep state across frames.
+        Call "reset()" on them if frames are skipped for a longer time.
+        """
+
+        self.dark_frame: DarkFrame | None = None
+        """Dark frame to subtract in "process_frame()" or None.
+
+        Has to cover the region of interest of the processed frames.
+        See "FTCamera.calibrate_dark_frame()".
+        """
+
+        self.geometry = FrameGeometry(400, 400)
+        """Geometry applied to the left eye image in "process_frame()".
+
+        Scales the eye image to 400x400 by default. Set crop, flip,
+        undistortion and interpolation on it as required.
+        """
+
+        with self._profiler.phase("vive tracker detect"):
+            self._detect_vive_tracker()
+        with self._profiler.phase("vive tracker activate"):
+            self._activate_tracker()
 
     def _resize_data_buf(self: 'ViveTracker') -> None:
         self._bufferSend: list[ctypes.c_uint8] = (ctypes.c_uint8 * self._dataBufLen)()
@@ -425,10 +488,14 @@ class ViveTracker:
             check the vendor-id(0x0bb4) and device-id (0x0321). But these
             can be only found by querying full USB descriptor. Left for
             the reader as excercise.
+
+            The card name is queried directly from the device instead of
+            using "device.info" which enumerates all device information.
             """
-            check = "HTC Multimedia Camera" in device.info.card
+            card = v4ld.read_capabilities(device.fileno()).card.decode()
+            check = "HTC Multimedia Camera" in card
             ViveTracker._logger.info("is_camera_vive_tracker: '{}' -> {}".
-                                     format(device.info.card, check))
+                                     format(card, check))
             return check
     else:
         @staticmethod
@@ -438,28 +505,158 @@ class ViveTracker:
                                      format(device.Name, check))
             return check
 
+    @property
+    def exposure(self: 'ViveTracker') -> int | None:
+        """Exposure set on the sensor or None if not activated."""
+        return self._exposure
+
+    @property
+    def gain(self: 'ViveTracker') -> int | None:
+        """Gain set on the sensor or None if not activated."""
+        return self._gain
+
+    def set_stream_enabled(self: 'ViveTracker', enable: bool) -> None:
+        """Enable or disable the data stream without setting parameters.
+
+        Disabling the stream stops the frame transfers. Enabling resumes
+        with the parameters set before. Suitable for
+        "FTCamera.stream_switch".
+
+        Keyword arguments:
+        enable --- Enable or disable data stream
+        """
+        ViveTracker._logger.info("set stream enabled: {}".format(enable))
+        with self._lock:
+            self._set_cur(self._dataTest)
+            self._set_enable_stream(enable)
+
+    def restart_stream(self: 'ViveTracker') -> None:
+        """Disable and enable the data stream without setting parameters.
+
+        Cheapest way to recover a stalled stream."""
+        ViveTracker._logger.info("restart stream")
+        with self._lock:
+            self._set_cur(self._dataTest)
+            self._set_enable_stream(False)
+            time.sleep(0.25)
+            self._set_cur(self._dataTest)
+            self._set_enable_stream(True)
+            time.sleep(0.25)
+
+    def activate(self: 'ViveTracker', force: bool = True) -> None:
+        """Run the activation sequence again.
+
+        Keyword arguments:
+        force --- Disable the stream, set all camera parameters and enable
+                  the stream again. If False skips the steps matching the
+                  state probed from the device.
+        """
+        with self._lock:
+            self._activate_tracker(force)
+
+    if isLinux:
+        def attach(self: 'ViveTracker', fd: int) -> None:
+            """Use reopened device. Call "activate()" afterwards.
+
+            Keyword arguments:
+            fd --- File descriptor of reopened device
+            """
+            if not fd:
+                raise Exception("Missing camera file descriptor")
+            with self._lock:
+                self._fd = fd
+    else:
+        def attach(self: 'ViveTracker', device: pgdsg.VideoInput,
+                   index: int) -> None:
+            """Use reopened device. Call "activate()" afterwards.
+
+            Keyword arguments:
+            device --- Reopened DirectShow device
+            index --- Index of device
+            """
+            with self._lock:
+                self._close_controller()
+                self._device = device
+                self._device_index = index
+                self._open_controller()
+
+    def read_sensor_registers(self: 'ViveTracker', address: int,
+                              count: int) -> bytes:
+        """Read consecutive sensor registers.
+
+        Keyword arguments:
+        address --- First address to read
+        count --- Number of addresses to read
+        """
+        with self._lock:
+            self._set_cur(self._dataTest)
+            return self._read_registers(ViveTracker._XU_REG_SENSOR,
+                                        address, count)
+
+    def write_sensor_registers(self: 'ViveTracker', address: int,
+                               data: bytes) -> None:
+        """Write consecutive sensor registers.
+
+        Changing sensor registers while streaming can disturb frames.
+        Values written are not tracked by "exposure" and "gain".
+
+        Keyword arguments:
+        address --- First address to write
+        data --- Values to write starting at "address"
+        """
+        with self._lock:
+            self._set_cur(self._dataTest)
+            self._write_registers(ViveTracker._XU_REG_SENSOR, address, data)
+
+    def sensor_snapshot(self: 'ViveTracker') -> "dict[int, int]":
+        """Values of all sensor registers for diagnostics.
+
+        Reads the 256 addresses using 64 requests if the device answers
+        ranged reads, otherwise 256. Returns dictionary mapping address to
+        value.
+        """
+        return dict(enumerate(self.read_sensor_registers(0x00, 0x100)))
+
     def dispose(self: 'ViveTracker') -> None:
         """Dispose of tracker.
 
         Deactivates data stream."""
         ViveTracker._logger.info("dispose vive tracker")
 
-        if isLinux:
-            self._deactivate_tracker()
-        else:
-            self._deactivate_tracker()
-            self._close_controller()
+        with self._lock:
+            if isLinux:
+                self._deactivate_tracker()
+            else:
+                self._deactivate_tracker()
+                self._close_controller()
 
     def process_frame(self: 'ViveTracker', data: np.ndarray) -> np.ndarray:
         """Process a captured frame.
 
-        Right now this applies a median blur but other manipulations
-        are possible to improve the image if desired.
+        Right now this crops the left eye, subtracts "dark_frame" if set,
+        applies the temporal denoiser if "denoisers" is set and
+        applies "geometry". Other manipulations are possible to improve
+        the image if desired. Grayscale results are reused by the next
+        call.
+
+        The frame can be either a YUV frame of shape (height, width, 3)
+        or a grayscale frame of shape (height, width) as produced by
+        "OutputFormat.Gray8". The result has the same number of channels
+        as the frame. Using grayscale frames is faster since the VIVE
+        Facial Tracker stores the image in the Y channel only.
 
         Keyword arguments:
         data --- Frame to process
         """
-        lum = cv.split(data)[0]
+        if data.ndim == 2:
+            lum = data
+        else:
+            lum = cv.split(data)[0]
+
+        lum = lum[:, 0:200]
+
+        if self.dark_frame:
+            lum = self.dark_frame.subtract(lum)
 
         """
         gamma = 2.2
@@ -469,14 +666,17 @@ class ViveTracker:
         lum = cv.LUT(lum, lut)
         """
 
-        lum = lum[:, 0:200]
+        if self.denoisers:
+            lum = self.denoisers[0].process(lum)
 
-        lum = cv.resize(lum, (400, 400))
+        lum = self.geometry.apply(lum)
 
         """
         lum = cv.medianBlur(lum, 5)
         """
 
+        if data.ndim == 2:
+            return lum
         return cv.merge((lum, lum, lum))
 
     if not isLinux:
@@ -702,9 +902,9 @@ class ViveTracker:
         br[4] = ctypes.c_uint8(value_len)  # data width in bytes
 
         # address
-        br[5] = ctypes.c_uint8((address > 24) & 0xff)
-        br[6] = ctypes.c_uint8((address > 16) & 0xff)
-        br[7] = ctypes.c_uint8((address > 8) & 0xff)
+        br[5] = ctypes.c_uint8((address >> 24) & 0xff)
+        br[6] = ctypes.c_uint8((address >> 16) & 0xff)
+        br[7] = ctypes.c_uint8((address >> 8) & 0xff)
         br[8] = ctypes.c_uint8(address & 0xff)
 
         # page address
@@ -714,40 +914,127 @@ class ViveTracker:
         br[12] = ctypes.c_uint8(0x01)
 
         # value
-        br[13] = ctypes.c_uint8((value > 24) & 0xff)
-        br[14] = ctypes.c_uint8((value > 16) & 0xff)
-        br[15] = ctypes.c_uint8((value > 8) & 0xff)
+        br[13] = ctypes.c_uint8((value >> 24) & 0xff)
+        br[14] = ctypes.c_uint8((value >> 16) & 0xff)
+        br[15] = ctypes.c_uint8((value >> 8) & 0xff)
         br[16] = ctypes.c_uint8(value & 0xff)
 
     def _set_register(self: 'ViveTracker', reg: int, address: int,
-                      value: int, timeout: float = 0.5) -> None:
+                      value: int, timeout: float = 0.5,
+                      value_len: int = 1) -> None:
         """Set device register.
 
         Keyword arguments:
         reg --- Register to manipulate
         address --- Address to manipulate
-        value --- Value to set
+        value --- Value to set. With "value_len" larger than 1 the most
+                  significant byte is written to "address" and the others
+                  to the following addresses
         timeout --- Timeout in seconds. Use 0 to send register without
                     proper request handling
+        value_len --- Length of value in bytes from 1 to 4
         """
-        self._init_register(ViveTracker._XU_TASK_SET, reg, address, 1, value, 1)
+        self._init_register(ViveTracker._XU_TASK_SET, reg, address, 1,
+                            value, value_len)
         if timeout > 0:
             self._set_cur(self._bufferRegister, timeout)
         else:
             self._set_cur_no_resp(self._bufferRegister)
 
     def _get_register(self: 'ViveTracker', reg: int, address: int,
-                      timeout: float = 0.5) -> int:
+                      timeout: float = 0.5, value_len: int = 1) -> int:
         """Get device register.
 
         Keyword arguments:
         reg --- Register to fetch
         address --- Address to fetch
         timeout --- Timeout in seconds
+        value_len --- Length of value in bytes from 1 to 4. The byte at
+                      "address" becomes the most significant byte
         """
-        self._init_register(ViveTracker._XU_TASK_GET, reg, address, 1, 0, 1)
+        self._init_register(ViveTracker._XU_TASK_GET, reg, address, 1,
+                            0, value_len)
         self._set_cur(self._bufferRegister, timeout)
-        return int(self._bufferReceive[17])
+        return int.from_bytes(
+            bytes(self._bufferReceive[17:17 + value_len]), 'big')
+
+    def _read_registers(self: 'ViveTracker', reg: int, address: int,
+                        count: int, timeout: float = 0.5) -> bytes:
+        """Read consecutive device registers.
+
+        Reads up to 4 registers per request instead of one if the device
+        answers ranged reads. This is verified with the first read.
+
+        Keyword arguments:
+        reg --- Register to fetch
+        address --- First address to fetch
+        count --- Number of addresses to fetch
+        timeout --- Timeout in seconds per request
+        """
+        data = bytearray()
+        end = address + count
+        while address < end:
+            length = 1
+            if self._ranged_reads is not False:
+                length = min(end - address, ViveTracker._XU_MAX_VALUE_LEN)
+            if length > 1 and self._ranged_reads is None:
+                chunk = self._verify_ranged_read(reg, address, length,
+                                                 timeout)
+            else:
+                chunk = self._get_register(reg, address, timeout, length
+                                           ).to_bytes(length, 'big')
+            data += chunk
+            address += length
+        return bytes(data)
+
+    def _verify_ranged_read(self: 'ViveTracker', reg: int, address: int,
+                            length: int, timeout: float) -> bytes:
+        """Check once if the device answers ranged reads.
+
+        Compares a ranged read against single register reads of the same
+        addresses. If they differ all further reads use single registers.
+        Returns the values read using single registers.
+
+        Keyword arguments:
+        reg --- Register to fetch
+        address --- First address to fetch
+        length --- Number of addresses to fetch
+        timeout --- Timeout in seconds per request
+        """
+        ranged = self._get_register(reg, address, timeout, length
+                                    ).to_bytes(length, 'big')
+        single = bytes(self._get_register(reg, address + i, timeout)
+                       for i in range(length))
+        self._ranged_reads = ranged == single
+        ViveTracker._logger.info("ranged register reads: {}".format(
+            "supported" if self._ranged_reads else "not supported"))
+        return single
+
+    def _write_registers(self: 'ViveTracker', reg: int, address: int,
+                         data: bytes, timeout: float = 0.5) -> None:
+        """Write consecutive device registers.
+
+        Writes up to 4 registers per request instead of one if the device
+        answers ranged reads. If this is not verified yet a ranged read
+        is verified first. A device ignoring the value length for reads
+        is assumed to ignore it for writes too.
+
+        Keyword arguments:
+        reg --- Register to manipulate
+        address --- First address to manipulate
+        data --- Values to write starting at "address"
+        timeout --- Timeout in seconds per request
+        """
+        step = min(len(data), ViveTracker._XU_MAX_VALUE_LEN)
+        if step > 1 and self._ranged_reads is None:
+            self._verify_ranged_read(reg, address, step, timeout)
+        if not self._ranged_reads:
+            step = 1
+        for i in range(0, len(data), step):
+            chunk = data[i:i + step]
+            self._set_register(reg, address + i,
+                               int.from_bytes(chunk, 'big'),
+                               timeout, len(chunk))
 
     def _set_register_sensor(self: 'ViveTracker', address: int, value: int,
                              timeout: float = 0.5) -> None:
@@ -803,35 +1090,102 @@ class ViveTracker:
                             format(length))
         ViveTracker._logger.info("vive tracker detected")
 
-    def _activate_tracker(self: 'ViveTracker') -> None:
+    def _probe_tracker(self: 'ViveTracker') -> "list[tuple[int, int]]":
+        """Sensor parameters not matching the values on the device.
+
+        Reading a register is a single request while writing all of them
+        requires disabling the stream and waiting for the device twice.
+        Returns all parameters if reading fails.
+        """
+        try:
+            self._set_cur(self._dataTest)
+            values = {}
+            for a, v in ViveTracker._SENSOR_PARAMETERS:
+                if a not in values:
+                    values.update(enumerate(self._read_registers(
+                        ViveTracker._XU_REG_SENSOR, a,
+                        ViveTracker._XU_MAX_VALUE_LEN), a))
+            return [(a, v) for a, v in ViveTracker._SENSOR_PARAMETERS
+                    if values[a] != v]
+        except Exception as e:
+            ViveTracker._logger.info("-> probe failed: {}".format(e))
+            return list(ViveTracker._SENSOR_PARAMETERS)
+
+    def _activate_tracker(self: 'ViveTracker', force: bool = False) -> None:
         """Activate tracker.
 
-        Sets parameters and enables data stream."""
+        Sets parameters and enables data stream. Unless forced only
+        parameters not matching the device are written. If all match the
+        stream is enabled without disabling it first. The stream enable
+        state can not be read back but enabling it is harmless if the
+        device is streaming already.
+
+        Keyword arguments:
+        force --- Write all parameters without probing the device first
+        """
         ViveTracker._logger.info("activate vive tracker")
 
+        profiler = self._profiler
+        parameters = list(ViveTracker._SENSOR_PARAMETERS)
+        if not force:
+            ViveTracker._logger.info("-> probe tracker")
+            with profiler.phase("probe"):
+                parameters = self._probe_tracker()
+            if not parameters:
+                ViveTracker._logger.info("-> already configured")
+                with profiler.phase("enable stream"):
+                    self._set_cur(self._dataTest)
+                    self._set_enable_stream(True)
+                self._store_camera_parameters()
+                return
+
         ViveTracker._logger.info("-> disable stream")
-        self._set_cur(self._dataTest)
-        self._set_enable_stream(False)
-        time.sleep(0.25)
+        with profiler.phase("disable stream"):
+            self._set_cur(self._dataTest)
+            self._set_enable_stream(False)
+            time.sleep(0.25)
 
         ViveTracker._logger.info("-> set camera parameters")
-        self._set_cur(self._dataTest)
-        self._set_register_sensor(0x00, 0x40)
-        self._set_register_sensor(0x08, 0x01)
-        self._set_register_sensor(0x70, 0x00)
-        self._set_register_sensor(0x02, 0xff)
-        self._set_register_sensor(0x03, 0xff)
-        self._set_register_sensor(0x04, 0xff)
-        self._set_register_sensor(0x0e, 0x00)
-        self._set_register_sensor(0x05, 0xb2)
-        self._set_register_sensor(0x06, 0xb2)
-        self._set_register_sensor(0x07, 0xb2)
-        self._set_register_sensor(0x0f, 0x03)
+        with profiler.phase("set camera parameters"):
+            self._set_camera_parameters(parameters)
 
         ViveTracker._logger.info("-> enable stream")
+        with profiler.phase("enable stream"):
+            self._set_cur(self._dataTest)
+            self._set_enable_stream(True)
+            time.sleep(0.25)
+
+    def _set_camera_parameters(self: 'ViveTracker',
+                               parameters: "list[tuple[int, int]]") -> None:
+        """Write sensor registers.
+
+        Keyword arguments:
+        parameters --- List of tuples (address, value) to write
+        """
         self._set_cur(self._dataTest)
-        self._set_enable_stream(True)
-        time.sleep(0.25)
+        for address, value in parameters:
+            self._set_register_sensor(address, value)
+        self._store_camera_parameters()
+
+    def _store_camera_parameters(self: 'ViveTracker') -> None:
+        """Store exposure and gain written to the sensor."""
+        values = dict(ViveTracker._SENSOR_PARAMETERS)
+        self._exposure = ViveTracker._sensor_value(
+            values, ViveTracker._EXPOSURE_ADDRESS)
+        self._gain = ViveTracker._sensor_value(
+            values, ViveTracker._GAIN_ADDRESS)
+
+    @staticmethod
+    def _sensor_value(values: "dict[int, int]", address: int) -> int:
+        """Multi-byte sensor value stored most significant byte first.
+
+        Keyword arguments:
+        values --- Sensor register values by address
+        address --- Address of most significant byte
+        """
+        return int.from_bytes(bytes(
+            values[address + i]
+            for i in range(ViveTracker._SENSOR_VALUE_LEN)), 'big')
 
     def _deactivate_tracker(self: 'ViveTracker') -> None:
         """Deactivate tracker.
@@ -0,0 +1,269 @@
+"""
+MIT License
+
+Copyright DragonDreams GmbH 2024
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from collections import deque
+from enum import Enum
+import asyncio as aio
+import traceback
+import platform
+import logging
+import time
+
+from camera import FTCamera
+from vivetracker import ViveTracker
+
+isLinux = platform.system() == 'Linux'
+
+
+class StreamWatchdog:
+    """Detects stalled capturing and recovers in place.
+
+    Tracks the time since the last non-empty frame arrived. If no frame
+    arrived for "timeout" seconds the stream stalled. Recovery escalates
+    from cheap to expensive stages until frames arrive again:
+    1. Restart the tracker data stream
+    2. Run the tracker activation sequence again
+    3. Reopen the device and activate the tracker again
+
+    The first two stages require "tracker" to be set. Each stage waits
+    up to "recovery_timeout" seconds for frames to arrive. If all stages
+    fail the stall is counted as failed and recovery starts over once
+    "timeout" passed again. Reopening the device ends frame streams
+    created by "FTCamera.frames()". Subscriptions are kept.
+
+    Streams suspended by "FTCamera.suspend_stream()" are not watched.
+    Stalls and recoveries are recorded in "stats".
+    """
+
+    class Stage(Enum):
+        """Recovery stage."""
+        RestartStream = 'restart stream'
+        """Disable and enable the tracker data stream."""
+        Activate = 'activate'
+        """Run the tracker activation sequence."""
+        Reopen = 'reopen'
+        """Reopen the device."""
+
+    class Stall:
+        """Record of a stall."""
+        def __init__(self: 'StreamWatchdog.Stall', reason: str,
+                     detected: float) -> None:
+            """Create stall record.
+
+            Keyword arguments:
+            reason --- Reason of stall
+            detected --- Monotonic time the stall has been detected
+            """
+            self.reason = reason
+            """Reason of stall."""
+            self.detected = detected
+            """Monotonic time the stall has been detected."""
+            self.stage: StreamWatchdog.Stage | None = None
+            """Stage recovering the stream or None if recovery failed."""
+            self.recovery_time: float = 0.0
+            """Seconds from detecting the stall until frames arrived
+            again or recovery failed."""
+            self.downtime: float = 0.0
+            """Seconds without frames including the detection time."""
+
+        def __repr__(self: 'StreamWatchdog.Stall') -> str:
+            return "(reason='{}', stage={}, recovery={:.0f}ms,"\
+                " downtime={:.0f}ms)".format(
+                    self.reason, self.stage.value if self.stage else None,
+                    self.recovery_time * 1000.0, self.downtime * 1000.0)
+
+    class Stats:
+        """Watchdog statistics."""
+        def __init__(self: 'StreamWatchdog.Stats') -> None:
+            self.stalls: int = 0
+            """Number of stalls detected."""
+            self.failed: int = 0
+            """Number of stalls no stage recovered."""
+            self.recovered: "dict[StreamWatchdog.Stage, int]" = {
+                x: 0 for x in StreamWatchdog.Stage}
+            """Number of stalls recovered per stage."""
+            self.downtime: float = 0.0
+            """Total seconds without frames due to stalls."""
+            self.history: "deque[StreamWatchdog.Stall]" = deque(maxlen=20)
+            """Most recent stalls."""
+
+        @property
+        def last(self: 'StreamWatchdog.Stats'
+                 ) -> 'StreamWatchdog.Stall | None':
+            """Most recent stall or None."""
+            return self.history[-1] if self.history else None
+
+    _logger = logging.getLogger("evcta.StreamWatchdog")
+
+    def __init__(self: 'StreamWatchdog', ftcamera: FTCamera,
+                 tracker: ViveTracker | None = None,
+                 timeout: float = 0.5,
+                 recovery_timeout: float = 1.0) -> None:
+        """Create watchdog. Call "start()" to start watching.
+
+        Keyword arguments:
+        ftcamera --- Camera to watch
+        tracker --- Tracker of camera or None
+        timeout --- Seconds without frames after which the stream stalled
+        recovery_timeout --- Seconds to wait for frames after each stage
+        """
+        self.ftcamera = ftcamera
+        self.tracker = tracker
+        """Tracker of camera or None. Can be set later on."""
+        self.timeout = timeout
+        """Seconds without frames after which the stream stalled."""
+        self.recovery_timeout = recovery_timeout
+        """Seconds to wait for frames after each recovery stage."""
+        self.stats = StreamWatchdog.Stats()
+        """Statistics of stalls and recoveries."""
+        self._task: aio.Task = None
+        self._empty_frames = 0
+
+    def start(self: 'StreamWatchdog') -> None:
+        """Start watching if not watching."""
+        if not self._task:
+            self._task = aio.create_task(self._run())
+
+    async def stop(self: 'StreamWatchdog') -> None:
+        """Stop watching if watching. Waits for recovery to be cancelled."""
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except aio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self: 'StreamWatchdog') -> None:
+        """Task checking for stalls."""
+        while True:
+            await aio.sleep(self.timeout / 4.0)
+            ftcamera = self.ftcamera
+            if not ftcamera.is_reading or ftcamera.is_suspended\
+                    or ftcamera.last_frame_time is None:
+                continue
+            gap = time.monotonic() - ftcamera.last_frame_time
+            if gap < self.timeout:
+                self._empty_frames = ftcamera.empty_frames
+                continue
+            try:
+                await self._recover(gap)
+            except aio.CancelledError:
+                raise
+            except Exception:
+                StreamWatchdog._logger.error(traceback.format_exc())
+
+    async def _recover(self: 'StreamWatchdog', gap: float) -> None:
+        """Recover stalled stream.
+
+        Keyword arguments:
+        gap --- Seconds since the last frame arrived
+        """
+        ftcamera = self.ftcamera
+        if ftcamera.empty_frames > self._empty_frames:
+            reason = "empty frames for {:.0f}ms".format(gap * 1000.0)
+        else:
+            reason = "no frames for {:.0f}ms".format(gap * 1000.0)
+
+        stall = StreamWatchdog.Stall(reason, time.monotonic())
+        self.stats.stalls += 1
+        self.stats.history.append(stall)
+        StreamWatchdog._logger.warning("stream stalled: {}".format(reason))
+
+        for stage in StreamWatchdog.Stage:
+            if stage != StreamWatchdog.Stage.Reopen and not self.tracker:
+                continue
+            StreamWatchdog._logger.info("recover using: {}".format(
+                stage.value))
+            received = ftcamera.frames_received
+            try:
+                await self._run_stage(stage)
+            except aio.CancelledError:
+                raise
+            except Exception:
+                StreamWatchdog._logger.error(traceback.format_exc())
+                continue
+            if await self._wait_frame(received):
+                stall.stage = stage
+                self.stats.recovered[stage] += 1
+                break
+
+        now = time.monotonic()
+        stall.recovery_time = now - stall.detected
+        stall.downtime = stall.recovery_time + gap
+        self.stats.downtime += stall.downtime
+        if stall.stage:
+            StreamWatchdog._logger.info("stream recovered: {}".format(stall))
+        else:
+            self.stats.failed += 1
+            StreamWatchdog._logger.error("stream recovery failed: {}".format(
+                stall))
+            # start over after the timeout passed again
+            ftcamera.last_frame_time = now
+        self._empty_frames = ftcamera.empty_frames
+
+    async def _run_stage(self: 'StreamWatchdog',
+                         stage: 'StreamWatchdog.Stage') -> None:
+        """Run recovery stage.
+
+        Blocking tracker calls run in a worker thread to keep capturing.
+
+        Keyword arguments:
+        stage --- Stage to run
+        """
+        tracker = self.tracker
+        match stage:
+            case StreamWatchdog.Stage.RestartStream:
+                await aio.to_thread(tracker.restart_stream)
+            case StreamWatchdog.Stage.Activate:
+                await aio.to_thread(tracker.activate)
+            case StreamWatchdog.Stage.Reopen:
+                ftcamera = self.ftcamera
+                await ftcamera.close(keep_subscriptions=True)
+                ftcamera.open()
+                if tracker:
+                    if isLinux:
+                        tracker.attach(ftcamera.device.fileno())
+                    else:
+                        tracker.attach(ftcamera.device,
+                                       ftcamera.device_index)
+                    await aio.to_thread(tracker.activate)
+                ftcamera.start_read()
+
+    async def _wait_frame(self: 'StreamWatchdog', received: int) -> bool:
+        """Wait for a non-empty frame to arrive.
+
+        Returns True if a frame arrived within "recovery_timeout".
+
+        Keyword arguments:
+        received --- Number of frames received before the stage ran
+        """
+        end = time.monotonic() + self.recovery_timeout
+        while time.monotonic() < end:
+            if self.ftcamera.frames_received > received:
+                return True
+            await aio.sleep(0.01)
+        return False